@@ -25,4 +25,7 @@ setup(name='sosw',
       install_requires=[
           'boto3>=1.9'
       ],
+      extras_require={
+          'msgpack': ['msgpack']
+      },
       zip_safe=False)
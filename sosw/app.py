@@ -1,14 +1,19 @@
 __all__ = ['Processor']
 
 
-import boto3
+import hashlib
+import json
 import logging
 import os
+import threading
+import time
 
 from importlib import import_module
 from collections import defaultdict
+from typing import Optional, Tuple
 
 from sosw.components.benchmark import benchmark
+from sosw.components.boto3_clients import get_boto3_client
 from sosw.components.config import get_config
 from sosw.components.helpers import *
 
@@ -23,6 +28,92 @@ __status__ = "Production"
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+CLIENT_SUFFIXES = ['Manager', 'Client']
+
+CLIENT_IMPORT_PATHS = [
+    'components.{}',
+    'managers.{}',
+    'sosw.components.{}',
+    'sosw.managers.{}',
+]
+
+# Classes of clients resolved by `register_clients()`. Live for the lifetime of the container.
+_client_classes = {}
+_lazy_clients_lock = threading.RLock()
+
+# Processors created with `Processor.get_instance()` by class and fingerprint of arguments.
+_instances = {}
+_instances_lock = threading.Lock()
+
+
+def _resolve_client_class(service: str) -> Tuple[Optional[type], Optional[str]]:
+    """
+    Find the class of the client for the `service` in `CLIENT_IMPORT_PATHS`.
+
+    :return:    The class and its suffix. (None, None) if there is no such module and a boto3 client should be used.
+    :raises RuntimeError:   If the module is found, but has no class with any of `CLIENT_SUFFIXES`.
+    """
+
+    try:
+        return _client_classes[service]
+    except KeyError:
+        pass
+
+    module_name = camel_case_to_underscore(service)
+
+    for path in CLIENT_IMPORT_PATHS:
+        try:
+            some_module = import_module(path.format(module_name))
+            logger.debug(f"Imported {service} from {path.format(module_name)}")
+            break
+        except ImportError:
+            pass
+
+    else:
+        _client_classes[service] = None, None
+        return _client_classes[service]
+
+    for suffix in CLIENT_SUFFIXES:
+        some_class = getattr(some_module, f"{service}{suffix}", None)
+        if some_class is not None:
+            _client_classes[service] = some_class, suffix
+            return _client_classes[service]
+
+        logger.info(f"Failed suffix {suffix}")
+
+    raise RuntimeError(f"Failed to import {service} from {some_module}. Tried suffixes for class: {CLIENT_SUFFIXES}")
+
+
+class _LazyClient:
+    """
+    Class attribute of Processor that initializes the client registered with `register_clients(lazy=True)`
+    on the first access. Installed by `Processor._set_lazy_client()` only when some client is registered as lazy.
+    Instances without such lazy client get None, as from the usual `some_client = None`.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return None
+
+        with _lazy_clients_lock:
+            # Another thread could have initialized it while we were waiting for the lock.
+            if self.name in instance.__dict__:
+                return instance.__dict__[self.name]
+
+            lazy_clients = instance.__dict__.get('_lazy_clients', {})
+            if self.name not in lazy_clients:
+                return None
+
+            client = instance.__dict__[self.name] = lazy_clients[self.name]()
+            del lazy_clients[self.name]
+            logger.info(f"Successfully registered lazy {self.name}")
+
+        return client
+
 
 class Processor:
     """
@@ -54,12 +145,80 @@ class Processor:
         logger.info(f"Final {self.__class__.__name__} processor config: {self.config}")
 
         self.stats = defaultdict(int)
+        self._created_at = time.monotonic()
 
         self.register_clients(self.config.get('init_clients', []))
 
 
+    @classmethod
+    def get_instance(cls, custom_config=None, **kwargs):
+        """
+        Return the instance of the Processor for these arguments, shared between invocations of the warm container.
+        Call it from `lambda_handler` instead of initializing the Processor to skip fetching the config
+        and initializing clients on every invocation.
+
+        .. code-block:: python
+
+           def lambda_handler(event, context):
+               processor = Worker.get_instance(custom_config=event.get('config'))
+               processor(event)
+               return processor.get_stats()
+
+        A reused instance gets `reset_stats()` and `refresh()` before it is returned.
+        Once the instance is older than `config_ttl` seconds from its config (if specified), a new one is created
+        with the fresh config.
+
+        :param dict custom_config:  Custom config of the Processor.
+        :param kwargs:              Other arguments of the constructor.
+        """
+
+        fingerprint = hashlib.sha256(json.dumps([custom_config, kwargs], sort_keys=True, default=str).encode())
+        key = (cls, fingerprint.hexdigest())
+
+        with _instances_lock:
+            instance = _instances.get(key)
+
+            if instance is not None and instance.is_config_expired():
+                logger.info(f"Config of {cls.__name__} expired. Initializing a new instance.")
+                instance = None
+
+            if instance is None:
+                instance = _instances[key] = cls(custom_config=custom_config, **kwargs)
+                return instance
+
+        instance.reset_stats()
+        instance.refresh()
+        instance.stats['processor_reused'] += 1
+
+        return instance
+
+
+    @staticmethod
+    def clear_instances():
+        """ Forget the instances of all Processors created with `get_instance()`. """
+
+        with _instances_lock:
+            _instances.clear()
+
+
+    def is_config_expired(self) -> bool:
+        """ Check if the instance is older than `config_ttl` seconds from its config. Never expires by default. """
+
+        ttl = self.config.get('config_ttl')
+        return ttl is not None and time.monotonic() - self._created_at > ttl
+
+
+    def refresh(self):
+        """
+        Hook called when the instance is reused by `get_instance()` for the next invocation.
+        Override this to refresh the state that must not live between invocations. Does nothing by default.
+        """
+
+        pass
+
+
     @benchmark
-    def register_clients(self, clients):
+    def register_clients(self, clients, lazy: bool = None):
         """
         Initialize the given `clients` and assign them to self with suffix `_client`.
 
@@ -72,64 +231,83 @@ class Processor:
            If you follow these rules and put the module in package `components` of your Lambda,
            you can just provide the `clients` in custom_config when initializing the Processor.
 
+        The resolved classes are cached for the lifetime of the container, so the imports are tried only once.
+
+        With `lazy` clients are only registered here and initialized on the first access to the attribute.
+        This saves the cold start time of Processors that need some clients only in some invocations.
+        Note that the lazy clients are not in the stats of the Processor until they are initialized.
+
         TODO This method supports a too many ways of class initialization for backwards compatibility
         that it becomes a mess soon. Need to describe best practices and start deprecation in future versions.
 
         :param list clients:    List of names of clients.
+        :param bool lazy:       Initialize clients on the first access. Default: `lazy_clients` from config or False.
         """
 
-        client_suffixes = ['Manager', 'Client']
+        if lazy is None:
+            lazy = self.config.get('lazy_clients', False)
 
-        import_paths = [
-            lambda x: f"components.{x}",
-            lambda x: f"managers.{x}",
-            lambda x: f"sosw.components.{x}",
-            lambda x: f"sosw.managers.{x}",
-        ]
-
-        # # Initialize required clients
         for service in clients:
             module_name = camel_case_to_underscore(service)
+            name = f"{module_name}_client"
 
-            for path in import_paths:
-                try:
-                    some_module = import_module(path(module_name))
-                    logger.debug(f"Imported {service} from {path(module_name)}")
-                    break
-                except:
-                    pass
+            if lazy and self._set_lazy_client(name, lambda service=service: self._init_client(service)):
+                logger.debug(f"Registered lazy {name}")
+                continue
 
-            else:
-                # The other supported option is to load boto3 client if it exists.
-                try:
-                    setattr(self, f"{module_name}_client", boto3.client(module_name))
-                    continue
-                except:
-                    raise RuntimeError(f"Failed to import for service {module_name}. Component naming problem.")
+            setattr(self, name, self._init_client(service))
+            logger.info(f"Successfully registered {name}")
 
-            for suffix in client_suffixes:
-                try:
-                    some_class = getattr(some_module, f"{service}{suffix}")
-                    some_client_config = self.config.get(f"{module_name}_config")
-                    logger.debug(f"Found config for {module_name}: {some_client_config}")
-
-                    # Send configs one of the two ways as `config` or `custom_config` for some backwards compatibility
-                    if some_client_config:
-                        if suffix == 'Manager':
-                            setattr(self, f"{module_name}_client", some_class(custom_config=some_client_config))
-                        elif suffix == 'Client':
-                            setattr(self, f"{module_name}_client", some_class(config=some_client_config))
-
-                    else:
-                        setattr(self, f"{module_name}_client", some_class())
-                    logger.info(f"Successfully registered {module_name}_client")
-                    break
-                except AttributeError:
-                    logger.info(f"Failed suffix {suffix}")
-                    pass
-            else:
-                raise RuntimeError(f"Failed to import {service} from {some_module}. "
-                                   f"Tried suffixes for class: {client_suffixes}")
+
+    def _init_client(self, service: str):
+        """
+        Initialize the client for `service` as described in `register_clients()`.
+        """
+
+        module_name = camel_case_to_underscore(service)
+        some_class, suffix = _resolve_client_class(service)
+
+        # The other supported option is to load boto3 client if it exists.
+        if some_class is None:
+            try:
+                return get_boto3_client(module_name)
+            except Exception:
+                raise RuntimeError(f"Failed to import for service {module_name}. Component naming problem.")
+
+        some_client_config = self.config.get(f"{module_name}_config")
+        logger.debug(f"Found config for {module_name}: {some_client_config}")
+
+        # Send configs one of the two ways as `config` or `custom_config` for some backwards compatibility
+        if some_client_config:
+            if suffix == 'Manager':
+                return some_class(custom_config=some_client_config)
+            elif suffix == 'Client':
+                return some_class(config=some_client_config)
+
+        return some_class()
+
+
+    def _set_lazy_client(self, name: str, factory) -> bool:
+        """
+        Make `factory` initialize the attribute `name` of self on the first access.
+        The class attribute with this `name` (if any) must be None, otherwise lazy initialization is impossible.
+        It is replaced with a `_LazyClient` in the class of self. The registered factories are kept per instance.
+
+        :return:    True if the client was registered as lazy.
+        """
+
+        cls = type(self)
+        existing = next((klass.__dict__[name] for klass in cls.__mro__ if name in klass.__dict__), None)
+        if existing is not None and not isinstance(existing, _LazyClient):
+            return False
+
+        with _lazy_clients_lock:
+            if not isinstance(cls.__dict__.get(name), _LazyClient):
+                setattr(cls, name, _LazyClient(name))
+
+        self.__dict__.pop(name, None)
+        self.__dict__.setdefault('_lazy_clients', {})[name] = factory
+        return True
 
 
     def __call__(self, event):
@@ -175,7 +353,7 @@ class Processor:
             try:
                 self.aws_account = self.config['aws_account']
             except KeyError:
-                self.aws_account = boto3.client('sts').get_caller_identity().get('Account')
+                self.aws_account = get_boto3_client('sts').get_caller_identity().get('Account')
 
         return self.aws_account
 
@@ -215,7 +393,7 @@ class Processor:
         """
 
         if recursive:
-            for some_client in [x for x in dir(self) if x.endswith('_client')]:
+            for some_client in self._get_initialized_client_names():
                 try:
                     self.stats.update(getattr(self, some_client).get_stats())
                     logger.info(f"Updated Processor stats with stats of {some_client}")
@@ -225,6 +403,13 @@ class Processor:
         return self.stats
 
 
+    def _get_initialized_client_names(self):
+        """ Names of the `*_client` attributes except the lazy clients that are not initialized yet. """
+
+        lazy_clients = self.__dict__.get('_lazy_clients', {})
+        return [x for x in dir(self) if x.endswith('_client') and x not in lazy_clients]
+
+
     def reset_stats(self, recursive: bool = True):
         """
         Cleans statistics other than specified for the lifetime of processor.
@@ -260,7 +445,7 @@ class Processor:
         self.stats.update(preserved)
 
         if recursive:
-            for some_client in [x for x in dir(self) if x.endswith('_client')]:
+            for some_client in self._get_initialized_client_names():
                 try:
                     getattr(self, some_client).reset_stats()
                 except:
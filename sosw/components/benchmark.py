@@ -1,14 +1,22 @@
-__all__ = ['benchmark']
+__all__ = ['benchmark', 'LatencyHistogram']
 __author__ = "Nikolay Grishchenko"
 __version__ = "1.0"
 
+import math
+import threading
 import time
 
+from collections import defaultdict
+
+
+_benchmark_lock = threading.Lock()
+
 
 def benchmark(fn):
     """
     Decorator that should be used on class methods that you want to benchmark.
     It will aggregate to `self.stats` of the class timing of decorated functions.
+    The methods may be called from several threads, so the stats are updated under a lock.
 
     | `fn` - pointer to class function. Class is not yet initialized.
     | `self` - pointer to class instance. Passed during the call of decorated method.
@@ -18,8 +26,70 @@ def benchmark(fn):
     def _timing(self, *a, **kw):
         st = time.perf_counter()
         r = fn(self, *a, **kw)
-        self.stats[f"time_{fn.__name__}"] += time.perf_counter() - st
+        with _benchmark_lock:
+            self.stats[f"time_{fn.__name__}"] += time.perf_counter() - st
         return r
 
 
     return _timing
+
+
+class LatencyHistogram:
+    """
+    Histogram of durations with logarithmic buckets. Memory is bounded by the number of buckets, not the number
+    of observations, so it is safe for long-living objects. Percentiles are approximate: the upper bound
+    of the bucket is returned, the relative error is less than `precision`.
+
+    :param float precision:     Relative width of the bucket. Default 5%.
+    :param float min_value:     Values below this go to the first bucket. In seconds. Default 0.1 ms.
+    """
+
+    def __init__(self, precision: float = 0.05, min_value: float = 0.0001):
+        self.ratio = 1 + precision
+        self.min_value = min_value
+        self.buckets = defaultdict(int)
+        self.count = 0
+        self._lock = threading.Lock()
+
+
+    def get_bucket(self, value: float) -> int:
+        """ Index of the bucket for `value`. Buckets may be stored externally, e.g. as counters in DynamoDB. """
+
+        return int(math.log(value / self.min_value, self.ratio)) + 1 if value > self.min_value else 0
+
+
+    def add(self, value: float, count: float = 1):
+        bucket = self.get_bucket(value)
+        with self._lock:
+            self.buckets[bucket] += count
+            self.count += count
+
+
+    def add_buckets(self, buckets: dict):
+        """ Merge the counters of `buckets` (index: count) to the histogram. """
+
+        with self._lock:
+            for bucket, count in buckets.items():
+                self.buckets[bucket] += count
+                self.count += count
+
+
+    def percentile(self, p: float) -> float:
+        """
+        :param float p:     Percentile in range [0, 100].
+        :return:            Approximate value of the percentile or 0 if there are no observations.
+        """
+
+        with self._lock:
+            if not self.count:
+                return 0.0
+
+            rank = max(1, math.ceil(self.count * p / 100))
+            seen = 0
+            for bucket in sorted(self.buckets):
+                seen += self.buckets[bucket]
+                if seen >= rank:
+                    return self.min_value * self.ratio ** bucket
+
+            # Counts may be fractional (e.g. decayed), so their sum can fall short of the rank due to rounding.
+            return self.min_value * self.ratio ** max(self.buckets)
@@ -0,0 +1,123 @@
+"""
+Process-wide registry of boto3 clients.
+
+Every component of sosw used to create its own boto3 client, so a warm Lambda container with a Processor holding
+several managers kept many separate HTTP connection pools and paid for the TLS handshakes of each of them.
+The registry hands out one client per (service, region, configuration). boto3 clients are thread-safe, so the same
+client is shared by all the components, threads and warm invocations of the container.
+
+.. code-block:: python
+
+    dynamodb = get_boto3_client('dynamodb')
+    assert dynamodb is get_boto3_client('dynamodb')
+
+    # Bigger pool for a highly concurrent component. This is a different client.
+    dynamodb_pool = get_boto3_client('dynamodb', max_pool_connections=100)
+
+Arguments that are not passed take the values of environment variables. If neither is set, the defaults
+of botocore apply (e.g. the 'legacy' retry mode with its per-service number of attempts).
+TCP keep-alive and retry modes require a recent botocore. With older versions these settings are ignored
+with a warning.
+
+- ``SOSW_BOTO3_MAX_POOL_CONNECTIONS`` - Size of the HTTP connection pool of each client.
+- ``SOSW_BOTO3_TCP_KEEPALIVE`` - Enable TCP keep-alive for the connections: 'True' or 'False'.
+- ``SOSW_BOTO3_RETRY_MODE`` - Retry mode of botocore: 'legacy', 'standard' or 'adaptive'.
+- ``SOSW_BOTO3_MAX_ATTEMPTS`` - Total number of attempts of a call including the first one.
+
+In unit tests that patch ``boto3.client``, call `reset_boto3_clients()` in `setUp()` and `tearDown()`,
+so that the clients created before or inside the patch do not leak to other tests.
+"""
+
+__all__ = ['get_boto3_client', 'reset_boto3_clients']
+__author__ = "Nikolay Grishchenko"
+__version__ = "1.0"
+
+import boto3
+import importlib.util
+import logging
+import os
+import threading
+
+from botocore.config import Config
+from typing import Optional
+
+
+logger = logging.getLogger()
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+# Some settings need a newer botocore than the minimal boto3 supported by sosw. Retry modes were introduced
+# together with the `botocore.retries` package.
+_UNSUPPORTED_SETTINGS = {name for name, supported in (
+    ('tcp_keepalive', 'tcp_keepalive' in getattr(Config, 'OPTION_DEFAULTS', {})),
+    ('retry_mode', importlib.util.find_spec('botocore.retries') is not None),
+) if not supported}
+
+
+def _get_defaults() -> dict:
+    """ Settings from environment variables. Only the variables that are set. """
+
+    result = {}
+    converters = {
+        'max_pool_connections': ('SOSW_BOTO3_MAX_POOL_CONNECTIONS', int),
+        'tcp_keepalive':        ('SOSW_BOTO3_TCP_KEEPALIVE', lambda x: x == 'True'),
+        'retry_mode':           ('SOSW_BOTO3_RETRY_MODE', str),
+        'max_attempts':         ('SOSW_BOTO3_MAX_ATTEMPTS', int),
+    }
+
+    for name, (variable, convert) in converters.items():
+        if os.environ.get(variable):
+            result[name] = convert(os.environ[variable])
+
+    return result
+
+
+def get_boto3_client(service: str, region_name: Optional[str] = None, max_pool_connections: Optional[int] = None,
+                     tcp_keepalive: Optional[bool] = None, retry_mode: Optional[str] = None,
+                     max_attempts: Optional[int] = None):
+    """
+    Return the boto3 client for the `service` shared by all the callers in this process with the same arguments.
+    Arguments not provided take the values from environment described in the module, or the defaults of botocore.
+
+    :param str service:                 Name of AWS service. E.g. 'dynamodb'.
+    :param str region_name:             AWS region. Default: the region of boto3 (from environment).
+    :param int max_pool_connections:    Size of the HTTP connection pool.
+    :param bool tcp_keepalive:          Enable TCP keep-alive.
+    :param str retry_mode:              'legacy', 'standard' or 'adaptive'.
+    :param int max_attempts:            Total number of attempts of a call including the first one.
+    """
+
+    settings = _get_defaults()
+    for name, value in (('max_pool_connections', max_pool_connections), ('tcp_keepalive', tcp_keepalive),
+                        ('retry_mode', retry_mode), ('max_attempts', max_attempts)):
+        if value is not None:
+            settings[name] = value
+
+    for name in _UNSUPPORTED_SETTINGS.intersection(settings):
+        logger.warning(f"Setting {name}={settings.pop(name)} of boto3 clients is not supported by the installed "
+                       f"botocore. Ignoring it. Upgrade boto3 to use it.")
+
+    key = (service, region_name, tuple(sorted(settings.items())))
+
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            config_args = {k: v for k, v in settings.items() if k in ('max_pool_connections', 'tcp_keepalive')}
+
+            retries = {k: settings[name] for k, name in (('mode', 'retry_mode'), ('max_attempts', 'max_attempts'))
+                       if name in settings}
+            if retries:
+                config_args['retries'] = retries
+
+            client = _clients[key] = boto3.client(service, region_name=region_name, config=Config(**config_args))
+            logger.debug(f"Created shared boto3 client for {service} in region {region_name} with {settings}")
+
+    return client
+
+
+def reset_boto3_clients():
+    """ Forget all the shared clients. Next calls of `get_boto3_client()` create new ones. """
+
+    with _clients_lock:
+        _clients.clear()
@@ -0,0 +1,97 @@
+"""
+Simple in-memory caches for components. The caches are thread-safe and live as long as the object holding them,
+so if you keep them in the global scope of the Lambda they also survive between warm invocations.
+"""
+
+__all__ = ['TTLCache']
+__author__ = "Nikolay Grishchenko"
+__version__ = "1.0"
+
+import threading
+import time
+
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+
+class TTLCache:
+    """
+    Size-bounded LRU cache with expiration of values.
+
+    .. code-block:: python
+
+        cache = TTLCache(max_size=100, ttl=60)
+        cache.set('key', 'value')
+        cache.get('key')  # 'value' during the next 60 seconds.
+
+    :param int max_size:    Maximum number of values to keep. The least recently used are evicted first.
+    :param float ttl:       Default time to live of values in seconds. `None` - values never expire.
+    """
+
+    def __init__(self, max_size: int = 128, ttl: Optional[float] = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.RLock()
+
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """ Return the value of `key` if it is cached and not yet expired. Else - `default`. """
+
+        with self._lock:
+            try:
+                expires_at, value = self._data[key]
+            except KeyError:
+                return default
+
+            if expires_at is not None and expires_at <= time.time():
+                del self._data[key]
+                return default
+
+            self._data.move_to_end(key)
+            return value
+
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        """ Cache the `value`. Custom `ttl` overwrites the default one of the cache. """
+
+        ttl = ttl if ttl is not None else self.ttl
+
+        with self._lock:
+            self._data[key] = (time.time() + ttl if ttl is not None else None, value)
+            self._data.move_to_end(key)
+
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+
+    def get_or_set(self, key: Hashable, fn: Callable[[], Any], ttl: Optional[float] = None) -> Any:
+        """ Return the cached value of `key` or call `fn()` and cache the result. """
+
+        missing = object()
+        value = self.get(key, missing)
+        if value is missing:
+            value = fn()
+            self.set(key, value, ttl=ttl)
+        return value
+
+
+    def invalidate(self, key: Hashable):
+        """ Remove `key` from the cache if it exists. """
+
+        with self._lock:
+            self._data.pop(key, None)
+
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+    def __contains__(self, key: Hashable) -> bool:
+        missing = object()
+        return self.get(key, missing) is not missing
+
+
+    def __len__(self) -> int:
+        return len(self._data)
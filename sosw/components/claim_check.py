@@ -0,0 +1,185 @@
+"""
+Claim-check storage for payloads that are too large to keep in DynamoDB items or pass to Lambda invocations.
+
+The payload is saved as JSON under the key derived from the hash of its content, and the caller keeps only
+a small pointer: ``{'sosw_claim_check': 's3://bucket/prefix/<sha256>.json'}``.
+The same payload is always saved to the same key, so retries do not create duplicates.
+
+Supported stores:
+
+- ``s3://bucket/prefix`` - AWS S3
+- ``file:///some/local/dir`` - Local filesystem. Use it for tests.
+
+.. code-block:: python
+
+    store = get_claim_check_store('s3://my-bucket/sosw/payloads')
+    pointer = store.put({'huge': 'payload'})  # {'sosw_claim_check': 's3://my-bucket/sosw/payloads/1f2...json'}
+
+    # Somewhere else (e.g. in the Worker). The store is identified from the pointer itself.
+    payload = resolve_claim_check(pointer)  # {'huge': 'payload'}
+"""
+
+__all__ = ['CLAIM_CHECK_FIELD', 'ClaimCheckStore', 'S3ClaimCheckStore', 'LocalClaimCheckStore',
+           'get_claim_check_store', 'is_claim_check', 'resolve_claim_check']
+__author__ = "Nikolay Grishchenko"
+__version__ = "1.0"
+
+import hashlib
+import json
+import logging
+import os
+
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Optional
+from urllib.parse import ParseResult, urlparse
+
+from sosw.components.boto3_clients import get_boto3_client
+from sosw.components.helpers import write_file_atomically
+
+
+logger = logging.getLogger()
+
+CLAIM_CHECK_FIELD = 'sosw_claim_check'
+
+
+class ClaimCheckStore(ABC):
+    """
+    Base class of stores. Children implement `_write()` of raw bytes by the key and `_read()` by parsed URI.
+    """
+
+    scheme = None
+
+
+    def __init__(self, location: str, prefix: str = ''):
+        self.location = location
+        self.prefix = prefix.strip('/')
+
+
+    @staticmethod
+    def serialize(payload: Any) -> bytes:
+        """ The JSON of `payload` exactly as it is saved by `put()`. """
+
+        return json.dumps(payload, sort_keys=True, separators=(',', ':')).encode()
+
+
+    def put(self, payload: Any, data: Optional[bytes] = None) -> Dict:
+        """
+        Save the JSON-serializable `payload`.
+
+        :param payload:     The payload to save.
+        :param bytes data:  The result of `serialize(payload)` if the caller already has it. E.g. to check the size.
+        :return:            Pointer to the payload to keep instead of it.
+        """
+
+        if data is None:
+            data = self.serialize(payload)
+
+        name = f"{hashlib.sha256(data).hexdigest()}.json"
+        key = f"{self.prefix}/{name}" if self.prefix else name
+
+        self._write(key, data)
+        logger.debug(f"Saved payload of {len(data)} bytes to claim check {key}")
+
+        return {CLAIM_CHECK_FIELD: f"{self.scheme}://{self.location}/{key}"}
+
+
+    def get(self, pointer: Dict) -> Any:
+        """ Load the payload by the `pointer` returned from `put()`. """
+
+        return json.loads(self._read(urlparse(pointer[CLAIM_CHECK_FIELD])))
+
+
+    @abstractmethod
+    def _write(self, key: str, data: bytes):
+        pass
+
+
+    @abstractmethod
+    def _read(self, uri: ParseResult) -> bytes:
+        pass
+
+
+class S3ClaimCheckStore(ClaimCheckStore):
+
+    scheme = 's3'
+
+
+    def __init__(self, location: str, prefix: str = ''):
+        super().__init__(location, prefix)
+        self._s3_client = None
+
+
+    @property
+    def s3_client(self):
+        if self._s3_client is None:
+            self._s3_client = get_boto3_client('s3')
+        return self._s3_client
+
+
+    def _write(self, key: str, data: bytes):
+        self.s3_client.put_object(Bucket=self.location, Key=key, Body=data, ContentType='application/json')
+
+
+    def _read(self, uri: ParseResult) -> bytes:
+        return self.s3_client.get_object(Bucket=uri.netloc, Key=uri.path.lstrip('/'))['Body'].read()
+
+
+class LocalClaimCheckStore(ClaimCheckStore):
+    """ Keeps the payloads in a local directory. `location` is the absolute path to it. """
+
+    scheme = 'file'
+
+
+    def _write(self, key: str, data: bytes):
+        write_file_atomically(os.path.join(self.location, key), data)
+
+
+    def _read(self, uri: ParseResult) -> bytes:
+        with open(uri.path, 'rb') as f:
+            return f.read()
+
+
+_STORES = {
+    S3ClaimCheckStore.scheme:    S3ClaimCheckStore,
+    LocalClaimCheckStore.scheme: LocalClaimCheckStore,
+}
+
+
+def get_claim_check_store(uri: str) -> ClaimCheckStore:
+    """
+    :param str uri:     Location of the store. E.g. 's3://bucket/prefix' or 'file:///tmp/payloads'.
+    """
+
+    parsed = urlparse(uri)
+    try:
+        store_class = _STORES[parsed.scheme]
+    except KeyError:
+        raise ValueError(f"Unsupported claim check store: {uri}. Supported schemes: {', '.join(_STORES)}")
+
+    if parsed.scheme == LocalClaimCheckStore.scheme:
+        return store_class(parsed.path.rstrip('/') or '/')
+
+    return store_class(parsed.netloc, parsed.path)
+
+
+def is_claim_check(payload: Any) -> bool:
+    return isinstance(payload, dict) and CLAIM_CHECK_FIELD in payload
+
+
+def resolve_claim_check(payload: Any) -> Any:
+    """
+    Return the original payload if `payload` is a claim check pointer, otherwise the `payload` itself.
+    Other fields of the `payload` (e.g. `task_id` added to the event of the Worker) are merged to the result.
+    """
+
+    if not is_claim_check(payload):
+        return payload
+
+    uri = urlparse(payload[CLAIM_CHECK_FIELD])
+    result = get_claim_check_store(f"{uri.scheme}://{uri.netloc}/").get(payload)
+
+    other_fields = {k: v for k, v in payload.items() if k != CLAIM_CHECK_FIELD}
+    if other_fields and isinstance(result, dict):
+        result.update(other_fields)
+
+    return result
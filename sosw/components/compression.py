@@ -0,0 +1,75 @@
+"""
+Compact binary encoding of large values (e.g. payloads of tasks) for storage in DynamoDB Binary attributes.
+
+The value is serialized with msgpack (if installed) or JSON and compressed with zlib. The result starts
+with a format marker, so it can be decoded without knowing how it was encoded.
+"""
+
+__all__ = ['pack', 'unpack', 'is_packed']
+__author__ = "Nikolay Grishchenko"
+__version__ = "1.0"
+
+import json
+import zlib
+
+from typing import Any, Optional
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+MARKER_JSON = b'zj1'
+MARKER_MSGPACK = b'zm1'
+MARKER_LENGTH = 3
+
+
+def pack(value: Any, threshold: int = 0, use_msgpack: Optional[bool] = None, level: int = 6) -> Optional[bytes]:
+    """
+    Serialize and compress the `value`.
+
+    :param value:               JSON-serializable value.
+    :param int threshold:       Return None if the serialized value is shorter than this number of bytes.
+                                Compressing small values is not worth the CPU.
+    :param bool use_msgpack:    Serialize with msgpack. Default: if msgpack is installed.
+    :param int level:           Compression level of zlib from 1 (fastest) to 9 (smallest).
+    :return:                    Marker + compressed bytes or None.
+    """
+
+    if use_msgpack is None:
+        use_msgpack = msgpack is not None
+
+    if use_msgpack:
+        if msgpack is None:
+            raise RuntimeError("msgpack is not installed. Install it or set use_msgpack=False.")
+        marker, data = MARKER_MSGPACK, msgpack.packb(value, use_bin_type=True)
+    else:
+        marker, data = MARKER_JSON, json.dumps(value, separators=(',', ':')).encode()
+
+    if len(data) < threshold:
+        return None
+
+    return marker + zlib.compress(data, level)
+
+
+def unpack(data: bytes) -> Any:
+    """
+    Decompress and deserialize the value created with `pack()`.
+
+    :raises ValueError:     If `data` doesn't start with a known format marker.
+    """
+
+    if not is_packed(data):
+        raise ValueError(f"Unknown format marker of packed value: {bytes(data[:MARKER_LENGTH])}")
+
+    if bytes(data[:MARKER_LENGTH]) == MARKER_JSON:
+        return json.loads(zlib.decompress(data[MARKER_LENGTH:]))
+
+    if msgpack is None:
+        raise RuntimeError("The value is packed with msgpack, but msgpack is not installed.")
+    return msgpack.unpackb(zlib.decompress(data[MARKER_LENGTH:]), raw=False)
+
+
+def is_packed(data: Any) -> bool:
+    return isinstance(data, (bytes, bytearray)) and bytes(data[:MARKER_LENGTH]) in (MARKER_JSON, MARKER_MSGPACK)
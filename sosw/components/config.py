@@ -6,24 +6,44 @@ Especially SSMConfig, because SSM throttles and has limits we reached in the pas
 Using these methods requires the Role to have permissions to access SSM and/or Dynamo for requested resources.
 """
 
-__all__ = ['ConfigSource', 'get_config', 'update_config', 'get_credentials_by_prefix']
+__all__ = ['ConfigSource', 'get_config', 'get_configs', 'update_config', 'get_credentials_by_prefix']
 __author__ = "Sophie Fogel, Nikolay Grishchenko"
 __version__ = "1.7.1"
 
-import boto3
+import botocore.exceptions
+import hashlib
 import json
 import logging
 import os
+import random
+import threading
+import time
 
-from sosw.components.helpers import chunks
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+from sosw.components.boto3_clients import get_boto3_client
+from sosw.components.helpers import chunks, write_file_atomically
 from sosw.components.dynamo_db import DynamoDbClient
 
 
+logger = logging.getLogger()
+
+
 class SSMConfig:
     """
     Methods to access some configurations and/or credentials stored in AWS SSM ParameterStore.
     Please note that SSM has a pretty low limit of concurrent calls and it THROTTLES.
     For high load Lambdas it is recommended to use DynamoConfig instead.
+
+    Throttled calls are retried with jittered exponential backoff. Optional config:
+
+    .. code-block:: python
+
+        {
+            'max_workers': 4,  # Number of threads to fetch chunks of parameters in `get_credentials_by_prefix()`.
+            'throttle_max_retries': 5,  # Retry throttled calls this many times before raising.
+        }
     """
 
     ssm_client = None
@@ -36,15 +56,42 @@ class SSMConfig:
         if not self.test:
             self.test = True if os.environ.get('STAGE') == 'test' or os.environ.get('autotest') == 'True' else False
 
+        self.config = kwargs.get('config') or {}
+
 
     def _get_ssm_client(self):
 
         if self.ssm_client is None:
-            self.ssm_client = boto3.client('ssm')
+            self.ssm_client = get_boto3_client('ssm')
 
         return self.ssm_client
 
 
+    def _call_ssm(self, operation: str, **kwargs):
+        """
+        Call the `operation` of SSM client. Throttled calls are retried with jittered exponential backoff
+        up to `throttle_max_retries` times.
+        """
+
+        func = getattr(self._get_ssm_client(), operation)
+
+        retry_num = 0
+        while True:
+            try:
+                return func(**kwargs)
+            except botocore.exceptions.ClientError as err:
+                if err.response.get('Error', {}).get('Code') != 'ThrottlingException':
+                    raise
+
+                if retry_num >= self.config.get('throttle_max_retries', 5):
+                    raise
+
+                wait_time = random.uniform(0, 0.1 * 2 ** retry_num)
+                logger.info(f"SSM.{operation}() throttled. Retry #{retry_num + 1} in {wait_time:.3f} seconds")
+                time.sleep(wait_time)
+                retry_num += 1
+
+
     def get_config(self, name):
         """
         Retrieve the Config from AWS SSM ParameterStore and return as a JSON parsed dictionary.
@@ -54,18 +101,10 @@ class SSMConfig:
         :return:            Config of some Controller
         """
 
-        ssm_client = self._get_ssm_client()
-
         try:
-            response = ssm_client.get_parameters(
-                    Names=[name],
-                    WithDecryption=True
-            )
+            response = self._call_ssm('get_parameters', Names=[name], WithDecryption=True)
         except:
-            response = ssm_client.get_parameters(
-                    Names=[name],
-                    WithDecryption=False
-            )
+            response = self._call_ssm('get_parameters', Names=[name], WithDecryption=False)
 
         try:
             config = json.loads(response['Parameters'][0]['Value'])
@@ -75,6 +114,34 @@ class SSMConfig:
         return config
 
 
+    def get_configs(self, names: List[str]) -> Dict:
+        """
+        Retrieve many configs from AWS SSM ParameterStore with `get_parameters` calls of 10 names (the limit of SSM).
+
+        :param list names:  Names of configs to extract
+        :return:            Configs by name. Empty dict for missing or not JSON configs, same as in `get_config()`.
+        """
+
+        result = {name: {} for name in names}
+        for chunk_of_names in chunks(list(result), 10):
+            try:
+                response = self._call_ssm('get_parameters', Names=chunk_of_names, WithDecryption=True)
+            except botocore.exceptions.ClientError as err:
+                # E.g. no permission to decrypt. Throttling was already retried in `_call_ssm()`, so don't hide it.
+                if err.response.get('Error', {}).get('Code') == 'ThrottlingException':
+                    raise
+                logger.warning(f"Failed to get decrypted parameters {chunk_of_names}, trying without decryption: {err}")
+                response = self._call_ssm('get_parameters', Names=chunk_of_names, WithDecryption=False)
+
+            for param in response.get('Parameters', []):
+                try:
+                    result[param['Name']] = json.loads(param['Value'])
+                except (KeyError, TypeError, ValueError):
+                    pass
+
+        return result
+
+
     def update_config(self, name, val, **kwargs):
         """
         Update a parameter in SSM ParameterStore with a new value.
@@ -104,6 +171,7 @@ class SSMConfig:
     def call_boto_with_pagination(self, f, **kwargs):
         """
         Invoke SSM functions with the ability to paginate results.
+        Pages are fetched one by one with `NextToken`, so each of them is retried if throttled.
 
         :param str f:           SSM function to invoke.
         :param object kwargs:   Keyword arguments for the function to invoke.
@@ -111,26 +179,14 @@ class SSMConfig:
         :return:                List of paginated responses.
         """
 
-        ssm_client = self._get_ssm_client()
-
-        func = getattr(ssm_client, f)
-        can_paginate = getattr(ssm_client, 'can_paginate')(f)
-
-        if can_paginate:
-            logging.debug(f"'SSM.{f}()' can natively paginate")
-            paginator = ssm_client.get_paginator(f)
-            response = paginator.paginate(**kwargs)
-            return list(response)
-
-        else:
-            logging.debug(f"'SSM.{f}()' can not natively paginate")
-            response_list = []
-            response = func(**kwargs)
+        response_list = []
+        response = self._call_ssm(f, **kwargs)
+        response_list.append(response)
+        while response.get('NextToken'):
+            kwargs['NextToken'] = response['NextToken']
+            response = self._call_ssm(f, **kwargs)
             response_list.append(response)
-            while 'NextToken' in response:
-                kwargs['NextToken'] = response['NextToken']
-                response_list.append(func(**kwargs))
-            return response_list
+        return response_list
 
 
     def get_credentials_by_prefix(self, prefix):
@@ -169,15 +225,20 @@ class SSMConfig:
         # Anyway you should encrypt everything.
         decryption_required = any([True for param in params if param['Type'] == 'SecureString'])
 
-        result = dict()
-        for chunk_of_names in chunks(names, 10):
+        def get_chunk(chunk_of_names):
             get_params_response = self.call_boto_with_pagination('get_parameters', Names=chunk_of_names,
                                                                  WithDecryption=decryption_required)
             logging.debug(f"SSM.get_parameters(names={chunk_of_names}) received response: {get_params_response}")
+            return [param for obj in get_params_response for param in obj['Parameters']]
+
+        # Chunks are fetched concurrently, but SSM throttles, so the pool is small.
+        chunks_of_names = list(chunks(names, 10))
+        max_workers = min(len(chunks_of_names), self.config.get('max_workers', 4))
 
-            # Update keys and values from this page of response to result. Removes the prefix away for keys.
-            params = [param for obj in get_params_response for param in obj['Parameters']]
-            if params:
+        result = dict()
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for params in executor.map(get_chunk, chunks_of_names):
+                # Update keys and values from this chunk to result. Removes the prefix away for keys.
                 result.update(dict([(x['Name'].replace(prefix, ''), x['Value'] if x['Value'] != 'None' else None)
                                     for x in params]))
 
@@ -231,6 +292,32 @@ class DynamoConfig:
         item = items[0] if items else None
         config_value = item.get('config_value') if item else None
 
+        return self._parse_config_value(config_value)
+
+
+    def get_configs(self, names: List[str], env="production") -> Dict:
+        """
+        Retrieve many configs from DynamoDB 'config' table with BatchGetItem.
+
+        :param list names:  Names of configs to extract
+        :param str env:     Environment the variables belong to: 'production' or 'dev'
+        :return:            Configs by name. Values are the same as from `get_config()`.
+        """
+
+        dynamo_client = self._get_dynamo_client()
+        if os.environ.get('STAGE') == 'test' or os.environ.get('autotest') == 'True':
+            dynamo_client.config['table_name'] = 'autotest_config'
+
+        result = {name: {} for name in names}
+        items = dynamo_client.batch_get_items_one_table([{'env': env, 'config_name': name} for name in result])
+        for item in items:
+            result[item['config_name']] = self._parse_config_value(item.get('config_value'))
+
+        return result
+
+
+    @staticmethod
+    def _parse_config_value(config_value):
         try:
             return json.loads(config_value)
         except:
@@ -299,9 +386,27 @@ class ConfigSource:
 
     :param dict config:     Custom configurations for clients. Should be in `ssm_config`, `dynamo_config`, etc.
                             Don't be confused, but sometimes configs also need their own configs. :)
+
+    Configs received with `get_config()` and `get_configs()` can be cached. Settings are also in the `config`:
+
+    .. code-block:: python
+
+        {
+            'cache_ttl': 60,  # Seconds to keep configs in memory. Disabled if not set.
+            'cache_ttls': {'some_config': 600},  # Custom TTL for some names of configs.
+            'cache_dir': '/tmp/sosw_config',  # Also keep configs on disk to survive restarts of the container.
+            'cache_credentials_on_disk': False,  # Save credentials to `cache_dir` as well. They are not encrypted!
+        }
+
+    Credentials from `get_credentials_by_prefix()` are cached the same way, but only in memory
+    unless `cache_credentials_on_disk` is set.
+
+    If the config source fails, the expired cached value (if any) is returned instead of raising.
+    Only JSON-serializable configs are cached.
     """
 
     SUPPORTED_SOURCES = ('Dynamo', 'SSM')
+    CREDENTIALS_CACHE_PREFIX = 'credentials_by_prefix:'
 
 
     def __init__(self, test=False, sources=None, config=None):
@@ -324,6 +429,9 @@ class ConfigSource:
         self.config = {}
         self.config.update(config or {})
 
+        self._cache = {}
+        self._cache_lock = threading.Lock()
+
         self.default_source = None
         for source in sources:
 
@@ -341,22 +449,191 @@ class ConfigSource:
                 logging.info(f"Initialized default_source = {source.lower()}_config")
 
 
-    def get_config(self, name):
-        return self.default_source.get_config(name)
+    def get_config(self, name, ttl: Optional[float] = None):
+        """
+        Get the config from the default source or from the cache.
+
+        :param str name:    Name of config to extract
+        :param float ttl:   Custom time to live of the cached config in seconds.
+        """
+
+        return self.get_configs([name], ttl=ttl)[name]
+
+
+    def get_configs(self, names: List[str], ttl: Optional[float] = None) -> Dict:
+        """
+        Get many configs. Those not found in the cache are fetched from the default source in one batch.
+
+        :param list names:  Names of configs to extract
+        :param float ttl:   Custom time to live of the cached configs in seconds.
+        :return:            Configs by name.
+        """
+
+        def fetch(missing):
+            if len(missing) == 1:
+                return {missing[0]: self.default_source.get_config(missing[0])}
+            return self.default_source.get_configs(missing)
+
+        return self._get_with_cache(names, fetch, ttl)
+
+
+    def get_credentials_by_prefix(self, prefix, ttl: Optional[float] = None):
+        """
+        Get the credentials from the default source or from the cache.
+        The cache key is ``credentials_by_prefix:<prefix>``. Use it in `cache_ttls` to customize the TTL.
+
+        :param str prefix:  Prefix of credentials to extract
+        :param float ttl:   Custom time to live of the cached credentials in seconds.
+        """
+
+        key = f"{self.CREDENTIALS_CACHE_PREFIX}{prefix}"
+        fetch = lambda missing: {key: self.default_source.get_credentials_by_prefix(prefix)}
+
+        return self._get_with_cache([key], fetch, ttl)[key]
+
+
+    def _get_with_cache(self, names: List[str], fetch: Callable[[List[str]], Dict], ttl: Optional[float] = None):
+        """
+        Return the values of `names` from the cache. Those not found are fetched with `fetch(missing_names)`.
+        If `fetch` fails and all the missing names have expired values in the cache, these are returned.
+        """
+
+        result, stale = {}, {}
+        now = time.time()
+
+        for name in names:
+            entry = self._get_cached(name)
+            if entry is None:
+                continue
+
+            fetched_at, value = entry
+            if now - fetched_at < self._get_cache_ttl(name, ttl):
+                result[name] = json.loads(value)
+            else:
+                stale[name] = value
+
+        missing = [name for name in names if name not in result]
+        if not missing:
+            return result
+
+        try:
+            fetched = fetch(missing)
+
+        except Exception:
+            if not all(name in stale for name in missing):
+                raise
+
+            logger.warning(f"Failed to fetch {missing}. Using expired values from the cache.", exc_info=True)
+            result.update({name: json.loads(stale[name]) for name in missing})
+            return result
+
+        for name, value in fetched.items():
+            if self._get_cache_ttl(name, ttl) > 0:
+                self._set_cached(name, value, now)
+
+        result.update(fetched)
+        return result
 
 
     def update_config(self, name, val, **kwargs):
+        self.invalidate_cache(name)
         return self.default_source.update_config(name, val, **kwargs)
 
 
-    def get_credentials_by_prefix(self, prefix):
-        return self.default_source.get_credentials_by_prefix(prefix)
+    def invalidate_cache(self, name: Optional[str] = None):
+        """
+        Remove the config `name` from the cache in memory and on disk. Clean the memory cache if `name` is not given.
+        """
+
+        with self._cache_lock:
+            if name is None:
+                self._cache.clear()
+                return
+
+            self._cache.pop(name, None)
+
+        path = self._get_cache_path(name)
+        if path and os.path.exists(path):
+            os.remove(path)
+
+
+    def _get_cache_ttl(self, name: str, ttl: Optional[float] = None) -> float:
+        if ttl is not None:
+            return ttl
+
+        return self.config.get('cache_ttls', {}).get(name, self.config.get('cache_ttl') or 0)
+
+
+    def _get_cache_path(self, name: str) -> Optional[str]:
+        cache_dir = self.config.get('cache_dir')
+        if not cache_dir:
+            return None
+
+        # Decrypted credentials are not written to disk without explicit permission.
+        if name.startswith(self.CREDENTIALS_CACHE_PREFIX) and not self.config.get('cache_credentials_on_disk'):
+            return None
+
+        return os.path.join(cache_dir, f"{hashlib.sha256(name.encode()).hexdigest()}.json")
+
+
+    def _get_cached(self, name: str):
+        """ Return the (fetched_at, serialized config) from memory or from disk. None if not cached. """
+
+        with self._cache_lock:
+            entry = self._cache.get(name)
+
+        if entry is not None:
+            return entry
+
+        path = self._get_cache_path(name)
+        if not path:
+            return None
+
+        try:
+            with open(path) as f:
+                data = json.load(f)
+            entry = data['fetched_at'], data['value']
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+        with self._cache_lock:
+            self._cache.setdefault(name, entry)
+
+        return entry
+
+
+    def _set_cached(self, name: str, value, fetched_at: float):
+        try:
+            serialized = json.dumps(value)
+        except (TypeError, ValueError):
+            logger.debug(f"Config {name} is not JSON-serializable. Not caching it.")
+            return
+
+        with self._cache_lock:
+            self._cache[name] = fetched_at, serialized
+
+        path = self._get_cache_path(name)
+        if not path:
+            return
+
+        try:
+            write_file_atomically(path, json.dumps({'fetched_at': fetched_at, 'value': serialized}))
+        except OSError:
+            logger.warning(f"Failed to save config {name} to the disk cache {path}", exc_info=True)
+
+
 
 
 test = True if os.environ.get('STAGE') == 'test' else False
 
-__config_source = ConfigSource(test=test)
+# Cache settings of the global config source are configured with environment variables. Caching is disabled
+# by default, because Lambdas would not see the updated configs for `SOSW_CONFIG_CACHE_TTL` seconds.
+__config_source = ConfigSource(test=test, config={
+    'cache_ttl': float(os.environ.get('SOSW_CONFIG_CACHE_TTL') or 0),
+    'cache_dir': os.environ.get('SOSW_CONFIG_CACHE_DIR'),
+})
 
 get_config = __config_source.get_config
+get_configs = __config_source.get_configs
 update_config = __config_source.update_config
 get_credentials_by_prefix = __config_source.get_credentials_by_prefix
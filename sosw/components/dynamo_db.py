@@ -2,17 +2,27 @@ __all__ = ['DynamoDbClient', 'clean_dynamo_table']
 __author__ = "Nikolay Grishchenko, Sophie Fogel"
 __version__ = "1.6"
 
-import boto3
+import botocore.exceptions
 import logging
 import json
 import os
 import time
 import pprint
+import queue
+import random
+import threading
 
 from collections import defaultdict
-from typing import Dict, List, Optional, Tuple, Union
-
-from .benchmark import benchmark
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from decimal import Decimal
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, Union
+
+from .benchmark import benchmark, LatencyHistogram
+from .boto3_clients import get_boto3_client
+from .cache import TTLCache
+from .compression import is_packed, pack, unpack
+from .rate_limiter import get_token_bucket
 from .helpers import chunks
 
 
@@ -20,6 +30,144 @@ logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
 
+READ_OPERATIONS = ('query', 'scan', 'get_item', 'batch_get_item')
+THROTTLING_ERROR_CODES = ('ProvisionedThroughputExceededException', 'ThrottlingException', 'RequestLimitExceeded')
+
+# Limits of a single TransactWriteItems call. The size limit is a bit lower than 4 MB to leave room for
+# the inaccuracy of `_estimate_dynamo_size()` and for the request envelope.
+TRANSACT_WRITE_MAX_ITEMS = 100
+TRANSACT_WRITE_MAX_BYTES = 4000000
+
+
+def _estimate_dynamo_size(value: Any) -> int:
+    """
+    Approximate size in bytes of a value in DynamoDB syntax (e.g. the body of a transaction item).
+    Names and type markers are counted too, so the estimate is a bit above the size DynamoDB counts.
+    """
+
+    if isinstance(value, dict):
+        return sum(len(str(k)) + _estimate_dynamo_size(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return sum(_estimate_dynamo_size(v) for v in value) + 1
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if isinstance(value, str):
+        return len(value.encode())
+
+    return len(str(value))
+
+
+def _decode_number(val: str) -> Union[int, float]:
+    return float(val) if '.' in val else int(val)
+
+
+def _decode_string(val: str) -> str:
+    return val
+
+
+def _decode_json_string(val: str) -> Union[str, Dict]:
+    """ Try to load to a dictionary if looks like JSON. """
+
+    if val[:1] == '{' and val[-1:] == '}':
+        try:
+            return json.loads(val)
+        except ValueError:
+            logger.warning(f"A JSON-looking string failed to parse: {val}")
+    return val
+
+
+def _decode_value(val_dict: Dict) -> Any:
+    """ Decode a nested value (of a Map or a List) with the type taken from DynamoDB syntax. """
+
+    for key_type, val in val_dict.items():
+        decode = _VALUE_DECODERS.get(key_type)
+        if decode is None:
+            _raise_unsupported_type(key_type)
+        return decode(val)
+
+
+def _encode_value(val: Any) -> Dict:
+    """ Encode a nested value (of a Map or a List) to DynamoDB syntax guessing the type from Python type. """
+
+    # Exact type lookup is much faster than the chain of isinstance() for large nested payloads.
+    encode = _NESTED_ENCODERS.get(type(val))
+    if encode is not None:
+        return encode(val)
+
+    if val is None:
+        return {'NULL': True}
+    # bool is a subclass of int, so must be checked first.
+    if isinstance(val, bool):
+        return {'BOOL': val}
+    if isinstance(val, (int, float, Decimal)):
+        return {'N': str(val)}
+    if isinstance(val, str):
+        return {'S': val}
+    if isinstance(val, (bytes, bytearray)):
+        return {'B': bytes(val)}
+    if isinstance(val, dict):
+        return {'M': {str(k): _encode_value(v) for k, v in val.items()}}
+    if isinstance(val, (list, tuple)):
+        return {'L': [_encode_value(x) for x in val]}
+    if isinstance(val, (set, frozenset)):
+        if val and all(isinstance(x, str) for x in val):
+            return {'SS': list(val)}
+        if val and all(isinstance(x, (int, float, Decimal)) and not isinstance(x, bool) for x in val):
+            return {'NS': [str(x) for x in val]}
+        raise ValueError(f"DynamoDB supports only non-empty sets of strings or numbers: {val}")
+
+    raise ValueError(f"Unsupported type {type(val)} to convert to DynamoDB syntax: {val}")
+
+
+_NESTED_ENCODERS = {
+    str:   lambda val: {'S': val},
+    int:   lambda val: {'N': str(val)},
+    float: lambda val: {'N': str(val)},
+    bool:  lambda val: {'BOOL': val},
+    dict:  lambda val: {'M': {str(k): _encode_value(v) for k, v in val.items()}},
+    list:  lambda val: {'L': [_encode_value(x) for x in val]},
+}
+
+
+def _encode_bytes(val: Union[bytes, str]) -> bytes:
+    return val.encode() if isinstance(val, str) else bytes(val)
+
+
+def _raise_unsupported_type(key_type: str):
+    raise RuntimeError(f"DynamoDbClient.dynamo_to_dict() found that self.row_mapper has "
+                       f"unsupported key_type: {key_type}. DynamoDbClient supports only "
+                       f"{', '.join(_VALUE_DECODERS)} types.")
+
+
+# Decoders of values from DynamoDB syntax by type. Strings inside of Maps and Lists are never JSON-loaded.
+_VALUE_DECODERS = {
+    'S':    _decode_string,
+    'N':    _decode_number,
+    'BOOL': bool,
+    'NULL': lambda val: None,
+    'B':    bytes,
+    'SS':   set,
+    'NS':   lambda val: {_decode_number(x) for x in val},
+    'BS':   set,
+    'M':    lambda val: {k: _decode_value(v) for k, v in val.items()},
+    'L':    lambda val: [_decode_value(x) for x in val],
+}
+
+# Encoders of values to DynamoDB syntax for the types of `row_mapper`.
+_VALUE_ENCODERS = {
+    'S':    str,
+    'N':    str,
+    'BOOL': bool,
+    'NULL': lambda val: True,
+    'B':    _encode_bytes,
+    'SS':   lambda val: [str(x) for x in val],
+    'NS':   lambda val: [str(x) for x in val],
+    'BS':   lambda val: [_encode_bytes(x) for x in val],
+    'M':    lambda val: _encode_value(dict(val))['M'],
+    'L':    lambda val: _encode_value(list(val))['L'],
+}
+
+
 class DynamoDbClient:
     """
     Has default methods for different types of DynamoDB tables.
@@ -28,6 +176,7 @@ class DynamoDbClient:
     but you are free to initialize multiple simultaneous dynamo_clients in your Lambda with different configs.
 
     Config should have a mapping for the field types and required fields.
+    Supported types: 'S', 'N', 'BOOL', 'NULL', 'B', 'SS', 'NS', 'BS', 'M' (dict) and 'L' (list).
     Config example:
 
     .. code-block:: python
@@ -39,7 +188,20 @@ class DynamoDbClient:
             },
             'required_fields': ['col_name_1']
             'table_name': 'some_table_name',  # If a table is not specified, this table will be used.
-            'dont_json_loads_results': True  # Use this if you don't want to convert json strings into json
+            'dont_json_loads_results': True,  # Use this if you don't want to convert json strings into json
+            'approximate_count_max_pages': 1,  # Page budget for `get_by_query(return_count=True, approximate=True)`
+            'read_cache_size': 1000,  # Cache this many items for `get_item(cached=True)`. Disabled if not set.
+            'read_cache_ttl': 60,  # Seconds to keep items in the read cache.
+            'return_consumed_capacity': 'INDEXES',  # Default. 'TOTAL' or 'NONE' to skip the capacity accounting.
+            'rate_limits': {  # Client-side targets of consumed capacity units per second. Adapt to throttling.
+                'some_table_name': {'rcu': 100, 'wcu': 50},
+                'some_table_name/some_index': {'rcu': 20, 'wcu': 50},  # Writes to the table also count here.
+            },
+            'throttle_max_retries': 5,  # Retry throttled requests this many times before raising.
+            'compress_fields': ['col_name_3'],  # Store large values of these fields compressed as Binary.
+            'compress_threshold': 1024,  # Compress only if the serialized value is at least this many bytes.
+            'compress_format': 'json',  # 'json' or 'msgpack'. Default: msgpack if it is installed.
+            'boto3_client_config': {'max_pool_connections': 100},  # Arguments of `get_boto3_client()`.
         }
 
     """
@@ -56,20 +218,134 @@ class DynamoDbClient:
         self.config = config
 
         if not str(config.get('table_name')).startswith('autotest_mock_'):
-            self.dynamo_client = boto3.client('dynamodb')
+            self.dynamo_client = get_boto3_client('dynamodb', **config.get('boto3_client_config', {}))
         else:
             logger.info(f"Initialized DynamoClient without boto3 client for table {config.get('table_name')}")
 
         self.stats = defaultdict(int)
+        self.latencies = defaultdict(LatencyHistogram)
+        self._stats_lock = threading.Lock()
+        self._write_buffer = None
+        self._write_buffer_settings = {}
+
+        self.read_cache = None
+        self._read_cache_key_names = {}
+        if self.config.get('read_cache_size'):
+            self.read_cache = TTLCache(max_size=self.config['read_cache_size'], ttl=self.config.get('read_cache_ttl', 60))
+
         if not hasattr(self, 'row_mapper'):
             self.row_mapper = self.config.get('row_mapper')
 
 
+    def _get_row_codec(self) -> Dict:
+        """
+        Return the converters for fields of `row_mapper` compiled once per `row_mapper`.
+        The settings that affect conversion are read only during compilation, not for every row.
+
+        The codec is recompiled automatically if `row_mapper` or `dont_json_loads_results` is changed.
+        Other settings (e.g. compression) are expected to be constant during the life of the client.
+        """
+
+        json_loads_results = not self.config.get('dont_json_loads_results')
+        codec = getattr(self, '_row_codec', None)
+
+        if codec and codec['row_mapper'] is self.row_mapper and codec['json_loads_results'] == json_loads_results:
+            return codec
+
+        decoders = dict(_VALUE_DECODERS, S=_decode_json_string if json_loads_results else _decode_string)
+        row_mapper = self.row_mapper or {}
+
+        codec = {
+            'row_mapper':         self.row_mapper,
+            'json_loads_results': json_loads_results,
+            'decoders':           decoders,
+            'fields':             {key: (key_type, decoders.get(key_type)) for key, key_type in row_mapper.items()},
+            'encoders':           {key: (key_type, _VALUE_ENCODERS.get(key_type))
+                                   for key, key_type in row_mapper.items()},
+            'required_fields':    set(self.config.get('required_fields', [])),
+            'compress_fields':    frozenset(self.config.get('compress_fields') or []),
+            'compress_threshold': self.config.get('compress_threshold', 1024),
+            'compress_msgpack':   {'json': False, 'msgpack': True}.get(self.config.get('compress_format')),
+        }
+
+        self._row_codec = codec
+        return codec
+
+
+    @staticmethod
+    def _decode_rows(codec: Dict, dynamo_rows: List[Dict], strict: bool = True) -> List[Dict]:
+        """ Convert rows with compiled `codec`. See `dynamo_to_dict()`. """
+
+        fields = codec['fields'] if strict else codec['decoders']
+        result = []
+
+        for dynamo_row in dynamo_rows:
+            row = {}
+            for key, val_dict in dynamo_row.items():  # {'key1': {'Type1': 'val2'}, 'key2': {'Type2': 'val2'}}
+                if strict:
+                    field = fields.get(key)
+                    if field is None or not val_dict:
+                        continue
+                    key_type, decode = field
+                    if decode is None:
+                        _raise_unsupported_type(key_type)
+                    val = val_dict.get(key_type)  # Ex: "1234" or "myvalue"
+                    if val is not None:
+                        row[key] = decode(val)
+                    else:
+                        # Stored with some other type. E.g. a JSON string written before the field became a Map,
+                        # or a compressed value.
+                        row[key] = DynamoDbClient._decode_legacy_value(key, key_type, val_dict, codec)
+                else:
+                    for key_type, val in val_dict.items():  # Ex: {'N': "1234"} or {'S': "myvalue"}
+                        if key_type == 'B' and key in codec['compress_fields']:
+                            mapped_type = codec['fields'].get(key, (None, None))[0]
+                            row[key] = DynamoDbClient._decode_legacy_value(key, mapped_type, val_dict, codec)
+                            continue
+                        decode = fields.get(key_type)
+                        if decode is None:
+                            _raise_unsupported_type(key_type)
+                        row[key] = decode(val)
+
+            result.append(row)
+
+        return result
+
+
+    @staticmethod
+    def _decode_legacy_value(key: str, key_type: Optional[str], val_dict: Dict, codec: Dict) -> Any:
+        """
+        Decode the value stored with a type different from `row_mapper` (`key_type`, None if the field is not there).
+        Strings are loaded as JSON only for the fields declared as 'M' or 'L', other strings are returned as is.
+        """
+
+        decoders = codec['decoders']
+
+        for stored_type, val in val_dict.items():
+            if stored_type == 'B' and key in codec['compress_fields'] and is_packed(val):
+                value = unpack(val)
+                # Strings of 'S' fields are decoded the same way as if they were stored uncompressed.
+                return decoders['S'](value) if isinstance(value, str) and key_type == 'S' else value
+
+            if stored_type == 'S':
+                if key_type in ('M', 'L'):
+                    try:
+                        return json.loads(val)
+                    except ValueError:
+                        pass
+                return val
+
+            decode = decoders.get(stored_type)
+            if decode is None:
+                _raise_unsupported_type(stored_type)
+            return decode(val)
+
+
     @benchmark
     def dynamo_to_dict(self, dynamo_row, strict=True):
         """
         Convert the ugly DynamoDB syntax of the row, to regular dictionary.
-        We currently support only String or Numeric values. Latest ones are converted to int or float.
+        Numeric values are converted to int or float, Maps to dict, Lists to list, Sets to set, Binary to bytes.
         Takes settings from row_mapper.
 
         e.g.:               {'key1': {'N': '3'}, 'key2': {'S': 'value2'}}
@@ -82,50 +358,22 @@ class DynamoDbClient:
         :return:                    Human readable row from dynamo
         """
 
-        result = {}
-        if strict:
-            for key, key_type in self.row_mapper.items():
-                val_dict = dynamo_row.get(key)  # Ex: {'N': "1234"} or {'S': "myvalue"}
-                if val_dict:
-                    val = val_dict.get(key_type)  # Ex: 1234 or "myvalue"
-                    if key_type == 'N':
-                        result[key] = float(val) if '.' in val else int(val)
-                    elif key_type == 'S':
-                        # Try to load to a dictionary if looks like JSON.
-                        if val.startswith('{') and val.endswith('}') and not self.config.get('dont_json_loads_results'):
-                            try:
-                                result[key] = json.loads(val)
-                            except ValueError:
-                                logger.warning("A JSON-looking string failed to parse: {}".format(val))
-                                result[key] = val
-                        else:
-                            result[key] = val
-                    else:
-                        raise RuntimeError(f"DynamoDbClient.dynamo_to_dict() found that self.row_mapper has "
-                                           f"unsupported key_type: {key_type}. DynamoDbClient now supports only "
-                                           f"'S' or 'N' types. Others must be JSON-ified.")
-        else:
-            for key, key_type_and_val in dynamo_row.items():  # {'key1': {'Type1': 'val2'}, 'key2': {'Type2': 'val2'}}
-                for key_type, val in key_type_and_val.items():  # Ex: {'N': "1234"} or {'S': "myvalue"}
-                    if key_type == 'N':
-                        result[key] = float(val) if '.' in val else int(val)
-                    elif key_type == 'S':
-                        # Try to load to a dictionary if looks like JSON.
-                        if val.startswith('{') and val.endswith('}') and not self.config.get('dont_json_loads_results'):
-                            try:
-                                result[key] = json.loads(val)
-                            except ValueError:
-                                logger.warning(f"A JSON-looking string failed to parse: {val}")
-                                result[key] = val
-                        else:
-                            result[key] = val
-                    else:
-                        raise RuntimeError(f"DynamoDbClient.dynamo_to_dict() found that self.row_mapper has "
-                                           f"unsupported key_type: {key_type}. DynamoDbClient now supports only "
-                                           f"'S' or 'N' types. Others must be JSON-ified.")
+        return self._decode_rows(self._get_row_codec(), [dynamo_row], strict=strict)[0]
 
-        assert all(True for x in self.config['required_fields'] if result.get(x)), "Some `required_fields` are missing"
-        return result
+
+    @benchmark
+    def dynamo_rows_to_dicts(self, dynamo_rows: List[Dict], strict: bool = True) -> List[Dict]:
+        """
+        Same as `dynamo_to_dict()`, but converts the whole page of rows at once.
+        The codec lookup and the `benchmark` timing are paid once per page instead of once per row.
+        See `test/benchmark_dynamo_db.py` to compare with the row by row conversion.
+
+        :param list dynamo_rows:    DynamoDB row items. E.g. `page['Items']` of DynamoDB response.
+        :param bool strict:         See `dynamo_to_dict()`.
+        :rtype: list
+        """
+
+        return self._decode_rows(self._get_row_codec(), dynamo_rows, strict=strict)
 
 
     @benchmark
@@ -149,28 +397,39 @@ class DynamoDbClient:
         if add_prefix is None:
             add_prefix = ''
 
-        result = {f"{add_prefix}{key}": {key_type: str(row_dict.get(key))} for (key, key_type) in
-                  self.row_mapper.items()
-                  if row_dict.get(key) is not None}
-        result_keys = result.keys()
-        if add_prefix:
-            result_keys = [x[len(add_prefix):] for x in result.keys()]
-        for key in list(set(row_dict.keys()) - set(result_keys)):
-            if not strict:
-                val = row_dict.get(key)
-                key_with_prefix = f"{add_prefix}{key}"
+        codec = self._get_row_codec()
+        encoders = codec['encoders']
+
+        compress_fields = codec['compress_fields']
+
+        result = {}
+        for key, val in row_dict.items():
+            if key in compress_fields and val is not None:
+                packed = pack(val, threshold=codec['compress_threshold'], use_msgpack=codec['compress_msgpack'])
+                if packed is not None:
+                    result[f"{add_prefix}{key}"] = {'B': packed}
+                    continue
+
+            key_type, encode = encoders.get(key, (None, None))
+            if key_type is not None and (val is not None or key_type == 'NULL'):
+                if encode is None:
+                    _raise_unsupported_type(key_type)
+                result[f"{add_prefix}{key}"] = {key_type: encode(val)}
+
+            elif not strict:
                 if isinstance(val, (int, float)) or (isinstance(val, str) and val.isnumeric()):
-                    result[key_with_prefix] = {'N': str(row_dict.get(key))}
+                    result[f"{add_prefix}{key}"] = {'N': str(val)}
                 else:
-                    result[key_with_prefix] = {'S': str(row_dict.get(key))}
+                    result[f"{add_prefix}{key}"] = {'S': str(val)}
+
+            elif key not in codec['required_fields']:
+                logger.warning(f"Field {key} is missing from row_mapper, so we can't convert it to DynamoDB "
+                               f"syntax. This is not a required field, so we continue, but please investigate "
+                               f"row: {row_dict}")
             else:
-                if not key in self.config.get('required_fields', []):
-                    logger.warning(f"Field {key} is missing from row_mapper, so we can't convert it to DynamoDB "
-                                   f"syntax. This is not a required field, so we continue, but please investigate "
-                                   f"row: {row_dict}")
-                else:
-                    raise ValueError(f"Field {key} is missing from row_mapper, so we can't convert it to DynamoDB "
-                                     f"syntax. This is a required field, so we can not continue. Row: {row_dict}")
+                raise ValueError(f"Field {key} is missing from row_mapper, so we can't convert it to DynamoDB "
+                                 f"syntax. This is a required field, so we can not continue. Row: {row_dict}")
+
         logger.debug(result)
         return result
 
@@ -179,7 +438,8 @@ class DynamoDbClient:
     def get_by_query(self, keys: Dict, table_name: Optional[str] = None, index_name: Optional[str] = None,
                      comparisons: Optional[Dict] = None, max_items: Optional[int] = None,
                      filter_expression: Optional[str] = None, strict: bool = True, return_count: bool = False,
-                     desc: bool = False) -> Union[List[Dict], int]:
+                     desc: bool = False, fields: Optional[List[str]] = None, approximate: bool = False,
+                     count_workers: Optional[int] = None, page_size: Optional[int] = None) -> Union[List[Dict], int]:
         """
         Get an item from a table, by some keys. Can specify an index.
         If an index is not specified, will query the table.
@@ -202,19 +462,90 @@ class DynamoDbClient:
             Comparisons only work for the range key.
             Example: if keys={'hk': 'cat', 'rk': 100} and comparisons={'rk': '<='} -> will get items where rk <= 100
 
-        :param int max_items:   Limit the number of items to fetch.
+        :param int max_items:   Limit the number of items to fetch. If there is no `filter_expression` this is also
+                                used as the page size (DynamoDB `Limit`), so you pay RCU only for `max_items`.
         :param str filter_expression:  Supports regular comparisons and `between`. Input must be a regular human string
             e.g. 'key <= 42', 'name = marta', 'foo between 10 and 20', etc.
         :param bool strict:     If True, will only get the attributes specified in the row mapper.
                                 If false, will get all attributes. Default is True.
         :param bool return_count: If True, will return the number of items in the result instead of the items themselves
+                                  The items are counted on the DynamoDB side through all the pages of the query.
         :param bool desc:    By default (False) the the values will be sorted ascending by the SortKey.
                              To reverse the order set the argument `desc = True`.
+        :param list fields:  Attributes to fetch (ProjectionExpression). You pay RCU only for the fetched ones.
+                             If not specified and `strict` is True, fetches only the fields of `row_mapper`.
+        :param bool approximate: Makes sense only with `return_count`. Counts no more than `approximate_count_max_pages`
+                                 (from config, default is 1) pages. Cheap, but may undercount large results.
+        :param int count_workers: Makes sense only with `return_count` and a `between` condition for integer range key.
+                                  Splits the range in this number of parts and counts them in parallel threads.
+        :param int page_size:   Number of items DynamoDB evaluates per request (DynamoDB `Limit`).
 
         :return: List of items from the table, each item in key-value format
             OR the count if `return_count` is True
         """
 
+        if return_count:
+            query_args = self._build_query_args(keys, table_name=table_name, index_name=index_name,
+                                                comparisons=comparisons, filter_expression=filter_expression,
+                                                desc=desc, select='COUNT')
+
+            max_pages = self.config.get('approximate_count_max_pages', 1) if approximate else None
+            count = self._count_by_query(query_args, keys, max_pages=max_pages, workers=count_workers)
+            return min(count, max_items) if max_items else count
+
+        return list(self.get_by_query_generator(keys, table_name=table_name, index_name=index_name,
+                                                comparisons=comparisons, max_items=max_items,
+                                                filter_expression=filter_expression, strict=strict, desc=desc,
+                                                fields=fields, page_size=page_size))
+
+
+    def get_by_query_generator(self, keys: Dict, table_name: Optional[str] = None, index_name: Optional[str] = None,
+                               comparisons: Optional[Dict] = None, max_items: Optional[int] = None,
+                               filter_expression: Optional[str] = None, strict: bool = True, desc: bool = False,
+                               fields: Optional[List[str]] = None, page_size: Optional[int] = None) -> Iterator[Dict]:
+        """
+        Same as `get_by_query()`, but yields the items one by one. Next pages are fetched from DynamoDB
+        only when the previous ones are consumed. Doesn't support `return_count`.
+
+        See `get_by_query()` for the description of arguments.
+        """
+
+        query_args = self._build_query_args(keys, table_name=table_name, index_name=index_name,
+                                            comparisons=comparisons, filter_expression=filter_expression, desc=desc,
+                                            projection=self._build_projection(fields, strict))
+
+        # Without filtering every evaluated item is returned, so there is no need to read more than `max_items`.
+        if not page_size and max_items and not filter_expression:
+            page_size = max_items
+
+        pagination_config = {}
+        if max_items:
+            pagination_config['MaxItems'] = max_items
+        if page_size:
+            pagination_config['PageSize'] = page_size
+        if pagination_config:
+            query_args['PaginationConfig'] = pagination_config
+
+        logger.debug(f"Querying dynamo: {query_args}")
+
+        yielded = 0
+        for page in self._paginate('query', **query_args):
+            self._increment_stat('dynamo_get_queries')
+
+            for item in self.dynamo_rows_to_dicts(page['Items'], strict=strict):
+                yield item
+                yielded += 1
+                if max_items and yielded >= max_items:
+                    return
+
+
+    def _build_query_args(self, keys: Dict, table_name: Optional[str] = None, index_name: Optional[str] = None,
+                          comparisons: Optional[Dict] = None, filter_expression: Optional[str] = None,
+                          desc: bool = False, select: Optional[str] = None, projection: Optional[Dict] = None) -> Dict:
+        """
+        Construct the arguments for DynamoDB Query. See `get_by_query()` for the description of arguments.
+        """
+
         table_name = self._get_validate_table_name(table_name)
 
         filter_values = self.dict_to_dynamo(keys, add_prefix=':', strict=False)
@@ -243,7 +574,8 @@ class DynamoDbClient:
 
         cond_expr = " AND ".join(cond_expr_parts)
 
-        select = ('ALL_ATTRIBUTES' if index_name is None else 'ALL_PROJECTED_ATTRIBUTES') if not return_count else 'COUNT'
+        if not select:
+            select = 'ALL_ATTRIBUTES' if index_name is None else 'ALL_PROJECTED_ATTRIBUTES'
 
         logger.debug(cond_expr, filter_values)
         query_args = {
@@ -253,6 +585,9 @@ class DynamoDbClient:
             'KeyConditionExpression':    cond_expr  # Ex: "key1_name = :key1_name AND ..."
         }
 
+        if projection:
+            query_args.update(projection)
+
         # In case we have a filter expression, we parse it and add variables (values) to the ExpressionAttributeValues
         # Expression is also transformed to use these variables.
         if filter_expression:
@@ -263,27 +598,86 @@ class DynamoDbClient:
         if index_name:
             query_args['IndexName'] = index_name
 
-        if max_items:
-            query_args['PaginationConfig'] = {'MaxItems': max_items}
-
         if desc:
             query_args['ScanIndexForward'] = False
 
-        logger.debug(f"Querying dynamo: {query_args}")
+        return query_args
 
-        paginator = self.dynamo_client.get_paginator('query')
-        response_iterator = paginator.paginate(**query_args)
-        result = []
-        for page in response_iterator:
-            if return_count:
-                return page['Count']
 
-            result += [self.dynamo_to_dict(x, strict=strict) for x in page['Items']]
-            self.stats['dynamo_get_queries'] += 1
-            if max_items and len(result) >= max_items:
-                break
+    def _count_by_query(self, query_args: Dict, keys: Dict, max_pages: Optional[int] = None,
+                        workers: Optional[int] = None) -> int:
+        """
+        Sum the `Count` of all the pages of the query with `Select=COUNT`. Items are never fetched or converted.
+
+        If `workers` is given and `keys` have a `between` condition with integer boundaries, the range is split
+        into `workers` non-overlapping sub-ranges counted in parallel threads.
+        """
+
+        def count_pages(args: Dict) -> Tuple[int, int]:
+            count, pages = 0, 0
+            for page in self._paginate('query', **args):
+                count += page['Count']
+                pages += 1
+                if max_pages and pages >= max_pages:
+                    break
+            return count, pages
+
+        between_key = next((k[11:] for k in keys if k.startswith('st_between_')), None)
+
+        ranges = []
+        if workers and workers > 1 and between_key:
+            try:
+                st, en = int(keys[f"st_between_{between_key}"]), int(keys[f"en_between_{between_key}"])
+            except (TypeError, ValueError):
+                logger.debug(f"Can not split non-integer range of {between_key} for parallel count")
+            else:
+                bounds = [st + (en - st + 1) * i // workers for i in range(workers + 1)]
+                ranges = [(bounds[i], bounds[i + 1] - 1) for i in range(workers) if bounds[i] < bounds[i + 1]]
 
-        return result[:max_items] if max_items else result
+        if len(ranges) < 2:
+            count, pages = count_pages(query_args)
+            self._increment_stat('dynamo_count_queries', pages)
+            return count
+
+        sub_queries = []
+        for st, en in ranges:
+            args = dict(query_args)
+            args['ExpressionAttributeValues'] = dict(query_args['ExpressionAttributeValues'])
+            args['ExpressionAttributeValues'].update(
+                    self.dict_to_dynamo({f"st_between_{between_key}": st, f"en_between_{between_key}": en},
+                                        add_prefix=':', strict=False))
+            sub_queries.append(args)
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(count_pages, sub_queries))
+
+        self._increment_stat('dynamo_count_queries', sum(pages for _, pages in results))
+        return sum(count for count, _ in results)
+
+
+    def _build_projection(self, fields: Optional[List[str]] = None, strict: bool = True) -> Dict:
+        """
+        Construct the arguments for DynamoDB request to fetch only the specific attributes.
+        Attribute names are passed as placeholders to avoid conflicts with DynamoDB reserved words.
+
+        :param list fields: Attributes to fetch. If not specified and `strict` - the fields of `row_mapper`.
+        :return:            Dict with `Select`, `ProjectionExpression` and `ExpressionAttributeNames` or empty dict
+                            if all attributes should be fetched.
+        """
+
+        if fields is None and strict and self.row_mapper:
+            fields = list(self.row_mapper.keys())
+
+        if not fields:
+            return {}
+
+        names = {f"#p{i}": field for i, field in enumerate(fields)}
+
+        return {
+            'Select':                   'SPECIFIC_ATTRIBUTES',
+            'ProjectionExpression':     ", ".join(names.keys()),  # Ex: "#p0, #p1"
+            'ExpressionAttributeNames': names,  # Ex: {'#p0': 'attr_name', ...}
+        }
 
 
     def _parse_filter_expression(self, expression: str) -> Tuple[str, Dict]:
@@ -332,7 +726,8 @@ class DynamoDbClient:
 
 
     @benchmark
-    def get_by_scan(self, attrs=None, table_name=None, strict=True):
+    def get_by_scan(self, attrs=None, table_name=None, strict=True, total_segments=None, max_workers=None,
+                    segment=None, fields=None):
         """
         Scans a table. Don't use this method if you want to select by keys. It is SLOW compared to get_by_query.
         Careful - don't make queries of too many items, this could run for a long time.
@@ -343,22 +738,29 @@ class DynamoDbClient:
         :param str table_name: Name of the dynamo table. If not specified, will use table_name from the config.
         :param bool strict: If True, will only get the attributes specified in the row mapper.
             If false, will get all attributes. Default is True.
+        :param int total_segments: Split the table into this many segments and scan them in parallel
+            (DynamoDB Parallel Scan). The order of items in the result is not guaranteed in this case.
+        :param int max_workers: Number of threads to scan segments. Default is `total_segments`.
+        :param int segment: Scan only this segment (of `total_segments`). Useful to shard the scan between
+            several Lambdas.
+        :param list fields: Attributes to fetch (ProjectionExpression). If not specified and `strict` is True,
+            fetches only the fields of `row_mapper`.
         :return: List of items from the table, each item in key-value format
         :rtype: list
         """
 
-        response_iterator = self._build_scan_iterator(attrs, table_name, strict)
-
         result = []
-        for page in response_iterator:
-            result += [self.dynamo_to_dict(x, strict=strict) for x in page['Items']]
-            self.stats['dynamo_scan_queries'] += 1
+        for page in self._get_scan_pages(attrs, table_name, total_segments, max_workers, segment,
+                                         projection=self._build_projection(fields, strict)):
+            result.extend(self.dynamo_rows_to_dicts(page['Items'], strict=strict))
+            self._increment_stat('dynamo_scan_queries')
 
         return result
 
 
     @benchmark
-    def get_by_scan_generator(self, attrs=None, table_name=None, strict=True):
+    def get_by_scan_generator(self, attrs=None, table_name=None, strict=True, total_segments=None, max_workers=None,
+                              segment=None, fields=None):
         """
         Scans a table. Don't use this method if you want to select by keys. It is SLOW compared to get_by_query.
         Careful - don't make queries of too many items, this could run for a long time.
@@ -370,17 +772,92 @@ class DynamoDbClient:
         :param str table_name: Name of the dynamo table. If not specified, will use table_name from the config.
         :param bool strict: If True, will only get the attributes specified in the row mapper.
             If false, will get all attributes. Default is True.
+        :param int total_segments: Split the table into this many segments and scan them in parallel
+            (DynamoDB Parallel Scan). Pages are yielded as soon as any segment receives them.
+        :param int max_workers: Number of threads to scan segments. Default is `total_segments`.
+        :param int segment: Scan only this segment (of `total_segments`). Useful to shard the scan between
+            several Lambdas.
+        :param list fields: Attributes to fetch (ProjectionExpression). If not specified and `strict` is True,
+            fetches only the fields of `row_mapper`.
         :return: List of items from the table, each item in key-value format
         :rtype: list
         """
 
-        response_iterator = self._build_scan_iterator(attrs, table_name, strict)
-        for page in response_iterator:
-            self.stats['dynamo_scan_queries'] += 1
-            yield [self.dynamo_to_dict(x, strict=strict) for x in page['Items']]
+        for page in self._get_scan_pages(attrs, table_name, total_segments, max_workers, segment,
+                                         projection=self._build_projection(fields, strict)):
+            self._increment_stat('dynamo_scan_queries')
+            yield self.dynamo_rows_to_dicts(page['Items'], strict=strict)
 
 
-    def _build_scan_iterator(self, attrs=None, table_name=None, strict=True):
+    def _get_scan_pages(self, attrs=None, table_name=None, total_segments=None, max_workers=None, segment=None,
+                        projection=None):
+        """
+        Yields the raw pages of the scan. Runs a DynamoDB Parallel Scan if `total_segments` is given
+        and no specific `segment` is requested.
+        """
+
+        if segment is not None:
+            assert total_segments and 0 <= segment < total_segments, \
+                f"Segment must be in range of total_segments: {segment} of {total_segments}"
+
+        if not total_segments or total_segments == 1 or segment is not None:
+            yield from self._build_scan_iterator(attrs, table_name, segment=segment, total_segments=total_segments,
+                                                 projection=projection)
+            return
+
+        # The queue is bounded, so the segments do not fetch pages faster than the consumer iterates them.
+        # Otherwise a slow consumer of a large table would end up with the whole table in memory.
+        pages = queue.Queue(maxsize=2 * total_segments)
+        stop = threading.Event()
+        finished = object()
+
+
+        def put(item) -> bool:
+            """ Wait for the place in the queue unless the consumer has stopped. """
+
+            while not stop.is_set():
+                try:
+                    pages.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+
+        def scan_segment(seg):
+            try:
+                for page in self._build_scan_iterator(attrs, table_name, segment=seg, total_segments=total_segments,
+                                                      projection=projection):
+                    if not put(page) or stop.is_set():
+                        break
+            except Exception as err:
+                put(err)
+            finally:
+                put(finished)
+
+
+        with ThreadPoolExecutor(max_workers=max_workers or total_segments) as executor:
+            for seg in range(total_segments):
+                executor.submit(scan_segment, seg)
+
+            try:
+                finished_segments = 0
+                while finished_segments < total_segments:
+                    page = pages.get()
+                    if page is finished:
+                        finished_segments += 1
+                    elif isinstance(page, Exception):
+                        raise page
+                    else:
+                        yield page
+            finally:
+                # In case of error or if the consumer stopped iterating (closed the generator), ask the segments
+                # to stop. They check it before fetching the next page.
+                stop.set()
+
+
+    def _build_scan_iterator(self, attrs=None, table_name=None, strict=True, segment=None, total_segments=None,
+                             projection=None):
         table_name = self._get_validate_table_name(table_name)
 
         filter_values = None
@@ -403,19 +880,112 @@ class DynamoDbClient:
             query_args['FilterExpression'] = cond_expr
         if filter_values:
             query_args['ExpressionAttributeValues'] = filter_values
+        if segment is not None:
+            query_args['Segment'] = segment
+            query_args['TotalSegments'] = total_segments
+        if projection:
+            query_args.update(projection)
 
         logger.debug(f"Scanning dynamo: {query_args}")
 
-        paginator = self.dynamo_client.get_paginator('scan')
-        response_iterator = paginator.paginate(**query_args)
-        return response_iterator
+        return self._paginate('scan', **query_args)
+
+
+    @benchmark
+    def get_item(self, keys: Dict, table_name: Optional[str] = None, consistent: bool = False, strict: bool = True,
+                 fields: Optional[List[str]] = None, cached: bool = False) -> Dict:
+        """
+        Get a single item by its primary key with DynamoDB `GetItem`.
+        Much cheaper than `get_by_query()` when you know the full primary key.
+
+        If the read cache is enabled in config (`read_cache_size`), the items are cached for `read_cache_ttl`
+        seconds and invalidated on `put()`, `update()`, `delete()` and other writes of the same item
+        with the current client. The cache is used only by the reads with `cached`, because writes of other
+        clients are not seen until the TTL expires.
+
+        :param dict keys:       Full primary key of the item. E.g. {'hash_col': 'cat', 'range_col': 123}
+        :param str table_name:  Name of the dynamo table. If not specified, will use table_name from the config.
+        :param bool consistent: Use strongly consistent read. Skips the read cache, but saves the result to it.
+        :param bool strict:     If True, will only get the attributes specified in the row mapper.
+        :param list fields:     Attributes to fetch (ProjectionExpression). Such reads are not cached.
+        :param bool cached:     Return the item from the read cache if it is there. Use it only if the caller
+                                tolerates data up to `read_cache_ttl` seconds old. Other reads refresh the cache.
+        :return:                The item or empty dict if not found.
+        """
+
+        table_name = self._get_validate_table_name(table_name)
+        dynamo_keys = self.dict_to_dynamo(keys, strict=False)
+
+        use_cache = self.read_cache is not None and not fields
+        if use_cache:
+            self._read_cache_key_names[table_name] = tuple(sorted(dynamo_keys.keys()))
+            cache_key = self._get_read_cache_key(table_name, dynamo_keys)
+
+            if cached and not consistent:
+                item = self.read_cache.get(cache_key)
+                if item is not None:
+                    self._increment_stat('dynamo_read_cache_hits')
+                    return self.dynamo_to_dict(item, strict=strict)
+
+        query = {
+            'TableName':      table_name,
+            'Key':            dynamo_keys,
+            'ConsistentRead': consistent,
+        }
+
+        projection = self._build_projection(fields, strict=False)
+        if projection:
+            query['ProjectionExpression'] = projection['ProjectionExpression']
+            query['ExpressionAttributeNames'] = projection['ExpressionAttributeNames']
+
+        logger.debug(f"Get item from dynamo: {query}")
+        response = self._call_dynamo('get_item', **query)
+        self._increment_stat('dynamo_get_item_queries')
+
+        item = response.get('Item')
+        if not item:
+            return {}
+
+        if use_cache:
+            # We cache the raw item, so that every hit converts to a new dictionary that the caller can modify.
+            self.read_cache.set(cache_key, item)
+
+        return self.dynamo_to_dict(item, strict=strict)
+
+
+    def _get_read_cache_key(self, table_name: str, dynamo_attrs: Dict) -> Optional[Tuple]:
+        """
+        Construct the key of the read cache from DynamoDB formatted attributes of the item.
+        Return None if we don't know the primary key of the table or `dynamo_attrs` do not contain it.
+        """
+
+        key_names = self._read_cache_key_names.get(table_name)
+        if not key_names or not all(k in dynamo_attrs for k in key_names):
+            return None
+
+        return (table_name,) + tuple((k,) + tuple(dynamo_attrs[k].items()) for k in key_names)
+
+
+    def _invalidate_read_cache(self, table_name: str, dynamo_attrs: Optional[Dict]):
+        """ Remove the item from the read cache. `dynamo_attrs` could be either the full item or just its keys. """
+
+        if self.read_cache is None or not dynamo_attrs:
+            return
 
+        cache_key = self._get_read_cache_key(table_name, dynamo_attrs)
+        if cache_key:
+            self.read_cache.invalidate(cache_key)
 
-    def batch_get_items_one_table(self, keys_list, table_name=None, max_retries=0, retry_wait_base_time=0.2):
+
+    def batch_get_items_one_table(self, keys_list, table_name=None, max_retries=3, retry_wait_base_time=0.2,
+                                  max_workers=None, strict=True, fields=None):
         """
         Gets a batch of items from a single dynamo table.
         Only accepts keys, can't query by other columns.
 
+        The keys are split into chunks of 100 (the limit of `BatchGetItem`) and the chunks are fetched concurrently.
+        The order of the result is not guaranteed.
+
         :param list keys_list: A list of the keys of the items we want to get. Gets the items that match the given keys.
                                If some key doesn't exist - it just skips it and gets the others.
                                e.g. [{'hash_col': '1, 'range_col': 2}, {'hash_col': 3}]
@@ -425,61 +995,101 @@ class DynamoDbClient:
         Optional
 
         :param str table_name:
-        :param int max_retries: If failed to get some items, retry this many times. Waiting between retries is
-                                multiplied by 2 after each retry, so `retries` shouldn't be a big number.
-                                Default is 1.
-        :param int retry_wait_base_time: Wait this much time after first retry. Will wait twice longer in each retry.
+        :param int max_retries: If failed to get some items, retry this many times. Only the `UnprocessedKeys` are
+                                retried. Waiting between retries is multiplied by 2 after each retry with random
+                                jitter, so `retries` shouldn't be a big number. Default is 3.
+        :param float retry_wait_base_time: Wait up to this much time after first retry.
+        :param int max_workers: Number of threads to fetch chunks. Default is the number of chunks, but not more
+                                than 10.
+        :param bool strict:     Convert only the fields from `row_mapper`. See `dynamo_to_dict()`.
+        :param list fields:     Fetch only these attributes. If not specified - all attributes are fetched.
         :return: List of items from the table
         :rtype: list
         """
 
-        table_name = self._get_validate_table_name(table_name)
+        return list(self.batch_get_items_one_table_generator(keys_list, table_name=table_name, max_retries=max_retries,
+                                                             retry_wait_base_time=retry_wait_base_time,
+                                                             max_workers=max_workers, strict=strict, fields=fields))
 
-        # Convert given keys to dynamo syntax
-        query_keys = [self.dict_to_dynamo(item) for item in keys_list]
 
-        batch_get_item_query = {
-            'RequestItems': {
-                table_name: {
-                    'Keys': query_keys
-                }
-            }
-        }
+    def batch_get_items_one_table_generator(self, keys_list, table_name=None, max_retries=3,
+                                            retry_wait_base_time=0.2, max_workers=None, strict=True,
+                                            fields=None) -> Iterator[Dict]:
+        """
+        Generator version of `batch_get_items_one_table()`. Yields the items as soon as their chunk is fetched,
+        so it is suitable for hydrating thousands of keys. See the parameters in `batch_get_items_one_table()`.
 
-        logger.debug(f"batch_get_item query: {batch_get_item_query}")
+        :raises RuntimeError:   If some keys are still unprocessed after `max_retries`.
+        """
 
-        db_result = self.dynamo_client.batch_get_item(**batch_get_item_query)
-        logger.debug(f"batch_get_items_one_table response: {db_result}")
+        table_name = self._get_validate_table_name(table_name)
 
+        projection = self._build_projection(fields) if fields else {}
+        # BatchGetItem does not support `Select`.
+        projection.pop('Select', None)
+
+        key_chunks = [[self.dict_to_dynamo(item) for item in chunk] for chunk in chunks(keys_list, 100)]
+        codec = self._get_row_codec()
+
+        if not key_chunks:
+            return
+
+        if len(key_chunks) == 1:
+            items, queries = self._batch_get_chunk(key_chunks[0], table_name, projection, max_retries,
+                                                   retry_wait_base_time)
+            self._increment_stat('dynamo_batch_get_queries', queries)
+            yield from self._decode_rows(codec, items, strict)
+            return
+
+        with ThreadPoolExecutor(max_workers=max_workers or min(len(key_chunks), 10)) as executor:
+            futures = [executor.submit(self._batch_get_chunk, chunk, table_name, projection, max_retries,
+                                       retry_wait_base_time) for chunk in key_chunks]
+            try:
+                for future in as_completed(futures):
+                    items, queries = future.result()
+                    self._increment_stat('dynamo_batch_get_queries', queries)
+                    yield from self._decode_rows(codec, items, strict)
+            finally:
+                # In case of error or if the consumer stopped iterating, do not start the chunks left.
+                for future in futures:
+                    future.cancel()
+
+
+    def _batch_get_chunk(self, keys: List[Dict], table_name: str, projection: Dict, max_retries: int,
+                         retry_wait_base_time: float) -> Tuple[List[Dict], int]:
+        """
+        Fetch up to 100 keys (already in DynamoDB syntax) with `BatchGetItem`.
+        Retries only the `UnprocessedKeys` with jittered exponential backoff.
 
-        # Check if we skipped something - if we did, try again.
-        def is_action_incomplete(db_result):
-            return 'UnprocessedKeys' in db_result and db_result['UnprocessedKeys'] \
-                   and table_name in db_result['UnprocessedKeys'] and db_result['UnprocessedKeys'][table_name]
+        :return:    Tuple of raw DynamoDB items and the number of queries made.
+        """
 
+        items = []
+        request = {'Keys': keys, **projection}
 
-        if is_action_incomplete(db_result):
-            # Retry several times
-            retry_num = 0
-            wait_time = retry_wait_base_time
-            while is_action_incomplete(db_result) and retry_num < max_retries:
-                logger.warning(f"batch_get_item action did NOT finish successfully.")
-                time.sleep(wait_time)
-                db_result = self.dynamo_client.batch_get_item(**batch_get_item_query)
-                retry_num += 1
-                wait_time *= 2
+        retry_num = 0
+        queries = 0
+        while True:
+            logger.debug(f"batch_get_item query: {request}")
+            db_result = self._call_dynamo('batch_get_item', RequestItems={table_name: request})
+            queries += 1
 
-        # After the retries still we have a bad result... then raise Exception
-        if is_action_incomplete(db_result):
-            raise Exception(f"batch_get_items action failed for table {table_name}, keys_list {keys_list}")
+            items.extend(db_result.get('Responses', {}).get(table_name, []))
 
-        items = db_result['Responses'][table_name]
+            unprocessed = (db_result.get('UnprocessedKeys') or {}).get(table_name)
+            if not unprocessed or not unprocessed.get('Keys'):
+                return items, queries
 
-        result = []
-        for item in items:
-            result.append(self.dynamo_to_dict(item))
+            if retry_num >= max_retries:
+                raise RuntimeError(f"batch_get_item failed to get {len(unprocessed['Keys'])} keys from {table_name} "
+                                   f"after {max_retries} retries: {unprocessed['Keys']}")
 
-        return result
+            wait_time = random.uniform(0, retry_wait_base_time * 2 ** retry_num)
+            logger.warning(f"batch_get_item left {len(unprocessed['Keys'])} unprocessed keys in {table_name}. "
+                           f"Retry in {wait_time:.3f} seconds.")
+            time.sleep(wait_time)
+            retry_num += 1
+            request = unprocessed
 
 
     def build_put_query(self, row, table_name=None):
@@ -513,19 +1123,113 @@ class DynamoDbClient:
         table_name = self._get_validate_table_name(table_name)
 
         put_query = self.build_put_query(row, table_name)
+        self._invalidate_read_cache(table_name, put_query['Item'])
+
+        if self._write_buffer is not None:
+            self._buffer_write_request(table_name, {'PutRequest': {'Item': put_query['Item']}})
+            return
+
         logger.debug(f"Put to DB: {put_query}")
 
-        dynamo_response = self.dynamo_client.put_item(**put_query)
+        dynamo_response = self._call_dynamo('put_item', **put_query)
 
         logger.debug(f"Response from dynamo {dynamo_response}")
 
-        self.stats['dynamo_put_queries'] += 1
+        self._increment_stat('dynamo_put_queries')
+
+
+    @benchmark
+    def batch_put(self, rows: List[Dict], table_name: Optional[str] = None, max_retries: int = 5,
+                  retry_wait_base_time: float = 0.1):
+        """
+        Adds multiple rows to the table using `BatchWriteItem`. The rows are split into chunks of 25 (the limit of
+        DynamoDB for a single request). The `UnprocessedItems` are retried with exponential backoff.
+
+        WARNING: BatchWriteItem is not a transaction. In case of failure some of the rows may already be written.
+
+        :param list rows:           Rows to add to the table. key is column name, value is value.
+        :param str table_name:      Name of the dynamo table to add the rows to.
+        :param int max_retries:     Retry `UnprocessedItems` this many times before giving up.
+        :param float retry_wait_base_time: Wait this much time before the first retry. Doubled for every next one.
+        """
+
+        table_name = self._get_validate_table_name(table_name)
+
+        requests = [(table_name, {'PutRequest': {'Item': self.build_put_query(row, table_name)['Item']}})
+                    for row in rows]
+
+        self._batch_write_items(requests, max_retries=max_retries, retry_wait_base_time=retry_wait_base_time)
+        self._increment_stat('dynamo_put_queries', len(rows))
+
+
+    @benchmark
+    def batch_delete(self, keys_list: List[Dict], table_name: Optional[str] = None, max_retries: int = 5,
+                     retry_wait_base_time: float = 0.1):
+        """
+        Deletes multiple rows from the table using `BatchWriteItem`. The same as `batch_put()` the keys are split
+        into chunks of 25 and the `UnprocessedItems` are retried with exponential backoff.
+        Deleting a row that doesn't exist is not an error, so the call can be safely repeated.
+
+        WARNING: BatchWriteItem is not a transaction. In case of failure some of the rows may already be deleted.
+
+        :param list keys_list:      Keys of the rows to delete. e.g. [{'hash_col': 'cat', 'range_col': 1}]
+        :param str table_name:      Name of the dynamo table to delete the rows from.
+        :param int max_retries:     Retry `UnprocessedItems` this many times before giving up.
+        :param float retry_wait_base_time: Wait this much time before the first retry. Doubled for every next one.
+        """
+
+        table_name = self._get_validate_table_name(table_name)
+
+        requests = [(table_name, {'DeleteRequest': {'Key': self.build_delete_query(keys, table_name)['Key']}})
+                    for keys in keys_list]
+
+        self._batch_write_items(requests, max_retries=max_retries, retry_wait_base_time=retry_wait_base_time)
+        self._increment_stat('dynamo_delete_queries', len(keys_list))
+
+
+    def _batch_write_items(self, requests: List[Tuple[str, Dict]], max_retries: int = 5,
+                           retry_wait_base_time: float = 0.1):
+        """
+        Send write requests to DynamoDB with `BatchWriteItem` in chunks of 25 items.
+        Requests may belong to different tables.
+
+        :param list requests:   List of tuples: (table_name, {'PutRequest': {...}} or {'DeleteRequest': {...}})
+        :raises RuntimeError:   If some items are still unprocessed after `max_retries`.
+        """
+
+        for chunk in chunks(requests, 25):
+            request_items = defaultdict(list)
+            for table_name, request in chunk:
+                body = request.get('PutRequest') or request['DeleteRequest']
+                self._invalidate_read_cache(table_name, body.get('Item') or body.get('Key'))
+                request_items[table_name].append(request)
+
+            retry_num = 0
+            wait_time = retry_wait_base_time
+            while request_items:
+                logger.debug(f"batch_write_item query: {dict(request_items)}")
+                response = self._call_dynamo('batch_write_item', RequestItems=dict(request_items))
+                self._increment_stat('dynamo_batch_write_queries')
+
+                request_items = response.get('UnprocessedItems') or {}
+                if not request_items:
+                    break
+
+                if retry_num >= max_retries:
+                    raise RuntimeError(f"batch_write_item failed to process items after {max_retries} retries: "
+                                       f"{request_items}")
+
+                logger.warning(f"batch_write_item left {sum(len(x) for x in request_items.values())} "
+                               f"unprocessed items. Retry in {wait_time} seconds.")
+                time.sleep(wait_time)
+                retry_num += 1
+                wait_time *= 2
 
 
     @benchmark
     def update(self, keys: Dict, attributes_to_update: Optional[Dict] = None,
                attributes_to_increment: Optional[Dict] = None, table_name: Optional[str] = None,
-               condition_expression: Optional[str] = None):
+               condition_expression: Optional[str] = None, return_values: Optional[str] = None) -> Optional[Dict]:
         """
         Updates an item in DynamoDB.
 
@@ -543,8 +1247,31 @@ class DynamoDbClient:
             Example: {'some_counter': '3'}
         :param str condition_expression: Condition Expression that must be fulfilled on the object to update.
         :param str table_name: Name of the table
+        :param str return_values: 'ALL_NEW', 'UPDATED_NEW', 'ALL_OLD' or 'UPDATED_OLD'. Return these attributes.
+        :return: Attributes requested with `return_values` converted to dict. None if not requested.
         """
 
+        update_item_query = self.build_update_query(keys, attributes_to_update, attributes_to_increment, table_name,
+                                                    condition_expression)
+        self._invalidate_read_cache(update_item_query['TableName'], update_item_query['Key'])
+
+        if return_values:
+            update_item_query['ReturnValues'] = return_values
+
+        logger.debug(f"Updating an item, query: {update_item_query}")
+        response = self._call_dynamo('update_item', **update_item_query)
+        logger.debug(f"Update result: {response}")
+        self._increment_stat('dynamo_update_queries')
+
+        if return_values:
+            return self.dynamo_to_dict(response.get('Attributes', {}), strict=False)
+
+
+    def build_update_query(self, keys: Dict, attributes_to_update: Optional[Dict] = None,
+                           attributes_to_increment: Optional[Dict] = None, table_name: Optional[str] = None,
+                           condition_expression: Optional[str] = None) -> Dict:
+        """ Construct the query for `update_item`. See the parameters in `update()`. """
+
         table_name = self._get_validate_table_name(table_name)
 
         if not attributes_to_update and not attributes_to_increment:
@@ -586,10 +1313,7 @@ class DynamoDbClient:
             update_item_query['ConditionExpression'] = expr
             update_item_query['ExpressionAttributeValues'].update(values)
 
-        logger.debug(f"Updating an item, query: {update_item_query}")
-        response = self.dynamo_client.update_item(**update_item_query)
-        logger.debug(f"Update result: {response}")
-        self.stats['dynamo_update_queries'] += 1
+        return update_item_query
 
 
     def delete(self, keys: Dict, table_name: Optional[str] = None):
@@ -600,7 +1324,89 @@ class DynamoDbClient:
         """
 
         query = self.build_delete_query(keys, table_name)
-        self.dynamo_client.delete_item(**query)
+        self._invalidate_read_cache(query['TableName'], query['Key'])
+
+        if self._write_buffer is not None:
+            self._buffer_write_request(query['TableName'], {'DeleteRequest': {'Key': query['Key']}})
+            return
+
+        self._call_dynamo('delete_item', **query)
+
+
+    @contextmanager
+    def batch_writer(self, max_retries: int = 5, retry_wait_base_time: float = 0.1):
+        """
+        Context manager that buffers `put()` and `delete()` calls (for any tables) and sends them to DynamoDB
+        with `BatchWriteItem` in chunks of 25. `UnprocessedItems` are retried with exponential backoff.
+        The remaining buffer is flushed when leaving the context. Nested calls share the outer buffer.
+
+        .. code-block:: python
+
+            with dynamo_db_client.batch_writer():
+                for row in rows:
+                    dynamo_db_client.put(row, table_name='table1')
+                    dynamo_db_client.delete({'hash_col': row['hash_col']}, table_name='table2')
+
+        WARNING: The writes are not transactional, and the `ConditionExpression` is not supported by BatchWriteItem.
+        The order of writes in a batch is not guaranteed either. Do not use it to move items between tables with
+        a put and a delete: the delete may succeed while the put fails. Use `transact_write()` for that.
+        Writes to the same item are flushed separately if we can detect it by keys of deletes, but two `put()`
+        of the same item in one context will fail the batch.
+
+        :param int max_retries:     Retry `UnprocessedItems` this many times before giving up.
+        :param float retry_wait_base_time: Wait this much time before the first retry. Doubled for every next one.
+        """
+
+        if self._write_buffer is not None:
+            yield self
+            return
+
+        self._write_buffer = []
+        self._write_buffer_settings = {'max_retries': max_retries, 'retry_wait_base_time': retry_wait_base_time}
+        try:
+            yield self
+        finally:
+            try:
+                self.flush_write_buffer()
+            finally:
+                self._write_buffer = None
+
+
+    def flush_write_buffer(self):
+        """ Send all the buffered write requests of the `batch_writer()` to DynamoDB. """
+
+        if not self._write_buffer:
+            return
+
+        requests, self._write_buffer = self._write_buffer, []
+        self._batch_write_items(requests, **self._write_buffer_settings)
+
+
+    def _buffer_write_request(self, table_name: str, request: Dict):
+        """
+        Add the request to the buffer of `batch_writer()`. BatchWriteItem doesn't accept multiple operations
+        on the same item in one call, so in case of a detected conflict we flush the buffer first.
+        """
+
+        attrs = request.get('PutRequest', {}).get('Item') or request['DeleteRequest']['Key']
+
+        def is_subset(small, big):
+            return all(big.get(k) == v for k, v in small.items())
+
+        for pending_table, pending in self._write_buffer:
+            if pending_table != table_name:
+                continue
+
+            pending_attrs = pending.get('PutRequest', {}).get('Item') or pending['DeleteRequest']['Key']
+            if ('DeleteRequest' in pending and is_subset(pending_attrs, attrs)) \
+                    or ('DeleteRequest' in request and is_subset(attrs, pending_attrs)):
+                self.flush_write_buffer()
+                break
+
+        self._write_buffer.append((table_name, request))
+
+        if len(self._write_buffer) >= 25:
+            self.flush_write_buffer()
 
 
     def make_put_transaction_item(self, row, table_name=None):
@@ -611,22 +1417,66 @@ class DynamoDbClient:
         return {'Delete': self.build_delete_query(row, table_name)}
 
 
-    def transact_write(self, *transactions: Dict):
+    def make_update_transaction_item(self, keys: Dict, attributes_to_update: Optional[Dict] = None,
+                                     attributes_to_increment: Optional[Dict] = None, table_name: Optional[str] = None,
+                                     condition_expression: Optional[str] = None) -> Dict:
+        """ See the parameters in `update()`. """
+
+        return {'Update': self.build_update_query(keys, attributes_to_update, attributes_to_increment, table_name,
+                                                  condition_expression)}
+
+
+    def make_condition_check_transaction_item(self, keys: Dict, condition_expression: str,
+                                              table_name: Optional[str] = None) -> Dict:
+        """
+        The transaction fails if the `condition_expression` is not fulfilled on the item with `keys`.
+        The item itself is not modified.
+        """
+
+        expr, values = self._parse_filter_expression(condition_expression)
+        query = {
+            'TableName':           self._get_validate_table_name(table_name),
+            'Key':                 self.dict_to_dynamo(keys, strict=False),
+            'ConditionExpression': expr,
+        }
+        if values:
+            query['ExpressionAttributeValues'] = values
+
+        return {'ConditionCheck': query}
+
+
+    def transact_write(self, *transactions: Dict, concurrent: bool = False, max_workers: Optional[int] = None,
+                       group_size: int = 1, on_commit: Optional[Callable[[List[Dict]], None]] = None):
         """
         Executes many write transaction. Can execute operations on different tables.
-        Will split transactions to chunks - because transact_write_items accepts up to 10 actions.
-        WARNING: If you're expecting a transaction on more than 10 operations - AWS DynamoDB doesn't support it.
+        Will split transactions to chunks - because transact_write_items accepts up to 100 actions
+        and up to 4 MB of data. The size of every operation is estimated from its body.
+        WARNING: If you're expecting a transaction on more than 100 operations - AWS DynamoDB doesn't support it.
+        Every chunk is atomic on its own, so keep the operations that depend on each other in the same chunk
+        with `group_size`.
+
+        If some chunk fails, the chunks written before it (or concurrently with it) stay committed.
+        The indexes of the failed chunks are logged, and the error of the first failed chunk is raised.
 
         .. code-block:: python
 
             dynamo_db_client = DynamoDbClient(config)
             t1 = dynamo_db_client.make_put_transaction_item(row, table_name='table1')
             t2 = dynamo_db_client.make_delete_transaction_item(row, table_name='table2')
-            dynamo_db_client.transact_write(t1, t2)
-
+            t3 = dynamo_db_client.make_update_transaction_item(keys, {'some_col': 'val'}, table_name='table3')
+            t4 = dynamo_db_client.make_condition_check_transaction_item(keys, 'attribute_exists hk', table_name='t4')
+            dynamo_db_client.transact_write(t1, t2, t3, t4)
+
+        :param bool concurrent:     Send the chunks in parallel threads. Use only if chunks are independent.
+        :param int max_workers:     Number of threads for `concurrent` mode. Default is the number of chunks,
+                                    but not more than 10.
+        :param int group_size:      Number of consecutive operations that are never split between chunks.
+                                    E.g. 2 for pairs of Put and Delete moving items between tables.
+        :param on_commit:           Called with the operations of every committed chunk. Always in the calling thread,
+                                    also if some other chunk fails.
         """
 
-        supported_actions = ['Put', 'Delete']
+        supported_actions = ['Put', 'Delete', 'Update', 'ConditionCheck']
         for t in transactions:
             assert isinstance(t, dict), "transaction must be a dictionary"
             assert len(t) == 1, "one transaction must contain only one operation"
@@ -636,15 +1486,79 @@ class DynamoDbClient:
             assert isinstance(t[action], dict), f"transaction[{action}] must be a dictionary. bad type: " \
                                                 f"{type(t[action])}"
 
-        for t_chunk in chunks(transactions, 10):
-            logger.debug(f"Transactions: \n{pprint.pformat(t_chunk)}")
+        for t in transactions:
+            for body in t.values():
+                self._invalidate_read_cache(body['TableName'], body.get('Item') or body.get('Key'))
 
-            response = self.dynamo_client.transact_write_items(TransactItems=t_chunk)
 
-            self.stats['dynamo_transact_write_operations'] += 1
+        def write_chunk(t_chunk):
+            logger.debug(f"Transactions: \n{pprint.pformat(t_chunk)}")
+            response = self._call_dynamo('transact_write_items', TransactItems=t_chunk)
             logger.debug(f"Response from transact_write_items: {response}")
 
 
+        transaction_chunks = self._chunk_transactions(transactions, group_size)
+
+        if concurrent and len(transaction_chunks) > 1:
+            with ThreadPoolExecutor(max_workers=max_workers or min(len(transaction_chunks), 10)) as executor:
+                futures = {executor.submit(write_chunk, t_chunk): i for i, t_chunk in enumerate(transaction_chunks)}
+                errors = {futures[f]: f.exception() for f in as_completed(futures) if f.exception() is not None}
+
+            self._increment_stat('dynamo_transact_write_operations', len(transaction_chunks) - len(errors))
+
+            if on_commit:
+                for i, t_chunk in enumerate(transaction_chunks):
+                    if i not in errors:
+                        on_commit(t_chunk)
+
+            if errors:
+                logger.error(f"transact_write failed chunks {sorted(errors)} of {len(transaction_chunks)}. "
+                             f"The other chunks are committed.")
+                raise errors[min(errors)]
+
+        else:
+            for i, t_chunk in enumerate(transaction_chunks):
+                try:
+                    write_chunk(t_chunk)
+                except Exception:
+                    logger.error(f"transact_write failed chunk {i} of {len(transaction_chunks)}. The chunks before it "
+                                 f"are committed, the ones after it were not sent.")
+                    raise
+
+                self._increment_stat('dynamo_transact_write_operations')
+
+                if on_commit:
+                    on_commit(t_chunk)
+
+
+    @staticmethod
+    def _chunk_transactions(transactions: Tuple[Dict], group_size: int = 1) -> List[List[Dict]]:
+        """ Split operations to chunks within the limits of TransactWriteItems. Groups are never split. """
+
+        assert len(transactions) % group_size == 0, f"Number of operations must be a multiple of {group_size}"
+        assert group_size <= TRANSACT_WRITE_MAX_ITEMS, f"group_size can not exceed {TRANSACT_WRITE_MAX_ITEMS}"
+
+        result, current, current_size = [], [], 0
+        for group in chunks(transactions, group_size):
+            size = _estimate_dynamo_size(group)
+            if size > TRANSACT_WRITE_MAX_BYTES:
+                raise ValueError(f"Operations of a single group take about {size} bytes, "
+                                 f"more than the limit of TransactWriteItems: {TRANSACT_WRITE_MAX_BYTES}")
+
+            if current and (len(current) + len(group) > TRANSACT_WRITE_MAX_ITEMS
+                            or current_size + size > TRANSACT_WRITE_MAX_BYTES):
+                result.append(current)
+                current, current_size = [], 0
+
+            current.extend(group)
+            current_size += size
+
+        if current:
+            result.append(current)
+
+        return result
+
+
     def _get_validate_table_name(self, table_name=None):
         if table_name is None:
             table_name = self.config.get('table_name')
@@ -658,20 +1572,301 @@ class DynamoDbClient:
         return table_name
 
 
+    def _call_dynamo(self, operation: str, **kwargs) -> Dict:
+        """
+        Call the `operation` of boto3 DynamoDB client requesting the consumed capacity. Record latency and capacity.
+
+        If `rate_limits` are configured for the tables (or indexes), waits for the capacity first.
+        Throttled requests are retried with jittered exponential backoff up to `throttle_max_retries` times.
+        """
+
+        kwargs.update(self._consumed_capacity_args())
+        limiters = self._get_rate_limiters(operation, kwargs)
+
+        retry_num = 0
+        while True:
+            for bucket, estimate, _ in limiters:
+                bucket.acquire(estimate)
+
+            started_at = time.perf_counter()
+            try:
+                response = getattr(self.dynamo_client, operation)(**kwargs)
+            except botocore.exceptions.ClientError as err:
+                self._handle_throttling(operation, err, limiters, retry_num)
+                retry_num += 1
+                continue
+
+            self._record_response(operation, time.perf_counter() - started_at, response)
+            self._settle_rate_limiters(limiters, response)
+            return response
+
+
+    def _paginate(self, operation: str, **kwargs) -> Iterator[Dict]:
+        """
+        Paginate the `operation` requesting the consumed capacity. Record latency and capacity of every page.
+        If `rate_limits` are configured, waits for the capacity before every page.
+
+        Throttled pages are retried the same way as in `_call_dynamo()`. Paginators of boto3 can not continue after
+        an error, so a new one is started from the `LastEvaluatedKey` of the last received page.
+        """
+
+        kwargs.update(self._consumed_capacity_args())
+        limiters = self._get_rate_limiters(operation, kwargs)
+
+        pages = iter(self.dynamo_client.get_paginator(operation).paginate(**kwargs))
+        retry_num, last_key, items_received = 0, None, 0
+        while True:
+            for bucket, estimate, _ in limiters:
+                bucket.acquire(estimate)
+
+            started_at = time.perf_counter()
+            try:
+                page = next(pages)
+            except StopIteration:
+                return
+            except botocore.exceptions.ClientError as err:
+                self._handle_throttling(operation, err, limiters, retry_num)
+                retry_num += 1
+
+                resume_kwargs = self._get_resume_pagination_args(kwargs, last_key, items_received)
+                if resume_kwargs is None:
+                    return
+                pages = iter(self.dynamo_client.get_paginator(operation).paginate(**resume_kwargs))
+                continue
+
+            retry_num = 0
+            last_key = page.get('LastEvaluatedKey')
+            items_received += len(page.get('Items', []))
+
+            self._record_response(operation, time.perf_counter() - started_at, page)
+            self._settle_rate_limiters(limiters, page)
+            yield page
+
+
+    @staticmethod
+    def _get_resume_pagination_args(kwargs: Dict, last_key: Optional[Dict], items_received: int) -> Optional[Dict]:
+        """
+        Arguments to paginate the rest of the results after `items_received` items up to `last_key` were received.
+        Returns None if `MaxItems` of the original pagination is already reached.
+        """
+
+        result = dict(kwargs)
+        if last_key:
+            result['ExclusiveStartKey'] = last_key
+
+        pagination_config = dict(result.get('PaginationConfig') or {})
+        pagination_config.pop('StartingToken', None)
+        if pagination_config.get('MaxItems'):
+            pagination_config['MaxItems'] -= items_received
+            if pagination_config['MaxItems'] <= 0:
+                return None
+
+        if pagination_config:
+            result['PaginationConfig'] = pagination_config
+
+        return result
+
+
+    @staticmethod
+    def _is_throttling_error(err: botocore.exceptions.ClientError) -> bool:
+        """
+        True for throttling errors, including cancelled transactions if all the reasons are throttling
+        (or 'None' for the operations that were fine, but cancelled together with the throttled ones).
+        """
+
+        code = err.response.get('Error', {}).get('Code')
+        if code in THROTTLING_ERROR_CODES:
+            return True
+
+        if code == 'TransactionCanceledException':
+            reasons = [x.get('Code') for x in err.response.get('CancellationReasons') or []]
+            return 'ThrottlingError' in reasons and set(reasons) <= {'ThrottlingError', 'None', None}
+
+        return False
+
+
+    def _handle_throttling(self, operation: str, err: botocore.exceptions.ClientError, limiters: List[Tuple],
+                           retry_num: int):
+        """
+        Slow down the rate limiters and wait before the retry of the throttled request.
+        Re-raises `err` if it is not a throttling error or if `throttle_max_retries` is exhausted.
+        """
+
+        if not self._is_throttling_error(err):
+            raise err
+
+        with self._stats_lock:
+            self.stats['dynamo_throttled_requests'] += 1
+        for bucket, _, _ in limiters:
+            bucket.throttled()
+
+        if retry_num >= self.config.get('throttle_max_retries', 5):
+            raise err
+
+        wait_time = random.uniform(0, 0.05 * 2 ** retry_num)
+        logger.warning(f"DynamoDB {operation} throttled. Retry in {wait_time:.3f} seconds.")
+        time.sleep(wait_time)
+
+
+    def _get_rate_limiters(self, operation: str, kwargs: Dict) -> List[Tuple]:
+        """
+        Find the shared rate limiters for the request according to `rate_limits` config.
+
+        Reads are limited by the target of the table or the index (if IndexName is given).
+        Writes are limited by the targets of the table and all of its configured indexes.
+
+        :return:    List of tuples: (TokenBucket, estimated units, (table_name, index_name or None))
+        """
+
+        rate_limits = self.config.get('rate_limits')
+        if not rate_limits:
+            return []
+
+        # Estimate the units per table. Transactions cost twice more.
+        if operation == 'batch_get_item':
+            estimates = {t: len(r['Keys']) for t, r in kwargs['RequestItems'].items()}
+        elif operation == 'batch_write_item':
+            estimates = {t: len(r) for t, r in kwargs['RequestItems'].items()}
+        elif operation == 'transact_write_items':
+            estimates = defaultdict(int)
+            for t in kwargs['TransactItems']:
+                for body in t.values():
+                    estimates[body['TableName']] += 2
+        else:
+            estimates = {kwargs['TableName']: 1}
+
+        unit = 'rcu' if operation in READ_OPERATIONS else 'wcu'
+
+        targets = []
+        for table_name, estimate in estimates.items():
+            if unit == 'rcu':
+                index_name = kwargs.get('IndexName')
+                targets.append((table_name, index_name, estimate))
+            else:
+                targets.append((table_name, None, estimate))
+                targets.extend((table_name, name.split('/', 1)[1], estimate) for name in rate_limits
+                               if name.startswith(f"{table_name}/"))
+
+        result = []
+        for table_name, index_name, estimate in targets:
+            name = f"{table_name}/{index_name}" if index_name else table_name
+            rate = (rate_limits.get(name) or {}).get(unit)
+            if rate:
+                result.append((get_token_bucket(f"{name}:{unit}", rate), estimate, (table_name, index_name)))
+
+        return result
+
+
+    @staticmethod
+    def _settle_rate_limiters(limiters: List[Tuple], response: Dict):
+        """
+        Correct the estimated units with the real `ConsumedCapacity` and adapt the rates.
+        Unprocessed items of batch operations are also a sign of throttling.
+        """
+
+        if not limiters:
+            return
+
+        throttled = bool(response.get('UnprocessedItems') or response.get('UnprocessedKeys'))
+
+        consumed = response.get('ConsumedCapacity') or []
+        consumed = {c.get('TableName'): c for c in (consumed if isinstance(consumed, list) else [consumed])}
+
+        for bucket, estimate, (table_name, index_name) in limiters:
+            if throttled:
+                bucket.throttled()
+            else:
+                bucket.succeeded()
+
+            capacity = consumed.get(table_name)
+            if not capacity:
+                continue
+
+            indexes = {**(capacity.get('GlobalSecondaryIndexes') or {}), **(capacity.get('LocalSecondaryIndexes') or {})}
+            if index_name:
+                part = indexes.get(index_name) or (None if indexes else capacity)
+            else:
+                part = capacity.get('Table') or capacity
+
+            if part:
+                bucket.consume(part.get('CapacityUnits', estimate) - estimate)
+
+
+    def _consumed_capacity_args(self) -> Dict:
+        return_consumed_capacity = self.config.get('return_consumed_capacity', 'INDEXES')
+        if not return_consumed_capacity or return_consumed_capacity == 'NONE':
+            return {}
+        return {'ReturnConsumedCapacity': return_consumed_capacity}
+
+
+    def _record_response(self, operation: str, duration: float, response: Dict):
+        """
+        Record the latency of the `operation` and accumulate the `ConsumedCapacity` of the response.
+        The capacity is counted per table and per index in stats like:
+        `dynamo_consumed_rcu_{table}` and `dynamo_consumed_rcu_{table}/{index}`.
+        Operations are called from several threads, so the stats are updated under a lock.
+        """
+
+        with self._stats_lock:
+            self.latencies[operation].add(duration)
+
+        consumed = response.get('ConsumedCapacity') if isinstance(response, dict) else None
+        if not consumed:
+            return
+
+        unit = 'rcu' if operation in READ_OPERATIONS else 'wcu'
+        units_field = 'ReadCapacityUnits' if unit == 'rcu' else 'WriteCapacityUnits'
+
+        def units(capacity: Dict) -> float:
+            return capacity.get(units_field) or capacity.get('CapacityUnits') or 0
+
+        with self._stats_lock:
+            # Batch and transactional operations return a list with capacity per table.
+            for capacity in consumed if isinstance(consumed, list) else [consumed]:
+                table_name = capacity.get('TableName')
+                self.stats[f"dynamo_consumed_{unit}"] += units(capacity)
+                self.stats[f"dynamo_consumed_{unit}_{table_name}"] += units(capacity)
+
+                for index_type in ('GlobalSecondaryIndexes', 'LocalSecondaryIndexes'):
+                    for index_name, index_capacity in (capacity.get(index_type) or {}).items():
+                        self.stats[f"dynamo_consumed_{unit}_{table_name}/{index_name}"] += units(index_capacity)
+
+
+    def _increment_stat(self, name: str, value: float = 1):
+        """ Add `value` to the stat `name`. The client is used from several threads, so the stats are locked. """
+
+        with self._stats_lock:
+            self.stats[name] += value
+
+
     def get_stats(self):
         """
         Return statistics of operations performed by current instance of the Class.
+        Latency percentiles of DynamoDB operations are added in milliseconds as
+        `dynamo_latency_{operation}_p50`, `..._p90` and `..._p99`.
 
         :return:    -   dict    - key: int statistics.
         """
-        return self.stats
+
+        with self._stats_lock:
+            stats = dict(self.stats)
+            latencies = dict(self.latencies)
+
+        for operation, histogram in latencies.items():
+            for p in (50, 90, 99):
+                stats[f"dynamo_latency_{operation}_p{p}"] = round(histogram.percentile(p) * 1000, 3)
+
+        return stats
 
 
     def reset_stats(self):
         """
         Cleans statistics.
         """
-        self.stats = defaultdict(int)
+
+        with self._stats_lock:
+            self.stats = defaultdict(int)
+            self.latencies = defaultdict(LatencyHistogram)
 
 
 def clean_dynamo_table(table_name='autotest_dynamo_db', keys=('hash_col', 'range_col')):
@@ -685,9 +1880,8 @@ def clean_dynamo_table(table_name='autotest_dynamo_db', keys=('hash_col', 'range
 
     assert table_name.startswith('autotest_')
 
-    client = boto3.client('dynamodb')
-    for row in client.scan(TableName=table_name)['Items']:
-        client.delete_item(
-                TableName=table_name,
-                Key={key: row[key] for key in keys}
-        )
+    dynamo_db_client = DynamoDbClient({'table_name': table_name})
+    rows = dynamo_db_client.dynamo_client.scan(TableName=table_name)['Items']
+
+    dynamo_db_client._batch_write_items([(table_name, {'DeleteRequest': {'Key': {key: row[key] for key in keys}}})
+                                         for row in rows])
@@ -27,15 +27,18 @@ __all__ = ['validate_account_to_dashed',
            'first_or_none',
            'recursive_update',
            'trim_arn_to_name',
+           'write_file_atomically',
            ]
 
 import re
 import collections
+import os
+import tempfile
 import uuid
 import datetime
 
 from copy import deepcopy
-from typing import Iterable, Callable, Dict, Mapping
+from typing import Iterable, Callable, Dict, Mapping, Union
 
 
 def validate_account_to_dashed(account):
@@ -710,3 +713,24 @@ def trim_arn_to_name(arn: str) -> str:
               "(?P<name>[0-9a-zA-Z_=,.@-]*)(:)?([0-9a-zA-Z$]*)?"
 
     return re.search(pattern, arn).group('name')
+
+
+def write_file_atomically(path: str, data: Union[str, bytes]):
+    """
+    Write `data` to the file at `path`, creating the directories if required.
+    The data is written to a temporary file in the same directory first and then moved to `path`,
+    so that concurrent readers (and writers) never see a partially written file.
+    """
+
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(path)}.", suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb' if isinstance(data, bytes) else 'w') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
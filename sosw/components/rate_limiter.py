@@ -0,0 +1,122 @@
+"""
+Client-side rate limiting. Used by DynamoDbClient to keep the consumption of tables and indexes below the targets
+and adapt to throttling.
+"""
+
+__all__ = ['TokenBucket', 'get_token_bucket']
+__author__ = "Nikolay Grishchenko"
+__version__ = "1.0"
+
+import logging
+import threading
+import time
+
+from typing import Optional
+
+
+logger = logging.getLogger()
+
+_token_buckets = {}
+_token_buckets_lock = threading.Lock()
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket with AIMD (additive increase, multiplicative decrease) adaptation of the rate.
+
+    Callers `acquire()` the estimated number of tokens before the operation and may `consume()` the difference
+    once the real cost is known. The balance can go negative, so the following callers wait longer.
+
+    .. code-block:: python
+
+        bucket = TokenBucket(rate=10)  # 10 units per second.
+        bucket.acquire(1)
+        try:
+            do_something()
+        except Throttled:
+            bucket.throttled()  # Halve the rate.
+        else:
+            bucket.succeeded()  # Slowly return the rate back to the target.
+
+    :param float rate:      Target (and maximum) rate in tokens per second.
+    :param float burst:     Maximum number of tokens to accumulate. Default: one second of `rate`.
+    :param float min_rate:  The rate never decreases below this. Default: 5% of `rate`.
+    :param float increase:  Rate increase after every success. Default: 5% of `rate`.
+    :param float decrease:  Rate multiplier after throttling. Default: 0.5.
+    """
+
+    def __init__(self, rate: float, burst: Optional[float] = None, min_rate: Optional[float] = None,
+                 increase: Optional[float] = None, decrease: float = 0.5):
+
+        assert rate > 0, f"Rate must be positive: {rate}"
+
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = burst or max(rate, 1)
+        self.min_rate = min_rate or rate * 0.05
+        self.increase = increase or rate * 0.05
+        self.decrease = decrease
+
+        self.tokens = self.burst
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+
+    def acquire(self, tokens: float = 1) -> float:
+        """
+        Take `tokens` from the bucket. Sleeps if there are not enough tokens.
+
+        :return:    Time waited in seconds.
+        """
+
+        with self._lock:
+            self._refill()
+            self.tokens -= tokens
+            wait_time = -self.tokens / self.rate if self.tokens < 0 else 0
+
+        if wait_time:
+            time.sleep(wait_time)
+
+        return wait_time
+
+
+    def consume(self, tokens: float):
+        """
+        Adjust the balance without waiting. Negative `tokens` return the overestimated tokens back.
+        """
+
+        with self._lock:
+            self._refill()
+            self.tokens = min(self.burst, self.tokens - tokens)
+
+
+    def throttled(self):
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate * self.decrease)
+            self.tokens = min(self.tokens, 0)
+            logger.info(f"Throttled. Decreased rate to {self.rate:.2f} per second")
+
+
+    def succeeded(self):
+        with self._lock:
+            if self.rate < self.max_rate:
+                self.rate = min(self.max_rate, self.rate + self.increase)
+
+
+def get_token_bucket(name: str, rate: float, **kwargs) -> TokenBucket:
+    """
+    Return the `TokenBucket` shared by all the callers in this process for the `name`.
+    If the target `rate` changes, the bucket is recreated.
+    """
+
+    with _token_buckets_lock:
+        bucket = _token_buckets.get(name)
+        if bucket is None or bucket.max_rate != rate:
+            bucket = _token_buckets[name] = TokenBucket(rate, **kwargs)
+        return bucket
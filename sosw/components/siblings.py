@@ -1,10 +1,10 @@
-import boto3
 import datetime
 import json
 import logging
 import os
 
 from math import ceil
+from sosw.components.boto3_clients import get_boto3_client
 
 
 __author__ = "Nikolay Grishchenko"
@@ -47,9 +47,9 @@ class SiblingsManager:
 
 
     def __init__(self):
-        self.lambda_client = boto3.client('lambda')
-        self.events_client = boto3.client('events')
-        self.cloudwatch_client = boto3.client('cloudwatch')
+        self.lambda_client = get_boto3_client('lambda')
+        self.events_client = get_boto3_client('events')
+        self.cloudwatch_client = get_boto3_client('cloudwatch')
 
 
     def any_events_rules_enabled(self, lambda_context):
@@ -1,10 +1,11 @@
-import boto3
 import csv
 import json
 import logging
 import os
 from collections import defaultdict
 
+from sosw.components.boto3_clients import get_boto3_client
+
 
 __author__ = "Nikolay Grishchenko"
 __email__ = "dev@bimpression.com"
@@ -53,8 +54,7 @@ class SnsManager():
             self.recipient = 'arn:aws:sns:us-west-2:000000000000:autotest_topic'
 
         if not self.test:
-            self.session = boto3.Session(region_name=kwargs.get('region', 'us-west-2'))
-            self.resource = self.session.client('sns')
+            self.resource = get_boto3_client('sns', region_name=kwargs.get('region', 'us-west-2'))
 
 
     def __del__(self):
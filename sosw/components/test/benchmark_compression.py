@@ -0,0 +1,83 @@
+"""
+Benchmark of the payload encodings of DynamoDbClient: item size and encode / decode throughput.
+
+Run it from the root of the repository:
+
+.. code-block:: bash
+
+   python -m sosw.components.test.benchmark_compression
+"""
+
+import json
+import logging
+import os
+
+from unittest.mock import patch
+
+
+os.environ["STAGE"] = "test"
+
+from sosw.components import compression
+from sosw.components.dynamo_db import DynamoDbClient
+from sosw.components.test.benchmark_dynamo_db import measure
+
+
+logging.getLogger().setLevel(logging.WARNING)
+
+ROWS = 2000
+
+# Looks like a chunk of a job from the Scheduler.
+PAYLOAD = {
+    'sections': {'section_funny': {'stores': {f"store_{i}": {'products': list(range(1000 + i, 1040 + i))}
+                                              for i in range(20)}}},
+    'isolate_products': True,
+    'period': 'last_2_days',
+}
+
+
+def item_size(dynamo_row):
+    """ Approximate size of the item in DynamoDB: names and values of attributes. """
+
+    def value_size(val_dict):
+        for key_type, val in val_dict.items():
+            if key_type == 'M':
+                return sum(len(k) + value_size(v) for k, v in val.items()) + 3
+            if key_type == 'L':
+                return sum(value_size(x) for x in val) + 3
+            if key_type in ('B', 'S'):
+                return len(val) if isinstance(val, bytes) else len(val.encode())
+            return len(str(val))
+
+    return sum(len(k) + value_size(v) for k, v in dynamo_row.items())
+
+
+def main():
+    variants = {
+        'JSON string':  {'payload': 'S'},
+        'Map':          {'payload': 'M'},
+        'zlib + JSON':  {'payload': 'M', 'compress_fields': ['payload'], 'compress_format': 'json'},
+    }
+    if compression.msgpack:
+        variants['zlib + msgpack'] = {'payload': 'M', 'compress_fields': ['payload'], 'compress_format': 'msgpack'}
+
+    for name, settings in variants.items():
+        config = {
+            'row_mapper':      {'task_id': 'S', 'payload': settings['payload']},
+            'table_name':      'autotest_benchmark',
+            'compress_fields': settings.get('compress_fields'),
+            'compress_format': settings.get('compress_format'),
+        }
+        with patch('boto3.client'):
+            client = DynamoDbClient(config=config)
+
+        payload = json.dumps(PAYLOAD) if settings['payload'] == 'S' else PAYLOAD
+        rows = [{'task_id': f"task_{i}", 'payload': payload} for i in range(ROWS)]
+        dynamo_rows = [client.dict_to_dynamo(x) for x in rows]
+
+        print(f"{name}: item size {item_size(dynamo_rows[0]):,} bytes")
+        measure("  encode", lambda: [client.dict_to_dynamo(x) for x in rows], rows=ROWS)
+        measure("  decode", lambda: client.dynamo_rows_to_dicts(dynamo_rows), rows=ROWS)
+
+
+if __name__ == '__main__':
+    main()
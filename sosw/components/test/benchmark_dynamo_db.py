@@ -0,0 +1,155 @@
+"""
+Microbenchmark of the row conversion in DynamoDbClient.
+
+Run it from the root of the repository:
+
+.. code-block:: bash
+
+   python -m sosw.components.test.benchmark_dynamo_db
+"""
+
+import json
+import logging
+import os
+import time
+
+from unittest.mock import patch
+
+
+os.environ["STAGE"] = "test"
+
+from sosw.components.benchmark import benchmark
+from sosw.components.dynamo_db import DynamoDbClient
+
+
+logging.getLogger().setLevel(logging.WARNING)
+
+ROWS = 20000
+
+CONFIG = {
+    'row_mapper':      {
+        'task_id':             'S',
+        'labourer_id':         'S',
+        'created_at':          'N',
+        'completed_at':        'N',
+        'greenfield':          'N',
+        'attempts':            'N',
+        'closed_at':           'N',
+        'desired_launch_time': 'N',
+        'arn':                 'S',
+        'payload':             'S'
+    },
+    'required_fields': ['task_id', 'labourer_id', 'created_at', 'greenfield'],
+    'table_name':      'autotest_benchmark',
+}
+
+
+@benchmark
+def legacy_dynamo_to_dict(client, dynamo_row, strict=True):
+    """
+    The row-by-row conversion as it was before the compiled row codec. Kept only as the baseline to compare with,
+    including the `benchmark` decorator that the method had. Supports only 'S' and 'N' types.
+    """
+
+    result = {}
+    if strict:
+        items = ((key, key_type, (dynamo_row.get(key) or {}).get(key_type))
+                 for key, key_type in client.row_mapper.items() if dynamo_row.get(key))
+    else:
+        items = ((key, key_type, val) for key, key_type_and_val in dynamo_row.items()
+                 for key_type, val in key_type_and_val.items())
+
+    for key, key_type, val in items:
+        if key_type == 'N':
+            result[key] = float(val) if '.' in val else int(val)
+        elif key_type == 'S':
+            if val.startswith('{') and val.endswith('}') and not client.config.get('dont_json_loads_results'):
+                try:
+                    result[key] = json.loads(val)
+                except ValueError:
+                    result[key] = val
+            else:
+                result[key] = val
+        else:
+            raise RuntimeError(f"Unsupported key_type: {key_type}")
+
+    assert all(True for x in client.config['required_fields'] if result.get(x)), "Some `required_fields` are missing"
+    return result
+
+
+@benchmark
+def legacy_dict_to_dynamo(client, row_dict, add_prefix='', strict=True):
+    """ The conversion to DynamoDB syntax as it was before the compiled row codec. Baseline only. """
+
+    result = {f"{add_prefix}{key}": {key_type: str(row_dict.get(key))} for (key, key_type) in
+              client.row_mapper.items()
+              if row_dict.get(key) is not None}
+    result_keys = result.keys()
+    if add_prefix:
+        result_keys = [x[len(add_prefix):] for x in result.keys()]
+    for key in list(set(row_dict.keys()) - set(result_keys)):
+        if not strict:
+            val = row_dict.get(key)
+            if isinstance(val, (int, float)) or (isinstance(val, str) and val.isnumeric()):
+                result[f"{add_prefix}{key}"] = {'N': str(val)}
+            else:
+                result[f"{add_prefix}{key}"] = {'S': str(val)}
+        elif key in client.config.get('required_fields', []):
+            raise ValueError(f"Field {key} is missing from row_mapper")
+    return result
+
+
+def measure(name, fn, rows=ROWS, repeat=10):
+    """ Prints the best throughput of `repeat` runs. """
+
+    elapsed = []
+    for _ in range(repeat):
+        st = time.perf_counter()
+        fn()
+        elapsed.append(time.perf_counter() - st)
+
+    print(f"{name:50s} {rows / min(elapsed):12,.0f} rows/sec")
+
+
+def main():
+    with patch('boto3.client'):
+        client = DynamoDbClient(config=CONFIG)
+        map_client = DynamoDbClient(config={**CONFIG, 'row_mapper': {**CONFIG['row_mapper'], 'payload': 'M'}})
+
+    dynamo_rows = [{
+        'task_id':     {'S': f"task_{i}"},
+        'labourer_id': {'S': 'some_function'},
+        'created_at':  {'N': '1555000000.123'},
+        'greenfield':  {'N': str(1000 * i)},
+        'attempts':    {'N': '0'},
+        'payload':     {'S': json.dumps({'foo': i, 'bar': 'x' * 50})},
+    } for i in range(ROWS)]
+
+    rows = client.dynamo_rows_to_dicts(dynamo_rows)
+
+    # The same rows with native Map payload instead of JSON string.
+    map_dynamo_rows = [map_client.dict_to_dynamo(x) for x in rows]
+
+    measure("baseline dynamo_to_dict (row by row)", lambda: [legacy_dynamo_to_dict(client, x) for x in dynamo_rows])
+    measure("baseline dynamo_to_dict strict=False (row by row)",
+            lambda: [legacy_dynamo_to_dict(client, x, strict=False) for x in dynamo_rows])
+    measure("dynamo_to_dict (row by row)", lambda: [client.dynamo_to_dict(x) for x in dynamo_rows])
+    measure("dynamo_to_dict strict=False (row by row)",
+            lambda: [client.dynamo_to_dict(x, strict=False) for x in dynamo_rows])
+    measure("dynamo_rows_to_dicts (page)", lambda: client.dynamo_rows_to_dicts(dynamo_rows))
+    measure("dynamo_rows_to_dicts strict=False (page)",
+            lambda: client.dynamo_rows_to_dicts(dynamo_rows, strict=False))
+    measure("baseline dict_to_dynamo", lambda: [legacy_dict_to_dynamo(client, x) for x in rows])
+    measure("baseline dict_to_dynamo strict=False",
+            lambda: [legacy_dict_to_dynamo(client, x, strict=False) for x in rows])
+    measure("dict_to_dynamo", lambda: [client.dict_to_dynamo(x) for x in rows])
+    measure("dict_to_dynamo strict=False", lambda: [client.dict_to_dynamo(x, strict=False) for x in rows])
+
+    measure("dynamo_rows_to_dicts payload as Map (page)", lambda: map_client.dynamo_rows_to_dicts(map_dynamo_rows))
+    measure("json.dumps + dict_to_dynamo payload as JSON",
+            lambda: [client.dict_to_dynamo(dict(x, payload=json.dumps(x['payload']))) for x in rows])
+    measure("dict_to_dynamo payload as Map", lambda: [map_client.dict_to_dynamo(x) for x in rows])
+
+
+if __name__ == '__main__':
+    main()
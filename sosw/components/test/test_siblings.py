@@ -4,6 +4,8 @@ import os
 from unittest.mock import MagicMock
 from unittest import mock
 
+from sosw.components.boto3_clients import reset_boto3_clients
+
 
 os.environ["STAGE"] = "test"
 os.environ["autotest"] = "True"
@@ -11,6 +13,14 @@ os.environ["autotest"] = "True"
 
 class siblings_TestCase(unittest.TestCase):
 
+    def setUp(self):
+        reset_boto3_clients()
+
+
+    def tearDown(self):
+        reset_boto3_clients()
+
+
     @mock.patch("boto3.client")
     def test_get_approximate_concurrent_executions(self, mock_boto_client):
         mock_get_metric_statistics_responses = [
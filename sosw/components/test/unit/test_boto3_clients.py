@@ -0,0 +1,89 @@
+import os
+import unittest
+
+from unittest.mock import patch
+
+from sosw.components.boto3_clients import get_boto3_client, reset_boto3_clients
+
+
+class boto3_clients_UnitTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.patcher = patch('boto3.client')
+        self.boto3_client = self.patcher.start()
+        self.boto3_client.side_effect = lambda *args, **kwargs: object()
+
+        reset_boto3_clients()
+
+
+    def tearDown(self):
+        self.patcher.stop()
+        reset_boto3_clients()
+
+
+    def test_get_boto3_client__shared(self):
+        client = get_boto3_client('dynamodb')
+
+        self.assertIs(get_boto3_client('dynamodb'), client)
+        self.assertIsNot(get_boto3_client('sns'), client)
+        self.assertIsNot(get_boto3_client('dynamodb', region_name='eu-west-1'), client)
+        self.assertIsNot(get_boto3_client('dynamodb', max_pool_connections=100), client)
+        self.assertEqual(self.boto3_client.call_count, 4)
+
+
+    def test_get_boto3_client__config(self):
+        get_boto3_client('dynamodb', region_name='eu-west-1', max_pool_connections=100, retry_mode='adaptive')
+
+        args, kwargs = self.boto3_client.call_args
+        self.assertEqual(args, ('dynamodb',))
+        self.assertEqual(kwargs['region_name'], 'eu-west-1')
+
+        config = kwargs['config']
+        self.assertEqual(config.max_pool_connections, 100)
+        self.assertEqual(config.retries, {'mode': 'adaptive'})
+
+
+    def test_get_boto3_client__unsupported_by_botocore(self):
+        with patch('sosw.components.boto3_clients._UNSUPPORTED_SETTINGS', {'tcp_keepalive', 'retry_mode'}), \
+                self.assertLogs(level='WARNING') as logs:
+            client = get_boto3_client('dynamodb', tcp_keepalive=True, retry_mode='standard', max_attempts=3)
+
+        config = self.boto3_client.call_args[1]['config']
+        self.assertFalse(config.tcp_keepalive)
+        self.assertEqual(config.retries, {'max_attempts': 3})
+        self.assertEqual(len(logs.output), 2)
+
+        # The same client as without the ignored settings.
+        self.assertIs(get_boto3_client('dynamodb', max_attempts=3), client)
+
+
+    def test_get_boto3_client__botocore_defaults(self):
+        get_boto3_client('dynamodb')
+
+        config = self.boto3_client.call_args[1]['config']
+        self.assertEqual(config.max_pool_connections, 10)
+        self.assertFalse(config.tcp_keepalive)
+        self.assertIsNone(config.retries)
+
+
+    def test_get_boto3_client__defaults_from_environment(self):
+        env = {'SOSW_BOTO3_MAX_POOL_CONNECTIONS': '7', 'SOSW_BOTO3_TCP_KEEPALIVE': 'True',
+               'SOSW_BOTO3_RETRY_MODE': 'standard', 'SOSW_BOTO3_MAX_ATTEMPTS': '5'}
+        with patch.dict(os.environ, env):
+            get_boto3_client('dynamodb')
+
+        config = self.boto3_client.call_args[1]['config']
+        self.assertEqual(config.max_pool_connections, 7)
+        self.assertTrue(config.tcp_keepalive)
+        self.assertEqual(config.retries, {'mode': 'standard', 'max_attempts': 5})
+
+
+    def test_reset_boto3_clients(self):
+        client = get_boto3_client('dynamodb')
+        reset_boto3_clients()
+
+        self.assertIsNot(get_boto3_client('dynamodb'), client)
+
+
+if __name__ == '__main__':
+    unittest.main()
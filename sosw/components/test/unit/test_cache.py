@@ -0,0 +1,64 @@
+import unittest
+
+from unittest.mock import MagicMock, patch
+
+from sosw.components.cache import TTLCache
+
+
+class TTLCache_UnitTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = TTLCache(max_size=3, ttl=10)
+
+
+    def test_get_set(self):
+        self.cache.set('a', 1)
+
+        self.assertEqual(self.cache.get('a'), 1)
+        self.assertIsNone(self.cache.get('b'))
+        self.assertEqual(self.cache.get('b', 42), 42)
+        self.assertIn('a', self.cache)
+
+
+    def test_expires(self):
+        with patch('time.time') as t:
+            t.return_value = 1000
+            self.cache.set('a', 1)
+            self.cache.set('b', 2, ttl=100)
+
+            t.return_value = 1010
+            self.assertIsNone(self.cache.get('a'))
+            self.assertEqual(self.cache.get('b'), 2)
+
+
+    def test_evicts_least_recently_used(self):
+        for k in 'abc':
+            self.cache.set(k, k)
+
+        # Touch the oldest one, so that `b` becomes the least recently used.
+        self.cache.get('a')
+        self.cache.set('d', 'd')
+
+        self.assertEqual(len(self.cache), 3)
+        self.assertNotIn('b', self.cache)
+        self.assertIn('a', self.cache)
+
+
+    def test_invalidate(self):
+        self.cache.set('a', 1)
+        self.cache.invalidate('a')
+        self.cache.invalidate('missing')
+
+        self.assertNotIn('a', self.cache)
+
+
+    def test_get_or_set(self):
+        fn = MagicMock(return_value=42)
+
+        self.assertEqual(self.cache.get_or_set('a', fn), 42)
+        self.assertEqual(self.cache.get_or_set('a', fn), 42)
+        fn.assert_called_once()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from unittest.mock import MagicMock, patch
+
+from sosw.components.claim_check import *
+from sosw.components.boto3_clients import reset_boto3_clients
+
+
+class claim_check_UnitTestCase(unittest.TestCase):
+
+    PAYLOAD = {'foo': 42, 'bar': ['baz'] * 10}
+
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.store = get_claim_check_store(f"file://{self.path}/payloads")
+
+
+    def tearDown(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+        reset_boto3_clients()
+
+
+    def test_local_store(self):
+        pointer = self.store.put(self.PAYLOAD)
+
+        self.assertTrue(is_claim_check(pointer))
+        self.assertTrue(pointer[CLAIM_CHECK_FIELD].startswith(f"file://{self.path}/payloads/"))
+        self.assertEqual(self.store.get(pointer), self.PAYLOAD)
+        self.assertEqual(resolve_claim_check(pointer), self.PAYLOAD)
+        self.assertEqual(os.listdir(os.path.join(self.path, 'payloads')), [pointer[CLAIM_CHECK_FIELD].split('/')[-1]])
+
+
+    def test_put__content_hash_key(self):
+        pointer = self.store.put({'a': 1, 'b': 2})
+
+        self.assertEqual(self.store.put({'b': 2, 'a': 1}), pointer)
+        self.assertNotEqual(self.store.put({'a': 1, 'b': 3}), pointer)
+
+
+    def test_resolve_claim_check__merges_other_fields(self):
+        pointer = self.store.put(self.PAYLOAD)
+        event = dict(pointer, task_id='123')
+
+        self.assertEqual(resolve_claim_check(event), dict(self.PAYLOAD, task_id='123'))
+        self.assertEqual(resolve_claim_check({'task_id': '123'}), {'task_id': '123'})
+
+
+    def test_s3_store(self):
+        reset_boto3_clients()
+        with patch('boto3.client') as boto3_client:
+            s3_client = boto3_client.return_value
+            store = get_claim_check_store('s3://autotest-bucket/sosw/payloads/')
+
+            pointer = store.put(self.PAYLOAD)
+
+            call_kwargs = s3_client.put_object.call_args[1]
+            self.assertEqual(call_kwargs['Bucket'], 'autotest-bucket')
+            self.assertTrue(call_kwargs['Key'].startswith('sosw/payloads/'))
+            self.assertEqual(pointer[CLAIM_CHECK_FIELD], f"s3://autotest-bucket/{call_kwargs['Key']}")
+
+            s3_client.get_object.return_value = {'Body': MagicMock(read=MagicMock(return_value=call_kwargs['Body']))}
+            self.assertEqual(resolve_claim_check(pointer), self.PAYLOAD)
+            s3_client.get_object.assert_called_once_with(Bucket='autotest-bucket', Key=call_kwargs['Key'])
+
+
+    def test_claim_check_store__abstract(self):
+        self.assertRaises(TypeError, ClaimCheckStore, 'some/where')
+
+
+    def test_put__serialized_data(self):
+        data = ClaimCheckStore.serialize(self.PAYLOAD)
+
+        with patch.object(ClaimCheckStore, 'serialize') as serialize:
+            pointer = self.store.put(self.PAYLOAD, data=data)
+            serialize.assert_not_called()
+
+        self.assertEqual(pointer, self.store.put(self.PAYLOAD))
+
+
+    def test_get_claim_check_store__unsupported(self):
+        self.assertRaises(ValueError, get_claim_check_store, 'ftp://some/where')
+
+
+if __name__ == '__main__':
+    unittest.main()
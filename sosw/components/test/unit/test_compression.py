@@ -0,0 +1,50 @@
+import unittest
+
+from unittest.mock import patch
+
+from sosw.components import compression
+from sosw.components.compression import is_packed, pack, unpack
+
+
+class compression_UnitTestCase(unittest.TestCase):
+
+    VALUE = {'foo': 42, 'bar': ['baz'] * 100, 'nested': {'a': None, 'b': True, 'c': 0.5}}
+
+
+    def test_pack_unpack__json(self):
+        packed = pack(self.VALUE, use_msgpack=False)
+
+        self.assertTrue(packed.startswith(compression.MARKER_JSON))
+        self.assertTrue(is_packed(packed))
+        self.assertLess(len(packed), len(str(self.VALUE)))
+        self.assertEqual(unpack(packed), self.VALUE)
+
+
+    @unittest.skipIf(compression.msgpack is None, "msgpack is not installed")
+    def test_pack_unpack__msgpack(self):
+        packed = pack(self.VALUE, use_msgpack=True)
+
+        self.assertTrue(packed.startswith(compression.MARKER_MSGPACK))
+        self.assertEqual(unpack(packed), self.VALUE)
+
+
+    def test_pack__threshold(self):
+        self.assertIsNone(pack({'foo': 42}, threshold=100))
+        self.assertIsNotNone(pack({'foo': 42}, threshold=5))
+
+
+    def test_pack__default_format(self):
+        with patch.object(compression, 'msgpack', None):
+            self.assertTrue(pack(self.VALUE).startswith(compression.MARKER_JSON))
+            self.assertRaises(RuntimeError, pack, self.VALUE, use_msgpack=True)
+            self.assertRaises(RuntimeError, unpack, compression.MARKER_MSGPACK + b'x')
+
+
+    def test_unpack__unknown_marker(self):
+        self.assertFalse(is_packed(b'plain bytes'))
+        self.assertFalse(is_packed('zj1 string'))
+        self.assertRaises(ValueError, unpack, b'plain bytes')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,11 +1,13 @@
 import boto3
+import botocore.exceptions
 import csv
 import logging
 import os
+import tempfile
 import unittest
 from unittest.mock import patch, MagicMock
 
-from sosw.components.config import ConfigSource
+from sosw.components.config import ConfigSource, DynamoConfig, SSMConfig
 
 
 logging.getLogger('botocore').setLevel(logging.WARNING)
@@ -67,5 +69,239 @@ class Config_UnitTestCase(unittest.TestCase):
         self.assertEqual(config_source.default_source, getattr(config_source, 'ssm_config'))
 
 
+    def get_cached_config_source(self, **config):
+        with patch('sosw.components.config.DynamoConfig'):
+            config_source = ConfigSource(test=True, config={'cache_ttl': 60, **config})
+
+        config_source.default_source.get_config.side_effect = lambda name: {'name': name}
+        config_source.default_source.get_configs.side_effect = lambda names: {x: {'name': x} for x in names}
+        return config_source
+
+
+    def test_get_config__not_cached_by_default(self):
+        self.config_source.get_config('something')
+        self.config_source.get_config('something')
+
+        self.assertEqual(self.config_source.default_source.get_config.call_count, 2)
+
+
+    def test_get_config__cached(self):
+        config_source = self.get_cached_config_source()
+
+        config = config_source.get_config('something')
+        config['name'] = 'changed'
+
+        self.assertEqual(config_source.get_config('something'), {'name': 'something'})
+        config_source.default_source.get_config.assert_called_once_with('something')
+
+
+    @patch('time.time')
+    def test_get_config__ttl(self, mock_time):
+        mock_time.return_value = 1000
+        config_source = self.get_cached_config_source(cache_ttls={'short': 10})
+
+        config_source.get_config('short')
+        config_source.get_config('long')
+        config_source.get_config('uncached', ttl=0)
+
+        mock_time.return_value = 1030
+        for name in ['short', 'long', 'uncached']:
+            config_source.get_config(name)
+
+        self.assertEqual([x[0][0] for x in config_source.default_source.get_config.call_args_list],
+                         ['short', 'long', 'uncached', 'short', 'uncached'])
+
+
+    @patch('time.time')
+    def test_get_config__stale_on_error(self, mock_time):
+        mock_time.return_value = 1000
+        config_source = self.get_cached_config_source()
+        config_source.get_config('something')
+
+        mock_time.return_value = 2000
+        config_source.default_source.get_config.side_effect = RuntimeError("Throttled")
+
+        self.assertEqual(config_source.get_config('something'), {'name': 'something'})
+        self.assertRaises(RuntimeError, config_source.get_config, 'other')
+
+
+    def test_get_config__disk_cache(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            self.get_cached_config_source(cache_dir=cache_dir).get_config('something')
+
+            config_source = self.get_cached_config_source(cache_dir=cache_dir)
+            self.assertEqual(config_source.get_config('something'), {'name': 'something'})
+            config_source.default_source.get_config.assert_not_called()
+
+            config_source.update_config('something', 'value')
+            self.assertEqual(os.listdir(cache_dir), [])
+
+
+    def test_get_credentials_by_prefix__not_on_disk_by_default(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            config_source = self.get_cached_config_source(cache_dir=cache_dir)
+            config_source.default_source.get_credentials_by_prefix.return_value = {'password': 'secret'}
+
+            self.assertEqual(config_source.get_credentials_by_prefix('some'), {'password': 'secret'})
+            self.assertEqual(config_source.get_credentials_by_prefix('some'), {'password': 'secret'})
+            config_source.default_source.get_credentials_by_prefix.assert_called_once()
+            self.assertEqual(os.listdir(cache_dir), [])
+
+            config_source.config['cache_credentials_on_disk'] = True
+            config_source.invalidate_cache()
+            config_source.get_credentials_by_prefix('some')
+            self.assertEqual(len(os.listdir(cache_dir)), 1)
+
+
+    def test_get_configs(self):
+        config_source = self.get_cached_config_source()
+        config_source.get_config('cached')
+
+        result = config_source.get_configs(['cached', 'one', 'two'])
+
+        self.assertEqual(result, {x: {'name': x} for x in ['cached', 'one', 'two']})
+        config_source.default_source.get_configs.assert_called_once_with(['one', 'two'])
+
+
+    def test_dynamo_config__get_configs(self):
+        dynamo_config = DynamoConfig(test=True)
+        dynamo_config.dynamo_client = MagicMock()
+        dynamo_config.dynamo_client.batch_get_items_one_table.return_value = [
+            {'env': 'production', 'config_name': 'one', 'config_value': '{"a": 1}'},
+            {'env': 'production', 'config_name': 'two', 'config_value': 'some string'},
+        ]
+
+        result = dynamo_config.get_configs(['one', 'two', 'missing'])
+
+        self.assertEqual(result, {'one': {'a': 1}, 'two': 'some string', 'missing': {}})
+        dynamo_config.dynamo_client.batch_get_items_one_table.assert_called_once_with(
+                [{'env': 'production', 'config_name': x} for x in ['one', 'two', 'missing']])
+
+
+    def test_ssm_config__get_configs(self):
+        ssm_config = SSMConfig(test=True)
+        ssm_config.ssm_client = MagicMock()
+        ssm_config.ssm_client.get_parameters.side_effect = lambda Names, **kwargs: {
+            'Parameters': [{'Name': x, 'Value': f'{{"name": "{x}"}}'} for x in Names if x != 'missing']
+        }
+
+        names = [f"config_{i}" for i in range(11)] + ['missing']
+        result = ssm_config.get_configs(names)
+
+        self.assertEqual(ssm_config.ssm_client.get_parameters.call_count, 2)
+        self.assertEqual(result['missing'], {})
+        self.assertEqual(result['config_10'], {'name': 'config_10'})
+        self.assertEqual(len(result), 12)
+
+
+    def test_ssm_config__get_configs__without_decryption(self):
+        ssm_config = self.get_ssm_config()
+        denied = botocore.exceptions.ClientError({'Error': {'Code': 'AccessDeniedException'}}, 'GetParameters')
+        ssm_config.ssm_client.get_parameters.side_effect = [denied, {'Parameters': [{'Name': 'a', 'Value': '{}'}]}]
+
+        self.assertEqual(ssm_config.get_configs(['a']), {'a': {}})
+        self.assertEqual(ssm_config.ssm_client.get_parameters.call_args[1]['WithDecryption'], False)
+
+
+    @patch('time.sleep')
+    def test_ssm_config__get_configs__raises(self, mock_sleep):
+        ssm_config = self.get_ssm_config()
+        ssm_config.config['throttle_max_retries'] = 0
+        throttled = botocore.exceptions.ClientError({'Error': {'Code': 'ThrottlingException'}}, 'GetParameters')
+
+        for err in [throttled, KeyboardInterrupt(), RuntimeError("Bug")]:
+            ssm_config.ssm_client.get_parameters.reset_mock()
+            ssm_config.ssm_client.get_parameters.side_effect = err
+
+            self.assertRaises(type(err), ssm_config.get_configs, ['a'])
+            ssm_config.ssm_client.get_parameters.assert_called_once()
+
+
+    @unittest.skipIf(os.environ.get('SOSW_CONFIG_CACHE_TTL'), "The cache of global config source is set explicitly")
+    def test_global_config_source__cache_disabled_by_default(self):
+        import sosw.components.config as config_module
+
+        global_source = vars(config_module)['__config_source']
+        self.assertEqual(global_source.config['cache_ttl'], 0)
+        self.assertEqual(global_source._get_cache_ttl('some_config'), 0)
+
+
+    def get_ssm_config(self):
+        ssm_config = SSMConfig(test=True)
+        ssm_config.ssm_client = MagicMock()
+        return ssm_config
+
+
+    def test_ssm_config__call_boto_with_pagination(self):
+        ssm_config = self.get_ssm_config()
+        ssm_config.ssm_client.describe_parameters.side_effect = [
+            {'Parameters': [1], 'NextToken': 'a'},
+            {'Parameters': [2], 'NextToken': 'b'},
+            {'Parameters': [3]},
+        ]
+
+        result = ssm_config.call_boto_with_pagination('describe_parameters', MaxResults=1)
+
+        self.assertEqual([x['Parameters'] for x in result], [[1], [2], [3]])
+        self.assertEqual(ssm_config.ssm_client.describe_parameters.call_args[1], {'MaxResults': 1, 'NextToken': 'b'})
+
+
+    @patch('time.sleep')
+    def test_ssm_config__call_boto_with_pagination__throttled_page(self, mock_sleep):
+        ssm_config = self.get_ssm_config()
+        throttled = botocore.exceptions.ClientError({'Error': {'Code': 'ThrottlingException'}}, 'DescribeParameters')
+        ssm_config.ssm_client.describe_parameters.side_effect = [
+            {'Parameters': [1], 'NextToken': 'a'},
+            throttled,
+            {'Parameters': [2]},
+        ]
+
+        result = ssm_config.call_boto_with_pagination('describe_parameters')
+
+        self.assertEqual([x['Parameters'] for x in result], [[1], [2]])
+        ssm_config.ssm_client.get_paginator.assert_not_called()
+        mock_sleep.assert_called_once()
+
+
+    @patch('time.sleep')
+    def test_ssm_config__throttling(self, mock_sleep):
+        ssm_config = self.get_ssm_config()
+        throttled = botocore.exceptions.ClientError({'Error': {'Code': 'ThrottlingException'}}, 'GetParameters')
+        ssm_config.ssm_client.get_parameters.side_effect = [throttled, throttled, {'Parameters': []}]
+
+        self.assertEqual(ssm_config._call_ssm('get_parameters', Names=['a']), {'Parameters': []})
+        self.assertEqual(mock_sleep.call_count, 2)
+
+        ssm_config.config['throttle_max_retries'] = 1
+        ssm_config.ssm_client.get_parameters.side_effect = [throttled, throttled]
+        self.assertRaises(botocore.exceptions.ClientError, ssm_config._call_ssm, 'get_parameters', Names=['a'])
+
+
+    def test_ssm_config__get_credentials_by_prefix(self):
+        ssm_config = self.get_ssm_config()
+        names = [f"autotest_{i}" for i in range(25)]
+        ssm_config.ssm_client.describe_parameters.return_value = {
+            'Parameters': [{'Name': x, 'Type': 'SecureString'} for x in names]
+        }
+        ssm_config.ssm_client.get_parameters.side_effect = lambda Names, **kwargs: {
+            'Parameters': [{'Name': x, 'Value': x.upper()} for x in Names]
+        }
+
+        result = ssm_config.get_credentials_by_prefix('autotest')
+
+        self.assertEqual(ssm_config.ssm_client.get_parameters.call_count, 3)
+        self.assertEqual(result, {str(i): f"AUTOTEST_{i}" for i in range(25)})
+
+
+    def test_get_credentials_by_prefix__cached(self):
+        config_source = self.get_cached_config_source()
+        config_source.default_source.get_credentials_by_prefix.return_value = {'user': 'me'}
+
+        config_source.get_credentials_by_prefix('some')
+        self.assertEqual(config_source.get_credentials_by_prefix('some'), {'user': 'me'})
+
+        config_source.default_source.get_credentials_by_prefix.assert_called_once_with('some')
+
+
 if __name__ == '__main__':
     unittest.main()
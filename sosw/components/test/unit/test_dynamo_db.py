@@ -1,9 +1,13 @@
 import boto3
+import botocore.exceptions
+import itertools
+import json
 import logging
 import time
 import unittest
 import os
 
+from concurrent.futures import ThreadPoolExecutor
 from unittest.mock import MagicMock, patch
 
 
@@ -13,6 +17,7 @@ os.environ["STAGE"] = "test"
 os.environ["autotest"] = "True"
 
 from sosw.components.dynamo_db import DynamoDbClient
+from sosw.components.boto3_clients import reset_boto3_clients
 
 
 class dynamodb_client_UnitTestCase(unittest.TestCase):
@@ -40,6 +45,7 @@ class dynamodb_client_UnitTestCase(unittest.TestCase):
         self.KEYS = ('hash_col', 'range_col')
         self.table_name = 'autotest_dynamo_db'
 
+        reset_boto3_clients()
         self.patcher = patch("boto3.client")
         self.dynamo_mock = MagicMock()
         self.paginator_mock = MagicMock()
@@ -53,6 +59,7 @@ class dynamodb_client_UnitTestCase(unittest.TestCase):
 
     def tearDown(self):
         self.patcher.stop()
+        reset_boto3_clients()
 
 
     def test_dict_to_dynamo_strict(self):
@@ -149,6 +156,125 @@ class dynamodb_client_UnitTestCase(unittest.TestCase):
 
 
 
+    def test_dynamo_rows_to_dicts(self):
+        dynamo_rows = [
+            {'hash_col': {'S': 'cat'}, 'range_col': {'N': '1'}, 'other_col': {'S': '{"a": 1}'}, 'extra': {'N': '1'}},
+            {'hash_col': {'S': 'dog'}, 'range_col': {'N': '2.5'}},
+        ]
+
+        for strict in (True, False):
+            self.assertEqual(self.dynamo_client.dynamo_rows_to_dicts(dynamo_rows, strict=strict),
+                             [self.dynamo_client.dynamo_to_dict(x, strict=strict) for x in dynamo_rows])
+
+        self.assertEqual(self.dynamo_client.dynamo_rows_to_dicts(dynamo_rows), [
+            {'hash_col': 'cat', 'range_col': 1, 'other_col': {'a': 1}},
+            {'hash_col': 'dog', 'range_col': 2.5},
+        ])
+
+
+    def test_dynamo_to_dict__recompiles_codec_for_new_row_mapper(self):
+        dynamo_row = {'hash_col': {'S': 'cat'}, 'range_col': {'N': '1'}}
+        self.assertEqual(self.dynamo_client.dynamo_to_dict(dynamo_row), {'hash_col': 'cat', 'range_col': 1})
+
+        self.dynamo_client.row_mapper = {'hash_col': 'S'}
+        self.assertEqual(self.dynamo_client.dynamo_to_dict(dynamo_row), {'hash_col': 'cat'})
+        self.assertEqual(self.dynamo_client.dict_to_dynamo({'range_col': 1}, strict=False), {'range_col': {'N': '1'}})
+
+
+    def test_dynamo_to_dict__unsupported_type(self):
+        self.dynamo_client.row_mapper = {'hash_col': 'S', 'range_col': 'XX'}
+
+        self.assertRaises(RuntimeError, self.dynamo_client.dynamo_to_dict, {'range_col': {'XX': '1'}})
+        self.assertRaises(RuntimeError, self.dynamo_client.dynamo_to_dict, {'foo': {'XX': '1'}}, strict=False)
+        self.assertRaises(RuntimeError, self.dynamo_client.dict_to_dynamo, {'range_col': '1'})
+
+
+    def test_native_types__round_trip(self):
+        self.dynamo_client.row_mapper = {
+            'hash_col': 'S', 'map_col': 'M', 'list_col': 'L', 'bool_col': 'BOOL', 'null_col': 'NULL',
+            'ss_col':   'SS', 'ns_col': 'NS', 'bin_col': 'B',
+        }
+        row = {
+            'hash_col': 'cat',
+            'map_col':  {'foo': 42, 'bar': [1, 'two', None, True], 'baz': {'deep': 0.5}, 'json': '{"a": 1}'},
+            'list_col': [{'a': 1}, 'b', b'c'],
+            'bool_col': False,
+            'null_col': None,
+            'ss_col':   {'a', 'b'},
+            'ns_col':   {1, 2.5},
+            'bin_col':  b'\x00\x01',
+        }
+
+        dynamo_row = self.dynamo_client.dict_to_dynamo(row)
+
+        self.assertEqual(dynamo_row['map_col']['M']['foo'], {'N': '42'})
+        self.assertEqual(dynamo_row['map_col']['M']['bar']['L'],
+                         [{'N': '1'}, {'S': 'two'}, {'NULL': True}, {'BOOL': True}])
+        self.assertEqual(dynamo_row['bool_col'], {'BOOL': False})
+        self.assertEqual(dynamo_row['null_col'], {'NULL': True})
+        self.assertCountEqual(dynamo_row['ns_col']['NS'], ['1', '2.5'])
+
+        # Strings nested in Maps are never parsed as JSON.
+        self.assertEqual(self.dynamo_client.dynamo_to_dict(dynamo_row), row)
+        self.assertEqual(self.dynamo_client.dynamo_to_dict(dynamo_row, strict=False), row)
+
+
+    def test_dynamo_to_dict__map_stored_as_json_string(self):
+        self.dynamo_client.row_mapper = {'hash_col': 'S', 'map_col': 'M', 'range_col': 'N'}
+
+        self.assertEqual(self.dynamo_client.dynamo_to_dict({'map_col': {'S': '{"foo": 42}'}, 'range_col': {'S': '3'}}),
+                         {'map_col': {'foo': 42}, 'range_col': '3'})
+
+
+    def test_dynamo_to_dict__legacy_json_only_for_maps(self):
+        config = self.TEST_CONFIG.copy()
+        config['row_mapper'] = {'hash_col': 'S', 'map_col': 'M', 'range_col': 'N'}
+        config['compress_fields'] = ['map_col', 'other_col']
+        config['compress_threshold'] = 10
+        self.dynamo_client = DynamoDbClient(config=config)
+
+        json_string = '{"foo": "' + 'x' * 50 + '"}'
+
+        # A JSON-looking string of a field declared with other type than Map or List is not loaded.
+        self.assertEqual(self.dynamo_client.dynamo_to_dict({'range_col': {'S': json_string}}),
+                         {'range_col': json_string})
+
+        # Neither is a compressed string of a field that is not in row_mapper.
+        dynamo_row = self.dynamo_client.dict_to_dynamo({'other_col': json_string}, strict=False)
+        self.assertIn('B', dynamo_row['other_col'])
+        self.assertEqual(self.dynamo_client.dynamo_to_dict(dynamo_row, strict=False), {'other_col': json_string})
+
+        self.assertEqual(self.dynamo_client.dynamo_to_dict({'map_col': {'S': json_string}}),
+                         {'map_col': json.loads(json_string)})
+        self.assertEqual(self.dynamo_client.dynamo_to_dict({'map_col': {'S': '{not json}'}}),
+                         {'map_col': '{not json}'})
+
+
+    def test_compress_fields(self):
+        config = self.TEST_CONFIG.copy()
+        config['row_mapper'] = {'hash_col': 'S', 'payload': 'M', 'json_payload': 'S'}
+        config['compress_fields'] = ['payload', 'json_payload']
+        config['compress_threshold'] = 100
+        self.dynamo_client = DynamoDbClient(config=config)
+
+        big = {'foo': 'x' * 500, 'bar': [1, 2, 3]}
+        row = {'hash_col': 'cat', 'payload': big, 'json_payload': json.dumps(big)}
+        dynamo_row = self.dynamo_client.dict_to_dynamo(row)
+
+        self.assertIn('B', dynamo_row['payload'])
+        self.assertIn('B', dynamo_row['json_payload'])
+        self.assertLess(len(dynamo_row['payload']['B']), 100)
+
+        # JSON strings are loaded the same way as if they were stored uncompressed.
+        expected = {'hash_col': 'cat', 'payload': big, 'json_payload': big}
+        self.assertEqual(self.dynamo_client.dynamo_to_dict(dynamo_row), expected)
+        self.assertEqual(self.dynamo_client.dynamo_to_dict(dynamo_row, strict=False), expected)
+
+        # Small values are not compressed.
+        dynamo_row = self.dynamo_client.dict_to_dynamo({'hash_col': 'cat', 'payload': {'foo': 42}})
+        self.assertEqual(dynamo_row['payload'], {'M': {'foo': {'N': '42'}}})
+
+
     def test_get_by_query__validates_comparison(self):
         self.assertRaises(AssertionError, self.dynamo_client.get_by_query, keys={'k': '1'},
                           comparisons={'k': 'unsupported'})
@@ -174,6 +300,547 @@ class dynamodb_client_UnitTestCase(unittest.TestCase):
                       kwargs['KeyConditionExpression'])
 
 
+    def test_get_by_query__projection_from_row_mapper(self):
+        self.dynamo_client.get_by_query(keys={'hash_col': 'cat'})
+
+        args, kwargs = self.paginator_mock.paginate.call_args
+
+        self.assertEqual(kwargs['Select'], 'SPECIFIC_ATTRIBUTES')
+        self.assertEqual(sorted(kwargs['ExpressionAttributeNames'].values()),
+                         sorted(self.TEST_CONFIG['row_mapper'].keys()))
+        self.assertEqual(kwargs['ProjectionExpression'].split(', '), list(kwargs['ExpressionAttributeNames'].keys()))
+
+
+    def test_get_by_query__projection_fields(self):
+        self.dynamo_client.get_by_query(keys={'hash_col': 'cat'}, fields=['range_col'])
+
+        args, kwargs = self.paginator_mock.paginate.call_args
+        self.assertEqual(kwargs['ProjectionExpression'], '#p0')
+        self.assertEqual(kwargs['ExpressionAttributeNames'], {'#p0': 'range_col'})
+
+
+    def test_get_by_query__no_projection(self):
+        self.dynamo_client.get_by_query(keys={'hash_col': 'cat'}, index_name='some_index', strict=False)
+
+        args, kwargs = self.paginator_mock.paginate.call_args
+        self.assertEqual(kwargs['Select'], 'ALL_PROJECTED_ATTRIBUTES')
+        self.assertNotIn('ProjectionExpression', kwargs)
+
+        self.dynamo_client.get_by_query(keys={'hash_col': 'cat'}, return_count=True)
+
+        args, kwargs = self.paginator_mock.paginate.call_args
+        self.assertEqual(kwargs['Select'], 'COUNT')
+        self.assertNotIn('ProjectionExpression', kwargs)
+
+
+    def test_get_by_scan__projection_fields(self):
+        self.paginator_mock.paginate.return_value = []
+
+        self.dynamo_client.get_by_scan(fields=['hash_col', 'range_col'])
+
+        args, kwargs = self.paginator_mock.paginate.call_args
+        self.assertEqual(kwargs['Select'], 'SPECIFIC_ATTRIBUTES')
+        self.assertEqual(kwargs['ExpressionAttributeNames'], {'#p0': 'hash_col', '#p1': 'range_col'})
+
+
+    def test_get_by_query__return_count_sums_pages(self):
+        self.paginator_mock.paginate.return_value = [{'Count': 3, 'Items': []}, {'Count': 5}, {'Count': 2}]
+
+        self.assertEqual(self.dynamo_client.get_by_query(keys={'hash_col': 'cat'}, return_count=True), 10)
+        self.assertEqual(self.dynamo_client.stats['dynamo_count_queries'], 3)
+
+        args, kwargs = self.paginator_mock.paginate.call_args
+        self.assertEqual(kwargs['Select'], 'COUNT')
+
+
+    def test_get_by_query__return_count_approximate(self):
+        self.paginator_mock.paginate.return_value = [{'Count': 3}, {'Count': 5}, {'Count': 2}]
+
+        self.assertEqual(self.dynamo_client.get_by_query(keys={'hash_col': 'cat'}, return_count=True,
+                                                         approximate=True), 3)
+
+
+    def test_get_by_query__return_count_parallel(self):
+
+        def paginate(**kwargs):
+            st = int(kwargs['ExpressionAttributeValues'][':st_between_range_col']['N'])
+            en = int(kwargs['ExpressionAttributeValues'][':en_between_range_col']['N'])
+            # Imitate one item for every value of range_col in two pages.
+            return [{'Count': (en - st + 1) // 2}, {'Count': (en - st + 1) - (en - st + 1) // 2}]
+
+        self.paginator_mock.paginate.side_effect = paginate
+
+        keys = {'hash_col': 'cat', 'st_between_range_col': 1000, 'en_between_range_col': 1999}
+        result = self.dynamo_client.get_by_query(keys=keys, return_count=True, count_workers=3)
+
+        self.assertEqual(result, 1000)
+        self.assertEqual(self.paginator_mock.paginate.call_count, 3)
+
+        ranges = sorted((int(kw['ExpressionAttributeValues'][':st_between_range_col']['N']),
+                         int(kw['ExpressionAttributeValues'][':en_between_range_col']['N']))
+                        for _, kw in self.paginator_mock.paginate.call_args_list)
+        self.assertEqual(ranges, [(1000, 1332), (1333, 1665), (1666, 1999)])
+
+
+    def test_get_by_query__max_items_sets_page_size(self):
+        self.paginator_mock.paginate.return_value = [{'Items': [{'hash_col': {'S': 'cat'}}]}]
+
+        self.dynamo_client.get_by_query(keys={'hash_col': 'cat'}, max_items=1)
+
+        args, kwargs = self.paginator_mock.paginate.call_args
+        self.assertEqual(kwargs['PaginationConfig'], {'MaxItems': 1, 'PageSize': 1})
+
+        # With filtering DynamoDB may need to evaluate more items than we want to receive.
+        self.dynamo_client.get_by_query(keys={'hash_col': 'cat'}, max_items=1, filter_expression='range_col > 3')
+
+        args, kwargs = self.paginator_mock.paginate.call_args
+        self.assertEqual(kwargs['PaginationConfig'], {'MaxItems': 1})
+
+
+    def test_get_by_query_generator__lazy(self):
+        pages_fetched = []
+
+        def paginate(**kwargs):
+            for i in range(3):
+                pages_fetched.append(i)
+                yield {'Items': [{'hash_col': {'S': 'cat'}, 'range_col': {'N': str(i * 10 + j)}} for j in range(2)]}
+
+        self.paginator_mock.paginate.side_effect = paginate
+
+        gen = self.dynamo_client.get_by_query_generator(keys={'hash_col': 'cat'})
+        self.assertEqual(pages_fetched, [])
+
+        self.assertEqual(next(gen), {'hash_col': 'cat', 'range_col': 0})
+        self.assertEqual(next(gen), {'hash_col': 'cat', 'range_col': 1})
+        self.assertEqual(pages_fetched, [0])
+
+        self.assertEqual(len(list(gen)), 4)
+        self.assertEqual(pages_fetched, [0, 1, 2])
+
+
+    def test_get_by_query__max_items(self):
+        self.paginator_mock.paginate.return_value = [
+            {'Items': [{'hash_col': {'S': 'cat'}, 'range_col': {'N': str(i)}} for i in range(3)]}] * 2
+
+        result = self.dynamo_client.get_by_query(keys={'hash_col': 'cat'}, max_items=4)
+        self.assertEqual([x['range_col'] for x in result], [0, 1, 2, 0])
+
+
+    def test_get_item(self):
+        self.dynamo_mock.get_item.return_value = {'Item': {'hash_col': {'S': 'cat'}, 'range_col': {'N': '1'}}}
+
+        result = self.dynamo_client.get_item({'hash_col': 'cat', 'range_col': 1}, consistent=True)
+
+        self.assertEqual(result, {'hash_col': 'cat', 'range_col': 1})
+        self.dynamo_mock.get_item.assert_called_once_with(
+                TableName=self.table_name, Key={'hash_col': {'S': 'cat'}, 'range_col': {'N': '1'}}, ConsistentRead=True,
+                ReturnConsumedCapacity='INDEXES')
+
+
+    def test_get_item__not_found(self):
+        self.dynamo_mock.get_item.return_value = {}
+
+        self.assertEqual(self.dynamo_client.get_item({'hash_col': 'cat', 'range_col': 1}), {})
+
+
+    def test_get_item__read_cache(self):
+        config = self.TEST_CONFIG.copy()
+        config['read_cache_size'] = 10
+        self.dynamo_client = DynamoDbClient(config=config)
+
+        keys = {'hash_col': 'cat', 'range_col': 1}
+        self.dynamo_mock.get_item.return_value = {'Item': {'hash_col': {'S': 'cat'}, 'range_col': {'N': '1'}}}
+
+        first = self.dynamo_client.get_item(keys, cached=True)
+        first['other_col'] = 'modified by caller'
+
+        self.assertEqual(self.dynamo_client.get_item(keys, cached=True), {'hash_col': 'cat', 'range_col': 1})
+        self.dynamo_mock.get_item.assert_called_once()
+        self.assertEqual(self.dynamo_client.stats['dynamo_read_cache_hits'], 1)
+
+        # Consistent read skips the cache.
+        self.dynamo_client.get_item(keys, consistent=True, cached=True)
+        self.assertEqual(self.dynamo_mock.get_item.call_count, 2)
+
+        # Reads that don't tolerate stale data skip the cache by default.
+        self.dynamo_client.get_item(keys)
+        self.assertEqual(self.dynamo_mock.get_item.call_count, 3)
+
+
+    def test_get_item__read_cache_invalidated_by_writes(self):
+        config = self.TEST_CONFIG.copy()
+        config['read_cache_size'] = 10
+        self.dynamo_client = DynamoDbClient(config=config)
+
+        keys = {'hash_col': 'cat', 'range_col': 1}
+        self.dynamo_mock.get_item.return_value = {'Item': {'hash_col': {'S': 'cat'}, 'range_col': {'N': '1'}}}
+        self.dynamo_mock.batch_write_item.return_value = {'UnprocessedItems': {}}
+
+        writes = [
+            lambda: self.dynamo_client.put({'hash_col': 'cat', 'range_col': 1, 'other_col': 'foo'}),
+            lambda: self.dynamo_client.update(keys, attributes_to_update={'other_col': 'bar'}),
+            lambda: self.dynamo_client.delete(keys),
+            lambda: self.dynamo_client.batch_put([{'hash_col': 'cat', 'range_col': 1}]),
+            lambda: self.dynamo_client.transact_write(self.dynamo_client.make_delete_transaction_item(keys, None)),
+        ]
+
+        for i, write in enumerate(writes, start=1):
+            self.dynamo_client.get_item(keys, cached=True)
+            self.dynamo_client.get_item(keys, cached=True)
+            self.assertEqual(self.dynamo_mock.get_item.call_count, i)
+
+            write()
+
+        # The write of some other item doesn't invalidate.
+        self.dynamo_client.get_item(keys, cached=True)
+        self.dynamo_client.delete({'hash_col': 'dog', 'range_col': 1})
+        self.dynamo_client.get_item(keys, cached=True)
+        self.assertEqual(self.dynamo_mock.get_item.call_count, len(writes) + 1)
+
+
+    def test_batch_get_items_one_table__chunks(self):
+        keys = [{'hash_col': f"key{i}"} for i in range(250)]
+
+        def batch_get_item(RequestItems, **kwargs):
+            return {'Responses': {self.table_name: RequestItems[self.table_name]['Keys']}}
+
+        self.dynamo_mock.batch_get_item.side_effect = batch_get_item
+
+        result = self.dynamo_client.batch_get_items_one_table(keys)
+
+        self.assertEqual(self.dynamo_mock.batch_get_item.call_count, 3)
+        self.assertEqual(sorted(len(c[1]['RequestItems'][self.table_name]['Keys'])
+                                for c in self.dynamo_mock.batch_get_item.call_args_list), [50, 100, 100])
+        self.assertCountEqual([x['hash_col'] for x in result], [x['hash_col'] for x in keys])
+        self.assertEqual(self.dynamo_client.stats['dynamo_batch_get_queries'], 3)
+
+
+    def test_batch_get_items_one_table__retries_unprocessed_keys(self):
+        keys = [{'hash_col': 'cat'}, {'hash_col': 'dog'}]
+        dog = {'hash_col': {'S': 'dog'}}
+
+        self.dynamo_mock.batch_get_item.side_effect = [
+            {'Responses': {self.table_name: [{'hash_col': {'S': 'cat'}}]},
+             'UnprocessedKeys': {self.table_name: {'Keys': [dog]}}},
+            {'Responses': {self.table_name: [dog]}, 'UnprocessedKeys': {}},
+        ]
+
+        with patch('time.sleep') as sleep_mock:
+            result = self.dynamo_client.batch_get_items_one_table(keys, fields=['hash_col'])
+
+        self.assertEqual(result, [{'hash_col': 'cat'}, {'hash_col': 'dog'}])
+        sleep_mock.assert_called_once()
+        self.assertLessEqual(sleep_mock.call_args[0][0], 0.2)
+
+        second_request = self.dynamo_mock.batch_get_item.call_args_list[1][1]['RequestItems'][self.table_name]
+        self.assertEqual(second_request, {'Keys': [dog]})
+
+        first_request = self.dynamo_mock.batch_get_item.call_args_list[0][1]['RequestItems'][self.table_name]
+        self.assertEqual(first_request['ProjectionExpression'], '#p0')
+        self.assertNotIn('Select', first_request)
+
+
+    def test_batch_get_items_one_table__raises_after_retries(self):
+        self.dynamo_mock.batch_get_item.return_value = {
+            'Responses':       {self.table_name: []},
+            'UnprocessedKeys': {self.table_name: {'Keys': [{'hash_col': {'S': 'cat'}}]}}
+        }
+
+        with patch('time.sleep'):
+            self.assertRaises(RuntimeError, self.dynamo_client.batch_get_items_one_table, [{'hash_col': 'cat'}],
+                              max_retries=2)
+
+        self.assertEqual(self.dynamo_mock.batch_get_item.call_count, 3)
+
+
+    def test_batch_get_items_one_table_generator__empty(self):
+        self.assertEqual(list(self.dynamo_client.batch_get_items_one_table_generator([])), [])
+        self.dynamo_mock.batch_get_item.assert_not_called()
+
+
+    def test_consumed_capacity(self):
+        self.paginator_mock.paginate.return_value = [
+            {'Items': [], 'ConsumedCapacity': {'TableName': self.table_name, 'CapacityUnits': 1.5,
+                                               'GlobalSecondaryIndexes': {'some_index': {'CapacityUnits': 1.5}}}},
+            {'Items': [], 'ConsumedCapacity': {'TableName': self.table_name, 'CapacityUnits': 0.5}},
+        ]
+        self.dynamo_mock.batch_write_item.return_value = {
+            'UnprocessedItems': {},
+            'ConsumedCapacity': [{'TableName': self.table_name, 'CapacityUnits': 2.0, 'WriteCapacityUnits': 2.0}]
+        }
+
+        self.dynamo_client.get_by_query(keys={'hash_col': 'cat'}, index_name='some_index')
+        self.dynamo_client.batch_put([{'hash_col': 'cat', 'range_col': 1}, {'hash_col': 'dog', 'range_col': 2}])
+
+        args, kwargs = self.paginator_mock.paginate.call_args
+        self.assertEqual(kwargs['ReturnConsumedCapacity'], 'INDEXES')
+
+        stats = self.dynamo_client.get_stats()
+        self.assertEqual(stats[f"dynamo_consumed_rcu_{self.table_name}"], 2.0)
+        self.assertEqual(stats[f"dynamo_consumed_rcu_{self.table_name}/some_index"], 1.5)
+        self.assertEqual(stats[f"dynamo_consumed_wcu_{self.table_name}"], 2.0)
+        self.assertEqual(stats['dynamo_consumed_wcu'], 2.0)
+
+
+    def test_consumed_capacity__disabled(self):
+        config = self.TEST_CONFIG.copy()
+        config['return_consumed_capacity'] = 'NONE'
+        self.dynamo_client = DynamoDbClient(config=config)
+
+        self.dynamo_client.get_by_query(keys={'hash_col': 'cat'})
+
+        args, kwargs = self.paginator_mock.paginate.call_args
+        self.assertNotIn('ReturnConsumedCapacity', kwargs)
+
+
+    def test_get_stats__latency(self):
+        for duration in [0.01] * 90 + [0.2] * 10:
+            self.dynamo_client._record_response('query', duration, {'Items': []})
+
+        stats = self.dynamo_client.get_stats()
+        self.assertAlmostEqual(stats['dynamo_latency_query_p50'], 10, delta=0.5)
+        self.assertAlmostEqual(stats['dynamo_latency_query_p90'], 10, delta=0.5)
+        self.assertAlmostEqual(stats['dynamo_latency_query_p99'], 200, delta=10)
+
+        self.dynamo_client.reset_stats()
+        self.assertNotIn('dynamo_latency_query_p50', self.dynamo_client.get_stats())
+
+
+    def test_record_response__concurrent(self):
+        response = {'ConsumedCapacity': {'TableName': self.table_name, 'CapacityUnits': 1}}
+
+        def record(_):
+            for _ in range(500):
+                self.dynamo_client._record_response('query', 0.01, response)
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(record, range(8)))
+
+        self.assertEqual(self.dynamo_client.latencies['query'].count, 4000)
+        self.assertEqual(self.dynamo_client.stats['dynamo_consumed_rcu'], 4000)
+
+
+    def test_call_dynamo__retries_throttling(self):
+        throttled = botocore.exceptions.ClientError({'Error': {'Code': 'ProvisionedThroughputExceededException'}},
+                                                    'PutItem')
+        self.dynamo_mock.put_item.side_effect = [throttled, throttled, {}]
+
+        with patch('time.sleep') as sleep_mock:
+            self.dynamo_client.put({'hash_col': 'cat', 'range_col': 1})
+
+        self.assertEqual(self.dynamo_mock.put_item.call_count, 3)
+        self.assertEqual(sleep_mock.call_count, 2)
+        self.assertEqual(self.dynamo_client.stats['dynamo_throttled_requests'], 2)
+
+
+    def test_call_dynamo__retries_throttled_transactions(self):
+        throttled = botocore.exceptions.ClientError(
+                {'Error': {'Code': 'TransactionCanceledException'},
+                 'CancellationReasons': [{'Code': 'None'}, {'Code': 'ThrottlingError'}]}, 'TransactWriteItems')
+        conflict = botocore.exceptions.ClientError(
+                {'Error': {'Code': 'TransactionCanceledException'},
+                 'CancellationReasons': [{'Code': 'ConditionalCheckFailed'}, {'Code': 'ThrottlingError'}]},
+                'TransactWriteItems')
+        transactions = [self.dynamo_client.make_delete_transaction_item({'hash_col': 'cat'}, None)]
+
+        self.dynamo_mock.transact_write_items.side_effect = [throttled, {}]
+        with patch('time.sleep'):
+            self.dynamo_client.transact_write(*transactions)
+        self.assertEqual(self.dynamo_mock.transact_write_items.call_count, 2)
+
+        # Transactions cancelled for other reasons are not retried.
+        self.dynamo_mock.transact_write_items.reset_mock()
+        self.dynamo_mock.transact_write_items.side_effect = [conflict, {}]
+        self.assertRaises(botocore.exceptions.ClientError, self.dynamo_client.transact_write, *transactions)
+        self.dynamo_mock.transact_write_items.assert_called_once()
+
+
+    def test_paginate__resumes_after_throttling(self):
+        throttled = botocore.exceptions.ClientError({'Error': {'Code': 'ProvisionedThroughputExceededException'}},
+                                                    'Query')
+        last_key = {'hash_col': {'S': 'cat'}, 'range_col': {'N': '1'}}
+
+        def first_pagination():
+            yield {'Items': [{'hash_col': {'S': 'cat'}, 'range_col': {'N': '1'}}], 'LastEvaluatedKey': last_key}
+            raise throttled
+
+        self.paginator_mock.paginate.side_effect = [
+            first_pagination(), [{'Items': [{'hash_col': {'S': 'cat'}, 'range_col': {'N': '2'}}]}]
+        ]
+
+        with patch('time.sleep') as sleep_mock:
+            result = self.dynamo_client.get_by_query({'hash_col': 'cat'}, max_items=5)
+
+        self.assertEqual([x['range_col'] for x in result], [1, 2])
+        sleep_mock.assert_called_once()
+        self.assertEqual(self.dynamo_client.stats['dynamo_throttled_requests'], 1)
+
+        first_kwargs, resumed_kwargs = [c[1] for c in self.paginator_mock.paginate.call_args_list]
+        self.assertNotIn('ExclusiveStartKey', first_kwargs)
+        self.assertEqual(resumed_kwargs['ExclusiveStartKey'], last_key)
+        self.assertEqual(resumed_kwargs['PaginationConfig']['MaxItems'], first_kwargs['PaginationConfig']['MaxItems'] - 1)
+
+
+    def test_paginate__raises_after_max_retries(self):
+        throttled = botocore.exceptions.ClientError({'Error': {'Code': 'ProvisionedThroughputExceededException'}},
+                                                    'Scan')
+
+        def pagination(**kwargs):
+            raise throttled
+            yield
+
+        self.paginator_mock.paginate.side_effect = pagination
+
+        with patch('time.sleep'):
+            self.assertRaises(botocore.exceptions.ClientError, self.dynamo_client.get_by_scan)
+
+        self.assertEqual(self.paginator_mock.paginate.call_count, 6)
+
+
+    def test_call_dynamo__raises_other_errors(self):
+        self.dynamo_mock.put_item.side_effect = botocore.exceptions.ClientError(
+                {'Error': {'Code': 'ConditionalCheckFailedException'}}, 'PutItem')
+
+        self.assertRaises(botocore.exceptions.ClientError, self.dynamo_client.put, {'hash_col': 'cat'})
+        self.dynamo_mock.put_item.assert_called_once()
+
+
+    def test_rate_limits(self):
+        config = self.TEST_CONFIG.copy()
+        config['rate_limits'] = {self.table_name: {'wcu': 1000}, f"{self.table_name}/some_index": {'wcu': 500}}
+        self.dynamo_client = DynamoDbClient(config=config)
+
+        self.dynamo_mock.put_item.return_value = {
+            'ConsumedCapacity': {'TableName': self.table_name, 'CapacityUnits': 3, 'Table': {'CapacityUnits': 2},
+                                 'GlobalSecondaryIndexes': {'some_index': {'CapacityUnits': 1}}}
+        }
+
+        with patch('sosw.components.dynamo_db.get_token_bucket') as get_token_bucket_mock:
+            self.dynamo_client.put({'hash_col': 'cat', 'range_col': 1})
+            # Reads from the table have no target.
+            self.dynamo_client.get_item({'hash_col': 'cat', 'range_col': 1})
+
+        self.assertEqual([c[0] for c in get_token_bucket_mock.call_args_list],
+                         [(f"{self.table_name}:wcu", 1000), (f"{self.table_name}/some_index:wcu", 500)])
+
+        bucket = get_token_bucket_mock.return_value
+        self.assertEqual(bucket.acquire.call_count, 2)
+        self.assertEqual(sorted(c[0][0] for c in bucket.consume.call_args_list), [0, 1])
+        self.assertEqual(bucket.succeeded.call_count, 2)
+
+
+    def test_update__return_values(self):
+        self.dynamo_mock.update_item.return_value = {'Attributes': {'some_counter': {'N': '15'}}}
+
+        result = self.dynamo_client.update({'hash_col': 'cat'}, attributes_to_increment={'some_counter': 5},
+                                           return_values='UPDATED_NEW')
+
+        self.assertEqual(result, {'some_counter': 15})
+        self.assertEqual(self.dynamo_mock.update_item.call_args[1]['ReturnValues'], 'UPDATED_NEW')
+
+
+    def test_make_update_transaction_item(self):
+        result = self.dynamo_client.make_update_transaction_item({'hash_col': 'cat', 'range_col': 1},
+                                                                 attributes_to_update={'other_col': 'foo'},
+                                                                 condition_expression='other_col = bar')
+
+        self.assertEqual(result['Update']['Key'], {'hash_col': {'S': 'cat'}, 'range_col': {'N': '1'}})
+        self.assertEqual(result['Update']['UpdateExpression'], 'SET #other_col = :other_col')
+        self.assertEqual(result['Update']['ConditionExpression'], 'other_col = :filter_other_col')
+        self.assertEqual(result['Update']['ExpressionAttributeValues'],
+                         {':other_col': {'S': 'foo'}, ':filter_other_col': {'S': 'bar'}})
+
+
+    def test_make_condition_check_transaction_item(self):
+        result = self.dynamo_client.make_condition_check_transaction_item({'hash_col': 'cat'},
+                                                                          'attribute_exists other_col')
+
+        self.assertEqual(result, {'ConditionCheck': {
+            'TableName':           self.table_name,
+            'Key':                 {'hash_col': {'S': 'cat'}},
+            'ConditionExpression': 'attribute_exists (other_col)'
+        }})
+
+
+    def test_transact_write__chunks(self):
+        transactions = [self.dynamo_client.make_put_transaction_item({'hash_col': f"cat{i}"}) for i in range(150)]
+        transactions.append(self.dynamo_client.make_condition_check_transaction_item({'hash_col': 'cat0'},
+                                                                                     'attribute_exists hash_col'))
+
+        for concurrent in (False, True):
+            self.dynamo_mock.transact_write_items.reset_mock()
+
+            self.dynamo_client.transact_write(*transactions, concurrent=concurrent)
+
+            self.assertEqual(sorted(len(c[1]['TransactItems'])
+                                    for c in self.dynamo_mock.transact_write_items.call_args_list), [51, 100])
+
+        self.assertEqual(self.dynamo_client.stats['dynamo_transact_write_operations'], 4)
+
+
+    def test_transact_write__chunks_by_size(self):
+        # Every pair of Put and Delete is about 1 MB, so only 3 pairs fit the 4 MB limit of a transaction.
+        transactions = []
+        for i in range(10):
+            transactions.append(self.dynamo_client.make_put_transaction_item({'hash_col': f"cat{i}",
+                                                                               'payload': 'x' * 1000000}))
+            transactions.append(self.dynamo_client.make_delete_transaction_item({'hash_col': f"cat{i}"}, None))
+
+        self.dynamo_client.transact_write(*transactions, group_size=2)
+
+        calls = self.dynamo_mock.transact_write_items.call_args_list
+        self.assertEqual([len(c[1]['TransactItems']) for c in calls], [6, 6, 6, 2])
+
+        for c in calls:
+            items = c[1]['TransactItems']
+            # Pairs are never split between chunks.
+            self.assertEqual([next(iter(x)) for x in items], ['Put', 'Delete'] * (len(items) // 2))
+            self.assertLess(sum(len(x['Put']['Item']['payload']['S']) for x in items if 'Put' in x), 4000000)
+
+
+    def test_transact_write__group_too_large(self):
+        transactions = [self.dynamo_client.make_put_transaction_item({'hash_col': f"cat{i}", 'payload': 'x' * 300000})
+                        for i in range(15)]
+
+        self.assertRaises(ValueError, self.dynamo_client.transact_write, *transactions, group_size=15)
+        self.dynamo_mock.transact_write_items.assert_not_called()
+
+
+    def test_transact_write__concurrent_partial_failure(self):
+        error = botocore.exceptions.ClientError({'Error': {'Code': 'TransactionCanceledException'}},
+                                                'TransactWriteItems')
+
+        def transact_write_items(TransactItems, **kwargs):
+            if len(TransactItems) < 100:
+                raise error
+            return {}
+
+        self.dynamo_mock.transact_write_items.side_effect = transact_write_items
+
+        transactions = [self.dynamo_client.make_delete_transaction_item({'hash_col': f"cat{i}"}, None)
+                        for i in range(150)]
+
+        committed = []
+        with self.assertLogs(level='ERROR') as logs:
+            self.assertRaises(botocore.exceptions.ClientError, self.dynamo_client.transact_write, *transactions,
+                              concurrent=True, on_commit=committed.append)
+
+        self.assertIn("failed chunks [1] of 2", logs.output[0])
+        self.assertEqual(self.dynamo_client.stats['dynamo_transact_write_operations'], 1)
+        self.assertEqual([len(x) for x in committed], [100])
+
+
+    def test_transact_write__concurrent_raises(self):
+        self.dynamo_mock.transact_write_items.side_effect = botocore.exceptions.ClientError(
+                {'Error': {'Code': 'TransactionCanceledException'}}, 'TransactWriteItems')
+
+        transactions = [self.dynamo_client.make_delete_transaction_item({'hash_col': f"cat{i}"}, None)
+                        for i in range(150)]
+
+        self.assertRaises(botocore.exceptions.ClientError, self.dynamo_client.transact_write, *transactions,
+                          concurrent=True)
+
+
     def test__parse_filter_expression(self):
         TESTS = {
             'key = 42': ("key = :filter_key", {":filter_key": {'N': '42'}}),
@@ -200,5 +867,185 @@ class dynamodb_client_UnitTestCase(unittest.TestCase):
             self.assertRaises((AssertionError, ValueError), self.dynamo_client._parse_filter_expression, data)
 
 
+    def test_batch_put__chunks(self):
+        rows = [{'hash_col': f"cat{i}", 'range_col': i} for i in range(60)]
+        self.dynamo_mock.batch_write_item.return_value = {'UnprocessedItems': {}}
+
+        self.dynamo_client.batch_put(rows)
+
+        self.assertEqual(self.dynamo_mock.batch_write_item.call_count, 3)
+
+        call_args, call_kwargs = self.dynamo_mock.batch_write_item.call_args_list[0]
+        requests = call_kwargs['RequestItems'][self.table_name]
+        self.assertEqual(len(requests), 25)
+        self.assertEqual(requests[0], {'PutRequest': {'Item': {'hash_col': {'S': 'cat0'}, 'range_col': {'N': '0'}}}})
+
+
+    def test_batch_put__retries_unprocessed(self):
+        rows = [{'hash_col': 'cat', 'range_col': 1}, {'hash_col': 'dog', 'range_col': 2}]
+        unprocessed = {self.table_name: [{'PutRequest': {'Item': {'hash_col': {'S': 'dog'}, 'range_col': {'N': '2'}}}}]}
+        self.dynamo_mock.batch_write_item.side_effect = [{'UnprocessedItems': unprocessed}, {'UnprocessedItems': {}}]
+
+        with patch('time.sleep') as sleep_mock:
+            self.dynamo_client.batch_put(rows)
+
+        sleep_mock.assert_called_once()
+        self.assertEqual(self.dynamo_mock.batch_write_item.call_count, 2)
+
+        call_args, call_kwargs = self.dynamo_mock.batch_write_item.call_args
+        self.assertEqual(call_kwargs['RequestItems'], unprocessed)
+
+
+    def test_batch_delete(self):
+        keys_list = [{'hash_col': f"cat{i}", 'range_col': i} for i in range(30)]
+        self.dynamo_mock.batch_write_item.return_value = {'UnprocessedItems': {}}
+
+        self.dynamo_client.batch_delete(keys_list)
+
+        self.assertEqual(self.dynamo_mock.batch_write_item.call_count, 2)
+
+        call_args, call_kwargs = self.dynamo_mock.batch_write_item.call_args_list[1]
+        requests = call_kwargs['RequestItems'][self.table_name]
+        self.assertEqual(len(requests), 5)
+        self.assertEqual(requests[0], {'DeleteRequest': {'Key': {'hash_col': {'S': 'cat25'}, 'range_col': {'N': '25'}}}})
+        self.assertEqual(self.dynamo_client.stats['dynamo_delete_queries'], 30)
+
+
+    def test_batch_put__raises_after_max_retries(self):
+        rows = [{'hash_col': 'cat', 'range_col': 1}]
+        unprocessed = {self.table_name: [{'PutRequest': {'Item': {'hash_col': {'S': 'cat'}, 'range_col': {'N': '1'}}}}]}
+        self.dynamo_mock.batch_write_item.return_value = {'UnprocessedItems': unprocessed}
+
+        with patch('time.sleep'):
+            self.assertRaises(RuntimeError, self.dynamo_client.batch_put, rows, max_retries=2)
+
+        self.assertEqual(self.dynamo_mock.batch_write_item.call_count, 3)
+
+
+    def test_batch_writer__buffers_put_and_delete(self):
+        self.dynamo_mock.batch_write_item.return_value = {'UnprocessedItems': {}}
+
+        with self.dynamo_client.batch_writer():
+            self.dynamo_client.put({'hash_col': 'cat', 'range_col': 1}, table_name='autotest_other')
+            self.dynamo_client.delete({'hash_col': 'cat', 'range_col': 1})
+
+            self.dynamo_mock.batch_write_item.assert_not_called()
+
+        self.dynamo_mock.put_item.assert_not_called()
+        self.dynamo_mock.delete_item.assert_not_called()
+        self.dynamo_mock.batch_write_item.assert_called_once()
+
+        call_args, call_kwargs = self.dynamo_mock.batch_write_item.call_args
+        self.assertEqual(call_kwargs['RequestItems'], {
+            'autotest_other':  [{'PutRequest': {'Item': {'hash_col': {'S': 'cat'}, 'range_col': {'N': '1'}}}}],
+            self.table_name: [{'DeleteRequest': {'Key': {'hash_col': {'S': 'cat'}, 'range_col': {'N': '1'}}}}],
+        })
+
+
+    def test_batch_writer__flushes_every_25(self):
+        self.dynamo_mock.batch_write_item.return_value = {'UnprocessedItems': {}}
+
+        with self.dynamo_client.batch_writer():
+            for i in range(30):
+                self.dynamo_client.delete({'hash_col': 'cat', 'range_col': i})
+
+            self.dynamo_mock.batch_write_item.assert_called_once()
+
+        self.assertEqual(self.dynamo_mock.batch_write_item.call_count, 2)
+
+
+    def test_batch_writer__flushes_on_same_item_conflict(self):
+        self.dynamo_mock.batch_write_item.return_value = {'UnprocessedItems': {}}
+
+        with self.dynamo_client.batch_writer():
+            self.dynamo_client.put({'hash_col': 'cat', 'range_col': 1, 'other_col': 'foo'})
+            self.dynamo_client.delete({'hash_col': 'cat', 'range_col': 1})
+
+        self.assertEqual(self.dynamo_mock.batch_write_item.call_count, 2)
+
+
+    def test_batch_writer__nested(self):
+        self.dynamo_mock.batch_write_item.return_value = {'UnprocessedItems': {}}
+
+        with self.dynamo_client.batch_writer():
+            with self.dynamo_client.batch_writer():
+                self.dynamo_client.delete({'hash_col': 'cat', 'range_col': 1})
+
+            self.dynamo_client.delete({'hash_col': 'dog', 'range_col': 2})
+            self.dynamo_mock.batch_write_item.assert_not_called()
+
+        self.dynamo_mock.batch_write_item.assert_called_once()
+
+        # Outside of the context writes are immediate again.
+        self.dynamo_client.delete({'hash_col': 'cat', 'range_col': 1})
+        self.dynamo_mock.delete_item.assert_called_once()
+
+
+    def test_get_by_scan__parallel(self):
+
+        def paginate(**kwargs):
+            seg = kwargs['Segment']
+            self.assertEqual(kwargs['TotalSegments'], 4)
+            return [{'Items': [{'hash_col': {'S': f"cat{seg}_{i}"}, 'range_col': {'N': str(i)}}]} for i in range(3)]
+
+        self.paginator_mock.paginate.side_effect = paginate
+
+        result = self.dynamo_client.get_by_scan(total_segments=4, max_workers=2)
+
+        self.assertEqual(len(result), 12)
+        self.assertEqual(sorted(x['hash_col'] for x in result),
+                         sorted(f"cat{seg}_{i}" for seg in range(4) for i in range(3)))
+        self.assertEqual(self.paginator_mock.paginate.call_count, 4)
+        self.assertEqual(self.dynamo_client.stats['dynamo_scan_queries'], 12)
+
+
+    def test_get_by_scan__parallel_raises(self):
+
+        def paginate(**kwargs):
+            if kwargs['Segment'] == 1:
+                raise RuntimeError("Boom")
+            return [{'Items': []}]
+
+        self.paginator_mock.paginate.side_effect = paginate
+
+        self.assertRaises(RuntimeError, self.dynamo_client.get_by_scan, total_segments=3)
+
+
+    def test_get_by_scan_generator__parallel_bounded(self):
+        fetched = []
+
+        def paginate(**kwargs):
+            for i in itertools.count():
+                fetched.append(i)
+                yield {'Items': [{'hash_col': {'S': f"cat{kwargs['Segment']}_{i}"}}]}
+
+        self.paginator_mock.paginate.side_effect = paginate
+
+        generator = self.dynamo_client.get_by_scan_generator(total_segments=2)
+        for _ in range(3):
+            next(generator)
+        time.sleep(0.3)
+
+        # The segments wait for the consumer: no more than the size of the queue is fetched in advance.
+        self.assertLessEqual(len(fetched), 3 + 2 * 2 + 2)
+
+        # After the consumer stops, the segments stop too.
+        generator.close()
+        fetched_after_close = len(fetched)
+        time.sleep(0.3)
+        self.assertEqual(len(fetched), fetched_after_close)
+
+
+    def test_get_by_scan_generator__one_segment(self):
+        self.paginator_mock.paginate.return_value = [{'Items': [{'hash_col': {'S': 'cat'}}]}]
+
+        result = list(self.dynamo_client.get_by_scan_generator(total_segments=4, segment=2))
+
+        self.assertEqual(result, [[{'hash_col': 'cat'}]])
+
+        args, kwargs = self.paginator_mock.paginate.call_args
+        self.assertEqual((kwargs['Segment'], kwargs['TotalSegments']), (2, 4))
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,4 +1,5 @@
 import datetime
+import tempfile
 import time
 import unittest
 import os
@@ -566,5 +567,19 @@ class helpers_UnitTestCase(unittest.TestCase):
             self.assertEqual(trim_arn_to_name(test), expected)
 
 
+    def test_write_file_atomically(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'some', 'dir', 'file.json')
+
+            write_file_atomically(path, '{"a": 1}')
+            write_file_atomically(path, b'{"a": 2}')
+
+            with open(path) as f:
+                self.assertEqual(f.read(), '{"a": 2}')
+
+            # No temporary files left.
+            self.assertEqual(os.listdir(os.path.dirname(path)), ['file.json'])
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,80 @@
+import unittest
+
+from unittest.mock import patch
+
+from sosw.components.rate_limiter import TokenBucket, get_token_bucket
+
+
+class TokenBucket_UnitTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.patcher_monotonic = patch('time.monotonic')
+        self.monotonic = self.patcher_monotonic.start()
+        self.monotonic.return_value = 1000
+
+        self.patcher_sleep = patch('time.sleep')
+        self.sleep = self.patcher_sleep.start()
+
+        self.bucket = TokenBucket(rate=10)
+
+
+    def tearDown(self):
+        self.patcher_monotonic.stop()
+        self.patcher_sleep.stop()
+
+
+    def test_acquire__burst(self):
+        for _ in range(10):
+            self.assertEqual(self.bucket.acquire(), 0)
+
+        self.sleep.assert_not_called()
+
+
+    def test_acquire__waits(self):
+        self.bucket.acquire(10)
+
+        self.assertAlmostEqual(self.bucket.acquire(5), 0.5)
+        self.sleep.assert_called_once_with(0.5)
+
+
+    def test_acquire__refills(self):
+        self.bucket.acquire(10)
+        self.monotonic.return_value = 1000.5
+
+        self.assertEqual(self.bucket.acquire(5), 0)
+
+
+    def test_consume__debt(self):
+        self.bucket.acquire(1)
+        self.bucket.consume(19)  # Real cost was 20
+
+        self.assertAlmostEqual(self.bucket.acquire(1), 1.1)
+
+
+    def test_aimd(self):
+        self.bucket.throttled()
+        self.assertEqual(self.bucket.rate, 5)
+
+        for _ in range(3):
+            self.bucket.throttled()
+        self.assertEqual(self.bucket.rate, 0.625)
+
+        for _ in range(100):
+            self.bucket.succeeded()
+        self.assertEqual(self.bucket.rate, 10)
+
+        for _ in range(100):
+            self.bucket.throttled()
+        self.assertEqual(self.bucket.rate, 0.5)
+
+
+    def test_get_token_bucket__shared(self):
+        bucket = get_token_bucket('autotest_table:wcu', 10)
+
+        self.assertIs(get_token_bucket('autotest_table:wcu', 10), bucket)
+        self.assertIsNot(get_token_bucket('autotest_table:rcu', 10), bucket)
+        self.assertIsNot(get_token_bucket('autotest_table:wcu', 20), bucket)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -118,9 +118,31 @@ class EcologyManager(Processor):
                                "You have to call register_task_manager() after initiazation and pass the pointer "
                                "to your TaskManager instance.")
 
+        if self.task_client.config.get('labourer_stats_table'):
+            stats = self.task_client.get_labourer_duration_stats(labourer)
+            if stats:
+                return round(stats['average'])
+
         return self.task_client.get_average_labourer_duration(labourer)
 
 
+    def get_labourer_duration_stats(self, labourer: Labourer) -> Optional[Dict]:
+        """
+        Rolling statistics of `labourer` durations: `count`, `average`, `p50` and `p95` in seconds.
+        Available only if `labourer_stats_table` is configured in TaskManager. Otherwise returns None.
+        """
+
+        if not self.task_client:
+            raise RuntimeError("EcologyManager doesn't have a TaskManager registered. "
+                               "You have to call register_task_manager() after initiazation and pass the pointer "
+                               "to your TaskManager instance.")
+
+        if not self.task_client.config.get('labourer_stats_table'):
+            return None
+
+        return self.task_client.get_labourer_duration_stats(labourer)
+
+
     def get_max_labourer_duration(self, labourer: Labourer) -> int:
         """
         Maximum duration of `labourer` executions.
@@ -6,15 +6,22 @@ import boto3
 import json
 import logging
 import os
+import threading
 import time
 import uuid
 
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from copy import deepcopy
 from pkg_resources import parse_version
-from typing import Dict, List, Optional, Union
+from typing import Callable, Dict, List, Optional, Tuple, Union
 
 from sosw.app import Processor
-from sosw.components.benchmark import benchmark
+from sosw.components.benchmark import benchmark, LatencyHistogram
+from sosw.components.cache import TTLCache
+from sosw.components.claim_check import (ClaimCheckStore, get_claim_check_store, is_claim_check,
+                                         resolve_claim_check)
+from sosw.components.compression import is_packed, unpack
 from sosw.components.dynamo_db import DynamoDbClient
 from sosw.components.helpers import first_or_none
 from sosw.labourer import Labourer
@@ -23,6 +30,14 @@ from sosw.labourer import Labourer
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+# Buckets of durations in `labourer_stats_table`. 10% precision starting from 1 second.
+DURATION_HISTOGRAM_SETTINGS = {'precision': 0.1, 'min_value': 1}
+DURATION_BUCKET_PREFIX = 'duration_b'
+
+# Slowly changing attributes of Labourers. Survives between invocations in the warm container.
+_labourer_attributes_cache = TTLCache(max_size=1000)
+_MISSING = object()
+
 
 class TaskManager(Processor):
     """
@@ -50,10 +65,22 @@ class TaskManager(Processor):
                 'closed_at':           'N',
                 'desired_launch_time': 'N',
                 'arn':                 'S',
+                # JSON string. Set 'M' to store payloads as native Maps, see the docs of TaskManager before that.
                 'payload':             'S'
             },
             'required_fields':  ['task_id', 'labourer_id', 'created_at', 'greenfield'],
 
+            # Cache of items fetched by key for the reads that tolerate stale data: `get_task_by_id(cached=True)`
+            # and the labourer duration stats. Invalidated by the writes of this TaskManager, but not of other
+            # Lambdas, so keep the TTL short. Example: 'read_cache_size': 1000, 'read_cache_ttl': 10,
+
+            # Client-side targets of consumed capacity units per second. Adapt automatically to throttling.
+            # Example: 'rate_limits': {'sosw_tasks': {'wcu': 25}, 'sosw_tasks/sosw_tasks_greenfield': {'wcu': 25}},
+
+            # Large payloads may be stored compressed to save WCU and item size. Other Lambdas reading the tasks
+            # (e.g. Workers) must have the same setting.
+            # Example: 'compress_fields': ['payload'], 'compress_threshold': 1024,
+
             # You can overwrite field names to match your DB schema. But the types should be the same.
             # By default takes the key itself.
             'field_names':      {
@@ -65,7 +92,27 @@ class TaskManager(Processor):
         'sosw_retry_tasks_table':                  'sosw_retry_tasks',
         'sosw_retry_tasks_greenfield_index':       'labourer_id_greenfield',
         'greenfield_invocation_delta':             31557600,  # 1 year.
+
+        # Payloads larger than threshold (bytes of JSON) are saved to the claim check store and tasks keep pointers.
+        # E.g. 's3://some-bucket/sosw/payloads' or 'file:///tmp/sosw_payloads'. Disabled if not set.
+        'payload_claim_check_uri':                 None,
+        'payload_claim_check_threshold':           100000,
+        # Load the payload in `invoke_task()`. Lambda Event invocations are limited to 256 KB, so for larger
+        # payloads set False and load it in the Worker: `sosw.components.claim_check.resolve_claim_check(event)`.
+        'payload_claim_check_resolve':             True,
         'greenfield_task_step':                    1000,
+        # Allocate greenfields of new tasks from counters in this table (hash key: labourer_id) instead of querying
+        # the newest task. Safe for concurrent producers. E.g. 'sosw_greenfield_counters'. Disabled if not set.
+        'greenfield_counters_table':               None,
+        # Number of greenfields reserved with one write to the counter and handed out locally.
+        'greenfield_counters_block_size':          100,
+        # Reserved blocks are handed out for half of this number of seconds. After the lease of the last reservation
+        # has expired, the counter is moved back to the end of the queue, so the unused greenfields are reused.
+        'greenfield_counters_lease_ttl':           30,
+        # Allocated greenfields must stay at least this number of seconds below now(), or the tasks look invoked.
+        'greenfield_counters_headroom':            86400,
+        # Maximum number of queued tasks to read in `snapshot_labourer()`. Longer queues are not counted in snapshots.
+        'labourer_snapshot_max_queued_ids':        1000,
         'labourers':                               {
             # 'some_function': {
             #     'arn': 'arn:aws:lambda:us-west-2:0000000000:function:some_function',
@@ -74,10 +121,22 @@ class TaskManager(Processor):
         },
         'max_attempts':                            3,
         'max_closed_to_analyse_for_duration':      10,
+        # Rolling statistics of durations of Labourers are maintained in this table (hash key: labourer_id)
+        # when tasks are archived. E.g. 'sosw_labourer_stats'. Disabled if not set.
+        'labourer_stats_table':                    None,
+        # Halve the statistics once they have this many observations, so that recent tasks weigh more.
+        'labourer_stats_decay_after':              1000,
+        # Average and max durations of Labourers are cached in the container for this number of seconds.
+        'labourer_attributes_cache_ttl':           300,
+        'register_labourers_max_workers':          10,
         'max_simultaneous_invocations':            1,
     }
 
     __labourers = None
+    _claim_check_store = None
+    _labourer_snapshots = None
+    _greenfield_blocks = None
+    _greenfield_blocks_lock = threading.Lock()
 
     # these clients will be initialized by Processor constructor
     ecology_client = None
@@ -93,11 +152,17 @@ class TaskManager(Processor):
 
         _ = self.get_db_field_name
 
+        snapshot = self.get_labourer_snapshot(labourer, queued=True)
+        if snapshot and not (reverse and snapshot['queued_truncated']):
+            result = snapshot['newest_greenfield' if reverse else 'oldest_greenfield']
+            return result if result is not None else 0 + int(self.config['greenfield_task_step'])
+
         q = dict(
                 keys={_('labourer_id'): labourer.id, _('greenfield'): str(time.time())},
                 comparisons={_('greenfield'): '<='},
                 max_items=1,
-                index_name=self.config['dynamo_db_config']['index_greenfield']
+                index_name=self.config['dynamo_db_config']['index_greenfield'],
+                fields=[_('greenfield')],
         )
         if reverse:
             q['desc'] = True
@@ -135,6 +200,10 @@ class TaskManager(Processor):
 
         _ = self.get_db_field_name
 
+        snapshot = self.get_labourer_snapshot(labourer, queued=True)
+        if snapshot and not snapshot['queued_truncated']:
+            return snapshot['counts']['queued']
+
         queue_count = self.dynamo_db_client.get_by_query(
                 keys={_('labourer_id'): labourer.id, _('greenfield'): str(time.time())},
                 comparisons={'greenfield': '<='},
@@ -144,6 +213,177 @@ class TaskManager(Processor):
         return queue_count
 
 
+    def snapshot_labourer(self, labourer: Labourer, queued: bool = True, max_queued: Optional[int] = None) -> Dict:
+        """
+        Read the state of tasks of the `labourer` from the greenfield index and split them in memory to buckets
+        by greenfield (see :ref:`greenfield <greenfield>`):
+
+        * `queued` - greenfield < `start`
+        * `expired` - `start` <= greenfield < `expired` and not completed
+        * `running` - `expired` <= greenfield <= `invoked` and not completed
+        * `completed` - greenfield >= `start` and completed
+
+        Only the keys, greenfield and completed_at of tasks are fetched. The invoked tasks are read with a single
+        query. The queue is read with another one limited to `max_queued` tasks from its beginning. If the queue
+        is longer, the snapshot has `queued_truncated` and doesn't know the count and the end of the queue.
+
+        Until the next `register_labourers()` the following methods answer from the snapshot instead of querying:
+        `get_oldest_greenfield_for_labourer()`, `get_newest_greenfield_for_labourer()`,
+        `get_length_of_queue_for_labourer()`, `get_next_for_labourer()` (IDs only or an empty queue),
+        `get_running_tasks_for_labourer()`, `get_completed_tasks_for_labourer()`
+        and `get_expired_tasks_for_labourer()`. The full tasks for the last three are fetched by IDs.
+        Writes of this TaskManager for the `labourer` update or drop the snapshot.
+
+        :param labourer:    Registered Labourer.
+        :param queued:      Read the queue as well. Set False if you don't need the queue.
+        :param max_queued:  Maximum number of queued tasks to read. Default: `labourer_snapshot_max_queued_ids`.
+        :return:            Snapshot with the lists of tasks in buckets and their `counts`.
+        """
+
+        _ = self.get_db_field_name
+
+        start, expired, invoked = (labourer.get_attr(x) for x in ('start', 'expired', 'invoked'))
+        if max_queued is None:
+            max_queued = self.config['labourer_snapshot_max_queued_ids']
+
+        query_args = dict(index_name=self.config['dynamo_db_config']['index_greenfield'],
+                          fields=[_('task_id'), _('greenfield'), _('completed_at')])
+
+        snapshot = {
+            'queued':            None,
+            'running':           [],
+            'expired':           [],
+            'completed':         [],
+            'counts':            {'queued': None, 'running': 0, 'expired': 0, 'completed': 0},
+            'oldest_greenfield': None,
+            'newest_greenfield': None,
+            'queued_truncated':  False,
+        }
+
+        if queued:
+            # One extra task tells if there is more in the queue.
+            tasks = list(self.dynamo_db_client.get_by_query_generator(
+                    keys={_('labourer_id'): labourer.id, _('greenfield'): start},
+                    comparisons={_('greenfield'): '<'},
+                    max_items=max_queued + 1,
+                    **query_args))
+
+            truncated = len(tasks) > max_queued
+            snapshot['queued'] = tasks[:max_queued]
+            snapshot['queued_truncated'] = truncated
+            snapshot['counts']['queued'] = None if truncated else len(tasks)
+
+            if tasks:
+                snapshot['oldest_greenfield'] = tasks[0][_('greenfield')]
+                snapshot['newest_greenfield'] = None if truncated else tasks[-1][_('greenfield')]
+
+        tasks = self.dynamo_db_client.get_by_query_generator(
+                keys={_('labourer_id'): labourer.id, _('greenfield'): start},
+                comparisons={_('greenfield'): '>='},
+                **query_args)
+
+        for task in tasks:
+            greenfield = task[_('greenfield')]
+
+            if task.get(_('completed_at')):
+                bucket = 'completed'
+            elif greenfield < expired:
+                bucket = 'expired'
+            elif greenfield <= invoked:
+                bucket = 'running'
+            else:
+                logger.warning(f"Task {task} of {labourer.id} has greenfield later than `invoked` {invoked}")
+                continue
+
+            snapshot[bucket].append(task)
+            snapshot['counts'][bucket] += 1
+
+        logger.info(f"Snapshot of tasks for {labourer.id}: {snapshot['counts']}")
+        self.stats['labourer_snapshots'] += 1
+
+        if self._labourer_snapshots is None:
+            self._labourer_snapshots = {}
+        self._labourer_snapshots[labourer.id] = snapshot
+
+        return snapshot
+
+
+    def get_labourer_snapshot(self, labourer: Labourer, queued: bool = False) -> Optional[Dict]:
+        """
+        Return the snapshot of `labourer` taken with `snapshot_labourer()` during the current run, if any.
+
+        :param queued:  Require the snapshot to include the queue.
+        """
+
+        snapshot = (self._labourer_snapshots or {}).get(labourer.id)
+        if snapshot and queued and snapshot['queued'] is None:
+            return None
+
+        return snapshot
+
+
+    def drop_labourer_snapshot(self, labourer_id: str):
+        if self._labourer_snapshots:
+            self._labourer_snapshots.pop(labourer_id, None)
+
+
+    def _forget_task_in_snapshots(self, task_id: str):
+        """ Remove the task from the buckets of snapshots. Called when the task leaves the tasks table. """
+
+        _ = self.get_db_field_name
+
+        for snapshot in (self._labourer_snapshots or {}).values():
+            for bucket, tasks in snapshot.items():
+                if bucket in snapshot['counts'] and tasks:
+                    remaining = [x for x in tasks if x[_('task_id')] != task_id]
+                    if snapshot['counts'][bucket] is not None:
+                        snapshot['counts'][bucket] -= len(tasks) - len(remaining)
+                    snapshot[bucket] = remaining
+
+
+    def _get_full_tasks(self, tasks: List[Dict]) -> List[Dict]:
+        """ Fetch the full data of `tasks` from the snapshot. The result is sorted by greenfield. """
+
+        _ = self.get_db_field_name
+
+        if not tasks:
+            return []
+
+        result = self.dynamo_db_client.batch_get_items_one_table([{_('task_id'): x[_('task_id')]} for x in tasks])
+        return sorted(result, key=lambda x: x[_('greenfield')])
+
+
+    def _fetch_labourer_attributes(self, labourers: List[Labourer], fetched_attributes: Tuple[Tuple, ...],
+                                   fetched: Dict[str, Dict]):
+        """
+        Fetch `fetched_attributes` for all the `labourers` concurrently and store the values in `fetched`.
+        The attributes are given as tuples of `(name, method, cached)`. Cached values are taken from and saved to
+        the container cache of Labourer attributes.
+        """
+
+        jobs = []
+        for labourer in labourers:
+            for name, method, cached in fetched_attributes:
+                cache_key = self._get_labourer_attribute_cache_key(labourer, name) if cached else None
+                value = _labourer_attributes_cache.get(cache_key, _MISSING) if cache_key else _MISSING
+                if value is _MISSING:
+                    jobs.append((labourer, name, method, cache_key))
+                else:
+                    fetched[labourer.id][name] = value
+
+        if not jobs:
+            return
+
+        max_workers = min(len(jobs), self.config['register_labourers_max_workers'])
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            values = list(executor.map(lambda job: job[2](job[0]), jobs))
+
+        for (labourer, name, _method, cache_key), value in zip(jobs, values):
+            fetched[labourer.id][name] = value
+            if cache_key:
+                _labourer_attributes_cache.set(cache_key, value, ttl=self.config['labourer_attributes_cache_ttl'])
+
+
     def register_labourers(self) -> List[Labourer]:
         """
         Sets timestamps, health status and other custom attributes on Labourer objects passed for registration.
@@ -157,36 +397,75 @@ class TaskManager(Processor):
 
         self.ecology_client.register_task_manager(self)
 
+        now = int(time.time())
+
+        # Attributes that query DynamoDB or other services are fetched concurrently for all the Labourers.
+        # The slowly changing ones are cached in the container for `labourer_attributes_cache_ttl` seconds.
+        # The stages are fetched one after another: `average_duration` of failed tasks depends on `max_duration`,
+        # so the latter must be set on the Labourers before the next stage starts.
+        fetched_stages = (
+            (
+                ('health', self.ecology_client.get_labourer_status, False),
+                ('max_duration', self.ecology_client.get_max_labourer_duration, True),
+            ),
+            (
+                ('average_duration', self.ecology_client.get_labourer_average_duration, True),
+            ),
+        )
+
         # WARNING! This must be something ordered, because these methods depend on one another.
         custom_attributes = (
-            ('start', lambda x: int(time.time())),
+            ('start', lambda x: now),
             ('invoked', lambda x: x.get_attr('start') + self.config['greenfield_invocation_delta']),
             ('expired', lambda x: x.get_attr('invoked') - (x.duration + x.cooldown)),
-            ('health', lambda x: self.ecology_client.get_labourer_status(x)),
+            ('health', lambda x: fetched[x.id]['health']),
             ('max_attempts', lambda x: self.config.get(f'max_attempts_{x.id}') or self.config['max_attempts']),
-            ('max_duration', lambda x: self.ecology_client.get_max_labourer_duration(x)),
-            ('average_duration', lambda x: self.ecology_client.get_labourer_average_duration(x)),
+            ('max_duration', lambda x: fetched[x.id]['max_duration']),
+            ('average_duration', lambda x: fetched[x.id]['average_duration']),
             ('max_simultaneous_invocations', lambda x: _cfg('labourers')[x.id].get('max_simultaneous_invocations')
                                                        or _cfg('max_simultaneous_invocations')),
         )
 
-        # Reset old Labourers and reconstruct them with fresh data.
+        # Reset old Labourers and their snapshots and reconstruct them with fresh data.
         self.__labourers = None
+        self._labourer_snapshots = None
         labourers = self.get_labourers()
 
-        result = []
+        # Only the values are fetched in the threads. The cache, Labourers and stats of TaskManager are updated
+        # here in the calling thread.
+        fetched = {labourer.id: {} for labourer in labourers}
+        for fetched_attributes in fetched_stages:
+            self._fetch_labourer_attributes(labourers, fetched_attributes, fetched)
+
+            # Expose the values of this stage to the methods of the next one.
+            for labourer in labourers:
+                for name, _method, _cached in fetched_attributes:
+                    labourer.set_custom_attribute(name, fetched[labourer.id][name])
+
         for labourer in labourers:
-            for k, method in [x for x in custom_attributes]:
-                labourer.set_custom_attribute(k, method(labourer))
-                logger.debug(f"SET for {labourer}: {k} = {method(labourer)}")
-            result.append(labourer)
+            for k, method in custom_attributes:
+                value = method(labourer)
+                labourer.set_custom_attribute(k, value)
+                logger.debug(f"SET for {labourer}: {k} = {value}")
 
             for attr, val in _cfg('labourers')[labourer.id].items():
                 labourer.set_custom_attribute(attr, val)
 
-        self.__labourers = result
+        self.__labourers = labourers
 
-        return result
+        return labourers
+
+
+    def _get_labourer_attribute_cache_key(self, labourer: Labourer, name: str) -> Optional[Tuple]:
+        """
+        Key of the slowly changing attribute `name` of `labourer` in the cache of the container.
+        None if the cache is disabled with `labourer_attributes_cache_ttl`.
+        """
+
+        if not self.config['labourer_attributes_cache_ttl']:
+            return None
+
+        return self.config['sosw_closed_tasks_table'], labourer.id, name
 
 
     def get_labourers(self) -> List[Labourer]:
@@ -220,6 +499,181 @@ class TaskManager(Processor):
                             and pass custom task properties setting strict = False
         """
 
+        if self.config.get('greenfield_counters_table'):
+            greenfield = lambda: self.allocate_greenfields(labourer)[0]
+        else:
+            greenfield = lambda: self.get_newest_greenfield_for_labourer(labourer) + int(self.config['greenfield_task_step'])
+
+        new_task = self.construct_task(labourer, greenfield=greenfield, strict=strict, **kwargs)
+
+        # Saving to DynamoDB.
+        self.dynamo_db_client.put(new_task)
+        self.drop_labourer_snapshot(labourer.id)
+        logger.debug(f"Created a task: {new_task}")
+
+
+    def create_tasks(self, labourer: Labourer, tasks: List[Dict], strict: bool = True):
+        """
+        Schedule multiple new tasks for the `labourer` at once.
+
+        The range of greenfields for the new tasks is allocated with a single query to the greenfield index
+        and the tasks are written to DynamoDB with `BatchWriteItem` in chunks of 25.
+        Tasks are queued in the order of the `tasks` list.
+
+        :param labourer:    Labourer object of Lambda to execute the tasks.
+        :param list tasks:  List of dictionaries. Each one is the same as `kwargs` of `create_task()`.
+        :param bool strict: Same as in `create_task()`.
+        """
+
+        if not tasks:
+            return
+
+        if self.config.get('greenfield_counters_table'):
+            greenfields = self.allocate_greenfields(labourer, len(tasks))
+        else:
+            step = int(self.config['greenfield_task_step'])
+            newest_greenfield = self.get_newest_greenfield_for_labourer(labourer)
+            greenfields = [newest_greenfield + step * i for i in range(1, len(tasks) + 1)]
+
+        new_tasks = []
+        for task, task_greenfield in zip(tasks, greenfields):
+            new_tasks.append(self.construct_task(labourer, greenfield=lambda: task_greenfield, strict=strict, **task))
+
+        # Saving to DynamoDB.
+        self.dynamo_db_client.batch_put(new_tasks)
+        self.drop_labourer_snapshot(labourer.id)
+        logger.debug(f"Created {len(new_tasks)} tasks for Labourer {labourer.id}")
+
+        self.stats['created_tasks'] += len(new_tasks)
+
+
+    def allocate_greenfields(self, labourer: Labourer, count: int = 1) -> List[int]:
+        """
+        Allocate `count` greenfields for new tasks of the `labourer` from the counter in `greenfield_counters_table`.
+
+        Greenfields are reserved in blocks of at least `greenfield_counters_block_size` with an atomic increment of
+        the counter, so concurrent producers never get the same values. The reserved block is handed out
+        from memory until exhausted, so most of the tasks are created without any reads or writes of the counter.
+        The block is handed out only during the first half of its lease (`greenfield_counters_lease_ttl`), the rest
+        of the lease covers writing the tasks. Every reservation reads the newest queued greenfield once,
+        see `_reserve_greenfields()`.
+        Note that blocks of concurrent producers interleave, so the order of their tasks in the queue is approximate.
+
+        :return:    Ascending list of greenfields.
+        """
+
+        step = int(self.config['greenfield_task_step'])
+
+        with self._greenfield_blocks_lock:
+            if self._greenfield_blocks is None:
+                self._greenfield_blocks = {}
+
+            next_greenfield, last_greenfield, valid_until = self._greenfield_blocks.get(labourer.id, (0, -1, 0))
+            available = (last_greenfield - next_greenfield) // step + 1 if time.time() < valid_until else 0
+
+            if available < count:
+                block_size = max(count, int(self.config['greenfield_counters_block_size']))
+                valid_until = time.time() + int(self.config['greenfield_counters_lease_ttl']) / 2
+                last_greenfield = self._reserve_greenfields(labourer, block_size * step)
+                next_greenfield = last_greenfield - (block_size - 1) * step
+
+            result = list(range(next_greenfield, next_greenfield + count * step, step))
+            self._greenfield_blocks[labourer.id] = (next_greenfield + count * step, last_greenfield, valid_until)
+
+        return result
+
+
+    def _reserve_greenfields(self, labourer: Labourer, size: int) -> int:
+        """
+        Move the counter of `labourer` by `size`. The new counter is the last greenfield of the reserved block.
+
+        Every reservation sets a lease of `greenfield_counters_lease_ttl` seconds on the counter. While the lease is
+        active, some producer may still hand out its block, so the counter is only incremented. Once the lease has
+        expired no block is outstanding: the counter is rebased to the newest queued greenfield, which also moves it
+        back after the queue has drained or the unused rest of blocks was thrown away. The counter is rebased forward
+        as well if it is behind the queue (e.g. the tasks were queued without it). All writes are conditional,
+        so concurrent producers never get the same block.
+
+        :raises RuntimeError:   If the block would come too close to now(), so the tasks would not look queued.
+        """
+
+        _ = self.get_db_field_name
+        table_name = self.config['greenfield_counters_table']
+        keys = {_('labourer_id'): labourer.id}
+
+        # The time is taken before reading the queue: the tasks of blocks with the lease expired by now are in it.
+        now = int(time.time())
+        newest_greenfield = int(self.get_newest_greenfield_for_labourer(labourer))
+        ceiling = now - int(self.config['greenfield_counters_headroom'])
+        if newest_greenfield + size > ceiling:
+            raise RuntimeError(f"Can not allocate {size} greenfield units for {labourer.id} after the newest "
+                               f"queued greenfield {newest_greenfield}: the limit is {ceiling}. Too many tasks "
+                               f"in the queue or too large `greenfield_task_step`.")
+
+        lease = {_('lease_expires_at'): now + int(self.config['greenfield_counters_lease_ttl'])}
+
+        # Most of the time the lease of some recent reservation is still active. Just increment the counter.
+        try:
+            counter = int(self.dynamo_db_client.update(
+                    keys, attributes_to_update=lease, attributes_to_increment={_('greenfield'): size},
+                    table_name=table_name, condition_expression=f"{_('lease_expires_at')} > {now}",
+                    return_values='UPDATED_NEW')[_('greenfield')])
+
+            if newest_greenfield <= counter - size and counter <= ceiling:
+                self.stats['greenfield_blocks_reserved'] += 1
+                return counter
+
+        except Exception as err:
+            if err.__class__.__name__ != 'ConditionalCheckFailedException':
+                raise
+
+        for _attempt in range(3):
+            item = self.dynamo_db_client.get_item(keys, table_name=table_name, consistent=True, strict=False)
+            current = item.get(_('greenfield'))
+            leased = int(item.get(_('lease_expires_at')) or 0) > now
+
+            if current is not None and leased and int(current) >= newest_greenfield:
+                base = int(current)
+            else:
+                logger.info(f"Rebasing greenfield counter for {labourer.id} in {table_name} from {current} "
+                            f"to the newest queued greenfield {newest_greenfield}")
+                base = newest_greenfield
+
+            if base + size > ceiling:
+                raise RuntimeError(f"Can not allocate {size} greenfield units for {labourer.id} after the counter "
+                                   f"{base} in {table_name}: the limit is {ceiling}. Too many reserved greenfields "
+                                   f"or too large `greenfield_task_step`. Retry after the lease expires.")
+
+            # Every reservation changes the counter, so the condition also guarantees that the lease is unchanged.
+            condition = f"{_('greenfield')} = {current}" if current is not None \
+                else f"attribute_not_exists {_('greenfield')}"
+            try:
+                self.dynamo_db_client.update(keys, attributes_to_update={_('greenfield'): base + size, **lease},
+                                             table_name=table_name, condition_expression=condition)
+
+                self.stats['greenfield_blocks_reserved'] += 1
+                if current is None or base != int(current):
+                    self.stats['greenfield_counters_rebased'] += 1
+                return base + size
+
+            except Exception as err:
+                # Some concurrent producer has changed it first.
+                if err.__class__.__name__ != 'ConditionalCheckFailedException':
+                    raise
+
+        raise RuntimeError(f"Failed to reserve greenfields for {labourer.id} in {table_name}")
+
+
+    def construct_task(self, labourer: Labourer, greenfield: Callable[[], int], strict: bool = True,
+                       **kwargs) -> Dict:
+        """
+        Construct the row of a new Task ready to be saved to DynamoDB.
+
+        :param labourer:    Labourer object of Lambda to execute the task.
+        :param greenfield:  Function to generate the greenfield for the Task. Called at most once.
+        :param bool strict: See `create_task()`.
+        """
+
         _ = self.get_db_field_name
 
         # Save a copy of kwargs, because we are going to play with them.
@@ -230,8 +684,7 @@ class TaskManager(Processor):
             _('task_id'):     lambda: str(uuid.uuid1().hex),
             _('labourer_id'): lambda: str(labourer.id),
             _('created_at'):  lambda: str(time.time()),
-            _('greenfield'):  lambda: str(self.get_newest_greenfield_for_labourer(labourer)
-                                          + int(self.config['greenfield_task_step'])),
+            _('greenfield'):  lambda: str(greenfield()),
             _('attempts'):    lambda: '0',
         }
 
@@ -239,8 +692,8 @@ class TaskManager(Processor):
 
         # Fill task fields from either kwargs or autogenerator.
         for key, gen in autogenerators.items():
+            suggested = kw.pop(key, None)
             if strict:
-                suggested = kw.pop(key, None)
                 if suggested:
                     if str(suggested) != gen():
                         raise ValueError(f"Value of {key} passed to `create_task` doesnot match autogenerated. "
@@ -249,26 +702,31 @@ class TaskManager(Processor):
                     suggested = gen()
 
             else:
-                suggested = str(kw.pop(key, gen()))
+                suggested = str(suggested) if suggested is not None else gen()
             new_task[key] = suggested
 
-        if not all(key in new_task for key in self.config['dynamo_db_config'].get('required_fields', [])):
-            raise ValueError(f"Required key {key} is missing in task {kwargs} and "
-                             f"we don't have any auto generator for it.")
+        for key in self.config['dynamo_db_config'].get('required_fields', []):
+            if key not in new_task:
+                raise ValueError(f"Required key {key} is missing in task {kwargs} and "
+                                 f"we don't have any auto generator for it.")
 
         try:
-            new_task['payload'] = self.construct_payload_for_task(**kw)
+            payload = self.construct_payload_for_task(**kw)
         except:
             raise ValueError(f"Unexpected `payload` or custom attrs for task '{kwargs}'. Should be dict() or JSON.")
 
-        # Saving to DynamoDB.
-        self.dynamo_db_client.put(new_task)
-        logger.debug(f"Created a task: {new_task}")
+        payload = self.offload_payload(payload)
+
+        # Serialize only if the table still keeps payloads as JSON strings.
+        payload_type = self.config['dynamo_db_config']['row_mapper'].get(_('payload'))
+        new_task['payload'] = payload if payload_type == 'M' else json.dumps(payload)
+
+        return new_task
 
 
-    def construct_payload_for_task(self, **kwargs) -> str:
+    def construct_payload_for_task(self, **kwargs) -> Dict:
         """
-        Combines remaining kwargs to a singular JSON payload.
+        Combines remaining kwargs to a singular payload dictionary.
         """
 
         _ = self.get_db_field_name
@@ -276,6 +734,10 @@ class TaskManager(Processor):
         # Now create and fill the payload
         payload = kwargs.pop(_('payload'), dict())
 
+        # Payload may come already compressed. See `compress_fields` in config of DynamoDbClient.
+        if is_packed(payload):
+            payload = unpack(payload)
+
         # We have to use a dictionary to add more elements soon.
         if isinstance(payload, str):
             try:
@@ -292,7 +754,34 @@ class TaskManager(Processor):
             result[key] = value
 
         logger.debug(f"Constructed payload ({result})from {kwargs}")
-        return json.dumps(result)
+        return result
+
+
+    @property
+    def claim_check_store(self) -> Optional[ClaimCheckStore]:
+        if self._claim_check_store is None and self.config.get('payload_claim_check_uri'):
+            self._claim_check_store = get_claim_check_store(self.config['payload_claim_check_uri'])
+        return self._claim_check_store
+
+
+    def offload_payload(self, payload: Dict) -> Dict:
+        """
+        Save the `payload` to the claim check store if it is larger than `payload_claim_check_threshold`.
+        Payloads are serialized to measure the size only if the store is configured.
+
+        :return:    Pointer to the saved payload or the `payload` itself.
+        """
+
+        store = self.claim_check_store
+        if not store or is_claim_check(payload):
+            return payload
+
+        data = store.serialize(payload)
+        if len(data) < self.config['payload_claim_check_threshold']:
+            return payload
+
+        self.stats['offloaded_payloads'] += 1
+        return store.put(payload, data=data)
 
 
     def is_valid_task(self, task: Dict) -> bool:
@@ -338,6 +827,9 @@ class TaskManager(Processor):
 
         # Flatten the payload
         call_payload = task.pop('payload', {})
+        if is_claim_check(call_payload) and self.config.get('payload_claim_check_resolve', True):
+            store = self.claim_check_store
+            call_payload = store.get(call_payload) if store else resolve_claim_check(call_payload)
         call_payload.update(task)
 
         lambda_response = self.lambda_client.invoke(
@@ -375,6 +867,7 @@ class TaskManager(Processor):
                 attributes_to_increment={_('attempts'): 1},
                 condition_expression=f"{_('greenfield')} < {labourer.get_attr('start')}"
         )
+        self.drop_labourer_snapshot(labourer.id)
 
 
     # Depricated
@@ -391,30 +884,91 @@ class TaskManager(Processor):
 
         # Get task
         task = self.get_task_by_id(task_id)
+        self._stamp_closed_task(task, int(time.time()))
+
+        # Add it to completed tasks table and delete it from tasks_table in a single transaction,
+        # so the task can never be deleted without being archived. Transactions are also never buffered
+        # by `batch_writer()`, so the hooks below run only after the task is actually moved.
+        keys = {_('task_id'): task[_('task_id')]}
+        self.dynamo_db_client.transact_write(
+                self.dynamo_db_client.make_put_transaction_item(task,
+                                                                table_name=self.config.get('sosw_closed_tasks_table')),
+                self.dynamo_db_client.make_delete_transaction_item(keys,
+                                                                   table_name=self.config['dynamo_db_config']['table_name']))
+
+        self._after_tasks_archived([task])
+
+
+    def archive_tasks(self, tasks: List[Dict]):
+        """
+        Archive many `tasks` already fetched from the tasks table (e.g. by `get_completed_tasks_for_labourer()`).
+        Unlike calling `archive_task()` in a loop, the tasks are not fetched again by ID, and are moved with
+        batched writes: 25 items per `BatchWriteItem` call.
+
+        All the tasks are first written to the closed tasks table, and only after that deleted from the tasks table.
+        If the call fails in the middle, no task is lost: some of them just stay in both tables. Both writes are
+        idempotent, so the next call (e.g. the next run of Scavenger) completes the archiving.
+
+        :param list tasks:  Full items of the tasks. The items are not modified.
+        """
+
+        _ = self.get_db_field_name
+
+        if not tasks:
+            return
+
+        closed_at = int(time.time())
+        closed_tasks = [self._stamp_closed_task(dict(task), closed_at) for task in tasks]
+
+        self.dynamo_db_client.batch_put(closed_tasks, table_name=self.config.get('sosw_closed_tasks_table'))
+        self.dynamo_db_client.batch_delete([{_('task_id'): task[_('task_id')]} for task in closed_tasks],
+                                           table_name=self.config['dynamo_db_config']['table_name'])
+
+        self._after_tasks_archived(closed_tasks)
+
+
+    def _stamp_closed_task(self, task: Dict, closed_at: int) -> Dict:
+        """ Set the fields of the `task` required in the closed tasks table. Updates the `task` in place. """
+
+        _ = self.get_db_field_name
 
-        # Update labourer_id_task_status field.
         is_completed = 1 if task.get(_('completed_at')) else 0
         labourer_id = task.get(_('labourer_id'))
         task[_('labourer_id_task_status')] = f"{labourer_id}_{is_completed}"
-        task[_('closed_at')] = int(time.time())
+        task[_('closed_at')] = closed_at
 
-        # Add it to completed tasks table:
-        self.dynamo_db_client.put(task, table_name=self.config.get('sosw_closed_tasks_table'))
+        return task
 
-        # Delete it from tasks_table
-        keys = {_('task_id'): task[_('task_id')]}
-        self.dynamo_db_client.delete(keys)
 
-        self.stats['archived_tasks'] += 1
+    def _after_tasks_archived(self, tasks: List[Dict]):
+        """ Update the snapshots, stats and rolling durations after the `tasks` left the tasks table. """
+
+        _ = self.get_db_field_name
+
+        tasks_by_labourer = defaultdict(list)
+        for task in tasks:
+            self._forget_task_in_snapshots(task[_('task_id')])
+            self.stats['archived_tasks'] += 1
+            tasks_by_labourer[task.get(_('labourer_id'))].append(task)
+
+        if self.config.get('labourer_stats_table'):
+            for labourer_id, labourer_tasks in tasks_by_labourer.items():
+                try:
+                    self.record_task_durations(labourer_tasks)
+                except Exception:
+                    logger.exception(f"Failed to record durations of {len(labourer_tasks)} tasks "
+                                     f"to labourer stats of {labourer_id}")
 
 
-    def get_task_by_id(self, task_id: str) -> Dict:
-        """ Fetches the full data of the Task. """
+    def get_task_by_id(self, task_id: str, cached: bool = False) -> Dict:
+        """
+        Fetches the full data of the Task.
+
+        :param cached:  Allow the task from the read cache of DynamoDbClient (if enabled in config). The task may be
+                        up to `read_cache_ttl` seconds stale, so never use it before updating or moving the task.
+        """
 
-        tasks = self.dynamo_db_client.get_by_query({self.get_db_field_name('task_id'): task_id})
-        assert len(tasks) in [0, 1], "Fetched more than 1 task by primary key(). Something broke your DB " \
-                                     "schema."
-        return tasks[0] if tasks else {}
+        return self.dynamo_db_client.get_item({self.get_db_field_name('task_id'): task_id}, cached=cached)
 
 
     def get_next_for_labourer(self, labourer: Labourer, cnt: int = 1, only_ids: bool = False) -> List[Union[str, Dict]]:
@@ -430,6 +984,13 @@ class TaskManager(Processor):
         # Maximum value to identify the task as available for invocation (either new, or ready for retry).
         max_greenfield = labourer.get_attr('start')
 
+        snapshot = self.get_labourer_snapshot(labourer, queued=True)
+        if snapshot and (len(snapshot['queued']) >= cnt or not snapshot['queued_truncated']):
+            if not snapshot['queued']:
+                return []
+            if only_ids:
+                return [task[self.get_db_field_name('task_id')] for task in snapshot['queued'][:cnt]]
+
         result = self.dynamo_db_client.get_by_query(
                 {
                     self.get_db_field_name('labourer_id'): labourer.id,
@@ -441,7 +1002,8 @@ class TaskManager(Processor):
                 max_items=cnt,
                 comparisons={
                     self.get_db_field_name('greenfield'): '<'
-                })
+                },
+                fields=[self.get_db_field_name('task_id')] if only_ids else None)
 
         logger.debug(f"get_next_for_labourer() received: {result} from {self.config['dynamo_db_config']['table_name']} "
                      f"for labourer: {labourer.id} max greenfield: {max_greenfield}")
@@ -491,6 +1053,10 @@ class TaskManager(Processor):
 
         _ = self.get_db_field_name
 
+        snapshot = self.get_labourer_snapshot(labourer)
+        if snapshot:
+            return snapshot['counts']['running'] if count else self._get_full_tasks(snapshot['running'])
+
         q = dict(
                 keys={
                     _('labourer_id'):                labourer.id,
@@ -527,6 +1093,10 @@ class TaskManager(Processor):
 
         _ = self.get_db_field_name
 
+        snapshot = self.get_labourer_snapshot(labourer)
+        if snapshot:
+            return self._get_full_tasks(snapshot['completed'])
+
         query_args = {
             'keys':        {
                 _('labourer_id'): labourer.id,
@@ -545,6 +1115,10 @@ class TaskManager(Processor):
 
         _ = self.get_db_field_name
 
+        snapshot = self.get_labourer_snapshot(labourer)
+        if snapshot:
+            return self._get_full_tasks(snapshot['expired'])
+
         return self.dynamo_db_client.get_by_query(
                 keys={
                     _('labourer_id'):                labourer.id,
@@ -564,15 +1138,18 @@ class TaskManager(Processor):
 
         _ = self.get_db_field_name
 
-        # Add task to retry table
         retry_row = task.copy()
         retry_row[_('desired_launch_time')] = int(time.time()) + wanted_delay
-        self.dynamo_db_client.put(retry_row, table_name=self.config.get('sosw_retry_tasks_table'))
 
-        # Delete task from tasks table
+        # Add task to retry table and delete it from tasks table in a single transaction. See `archive_task()`.
         delete_keys = {_('task_id'): task[_('task_id')]}
-        self.dynamo_db_client.delete(delete_keys)
+        self.dynamo_db_client.transact_write(
+                self.dynamo_db_client.make_put_transaction_item(retry_row,
+                                                                table_name=self.config.get('sosw_retry_tasks_table')),
+                self.dynamo_db_client.make_delete_transaction_item(delete_keys,
+                                                                   table_name=self.config['dynamo_db_config']['table_name']))
 
+        self._forget_task_in_snapshots(task[_('task_id')])
         self.stats['scheduled_for_retry_later_tasks'] += 1
 
 
@@ -605,27 +1182,43 @@ class TaskManager(Processor):
 
         lowest_greenfield = self.get_oldest_greenfield_for_labourer(labourer)
 
+        # If boto supports DynamoDB transaction, use them to add task to tasks_table and delete from retry_table
+        # https://github.com/boto/boto3/issues/1791: It's available for 1.9.54+
+        use_transactions = parse_version(str(boto3.__version__)) >= parse_version('1.9.54')
+        if not use_transactions:
+            logger.info("Looks like you are running an ancient copy of boto3 still in old Environment of Lambda."
+                        "Salut to AWS from March 2019.")
+
+        transactions = []
         for task in tasks:
             del task['desired_launch_time']
             lowest_greenfield = lowest_greenfield - 1
             task[_('greenfield')] = lowest_greenfield
             delete_keys = {_('labourer_id'): labourer.id, _('task_id'): task[_('task_id')]}
 
-            # If boto supports DynamoDB transaction, use them to add task to tasks_table and delete from retry_table
-            # https://github.com/boto/boto3/issues/1791: It's available for 1.9.54+
-            if parse_version(str(boto3.__version__)) >= parse_version('1.9.54'):
-                put_query = self.dynamo_db_client.make_put_transaction_item(task)
-                delete_query = self.dynamo_db_client.make_delete_transaction_item(
-                        delete_keys, table_name=self.config.get('sosw_retry_tasks_table'))
-                self.dynamo_db_client.transact_write(put_query, delete_query)
+            if use_transactions:
+                # Put and Delete of the same task are a group of 2, so they always get to the same transaction chunk.
+                transactions.append(self.dynamo_db_client.make_put_transaction_item(task))
+                transactions.append(self.dynamo_db_client.make_delete_transaction_item(
+                        delete_keys, table_name=self.config.get('sosw_retry_tasks_table')))
 
             else:
-                logger.info("Looks like you are running an ancient copy of boto3 still in old Environment of Lambda."
-                            "Salut to AWS from March 2019.")
                 self.dynamo_db_client.put(task)
                 self.dynamo_db_client.delete(keys=delete_keys, table_name=self.config.get('sosw_retry_tasks_table'))
+                self.stats['due_for_retry_tasks'] += 1
+
+        def count_moved(t_chunk):
+            self.stats['due_for_retry_tasks'] += len(t_chunk) // 2
+
+        try:
+            if transactions:
+                self.dynamo_db_client.transact_write(*transactions, concurrent=True, group_size=2,
+                                                     on_commit=count_moved)
+        finally:
+            # Some tasks could have been moved even if the write failed.
+            if tasks:
+                self.drop_labourer_snapshot(labourer.id)
 
-            self.stats['due_for_retry_tasks'] += 1
 
     @benchmark
     def get_average_labourer_duration(self, labourer: Labourer) -> int:
@@ -678,3 +1271,102 @@ class TaskManager(Processor):
             return round(sum(durations) / len(durations))
         except ZeroDivisionError:
             return 0
+
+
+    def record_task_duration(self, task: Dict):
+        """ Add the duration of the closed `task` to the rolling statistics. See `record_task_durations()`. """
+
+        self.record_task_durations([task])
+
+
+    def record_task_durations(self, tasks: List[Dict]):
+        """
+        Add the durations of the closed `tasks` to the rolling statistics of their Labourers in `labourer_stats_table`.
+        The same as in `get_average_labourer_duration()`, failed tasks are counted as `attempts` of max duration.
+
+        The statistics item has the number of observations, their sum and the histogram of durations.
+        The counters of all the `tasks` of the same Labourer are summed up and added with a single atomic increment,
+        so concurrent updates are safe.
+
+        Once the number of observations reaches `labourer_stats_decay_after`, all the counters are halved.
+        So the statistics are exponentially weighted towards the recent tasks.
+        """
+
+        _ = self.get_db_field_name
+
+        histogram = LatencyHistogram(**DURATION_HISTOGRAM_SETTINGS)
+        increments = defaultdict(lambda: defaultdict(int))
+
+        for task in tasks:
+            labourer = self.get_labourer(task[_('labourer_id')])
+
+            if task.get(_('completed_at')):
+                duration = task[_('completed_at')] - task[_('greenfield')] + self.config['greenfield_invocation_delta']
+                count = 1
+            else:
+                duration = getattr(labourer, 'max_duration', None) or Labourer.DEFAULTS['duration']
+                count = int(task.get(_('attempts')) or 1)
+
+            counters = increments[task[_('labourer_id')]]
+            counters['duration_count'] += count
+            counters['duration_sum'] += duration * count
+            counters[f"{DURATION_BUCKET_PREFIX}{histogram.get_bucket(duration)}"] += count
+
+        for labourer_id, counters in increments.items():
+            keys = {_('labourer_id'): labourer_id}
+            item = self.dynamo_db_client.update(keys, attributes_to_increment=dict(counters),
+                                                table_name=self.config['labourer_stats_table'],
+                                                return_values='ALL_NEW')
+
+            if item and item.get('duration_count', 0) >= self.config['labourer_stats_decay_after']:
+                self._decay_labourer_duration_stats(keys, item)
+
+
+    def get_labourer_duration_stats(self, labourer: Labourer) -> Optional[Dict]:
+        """
+        Read the rolling statistics of durations of `labourer` maintained by `record_task_durations()`.
+
+        :return:    Dict with `count`, `average`, `p50` and `p95` durations in seconds. None if there is no data.
+        """
+
+        item = self.dynamo_db_client.get_item({self.get_db_field_name('labourer_id'): labourer.id},
+                                              table_name=self.config['labourer_stats_table'], strict=False,
+                                              cached=True)
+        count = item.get('duration_count', 0)
+        if count <= 0:
+            return None
+
+        buckets = {int(k[len(DURATION_BUCKET_PREFIX):]): v for k, v in item.items()
+                   if k.startswith(DURATION_BUCKET_PREFIX)}
+        histogram = LatencyHistogram(**DURATION_HISTOGRAM_SETTINGS)
+        histogram.add_buckets(buckets)
+
+        return {
+            'count':   count,
+            'average': item.get('duration_sum', 0) / count,
+            'p50':     histogram.percentile(50),
+            'p95':     histogram.percentile(95),
+        }
+
+
+    def _decay_labourer_duration_stats(self, keys: Dict, item: Dict):
+        """
+        Halve the counters of the statistics item. Subtracting keeps the increments made concurrently since `item`
+        was returned. The random `duration_epoch` guards from decaying twice by concurrent writers.
+        The halving is integer (odd counters keep the larger half), so the counters stay whole numbers.
+        """
+
+        counters = {k: -(v // 2) for k, v in item.items() if k in ('duration_count', 'duration_sum')
+                    or k.startswith(DURATION_BUCKET_PREFIX)}
+
+        epoch = item.get('duration_epoch')
+        condition = f"duration_epoch = {epoch}" if epoch else "attribute_not_exists duration_epoch"
+
+        try:
+            self.dynamo_db_client.update(keys, attributes_to_update={'duration_epoch': uuid.uuid4().hex},
+                                         attributes_to_increment=counters, condition_expression=condition,
+                                         table_name=self.config['labourer_stats_table'])
+        except Exception as err:
+            if err.__class__.__name__ != 'ConditionalCheckFailedException':
+                raise
+            logger.info(f"Labourer stats {keys} were decayed concurrently")
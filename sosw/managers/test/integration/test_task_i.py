@@ -289,6 +289,27 @@ class TaskManager_IntegrationTestCase(unittest.TestCase):
         self.assertTrue(time.time() - 360 < completed_task[_('closed_at')] < time.time())
 
 
+    def test_archive_tasks(self):
+        _ = self.manager.get_db_field_name
+        tasks = [{_('task_id'): str(i), _('labourer_id'): 'lambda1', _('greenfield'): 8888 + i, _('attempts'): 2}
+                 for i in range(30)]
+        for task in tasks:
+            self.dynamo_client.put(task)
+
+        # Call twice to make sure that repeating the call is harmless.
+        self.manager.archive_tasks(tasks)
+        self.manager.archive_tasks(tasks)
+
+        for task in tasks:
+            self.assertEqual(len(self.dynamo_client.get_by_query({_('task_id'): task[_('task_id')]})), 0)
+
+            completed_tasks = self.dynamo_client.get_by_query({_('task_id'): task[_('task_id')]},
+                                                              table_name=self.completed_tasks_table)
+            self.assertEqual(len(completed_tasks), 1)
+            self.assertEqual(completed_tasks[0][_('labourer_id_task_status')], 'lambda1_0')
+            self.assertTrue(time.time() - 360 < completed_tasks[0][_('closed_at')] < time.time())
+
+
     def test_move_task_to_retry_table(self):
         _ = self.manager.get_db_field_name
         labourer_id = 'lambda1'
@@ -109,3 +109,23 @@ class ecology_manager_UnitTestCase(unittest.TestCase):
         # But the counter of tasks in cache should have.
         self.assertEqual(self.manager.running_tasks[self.LABOURER.id],
                          tm.get_count_of_running_tasks_for_labourer.return_value + 1 + 5)
+
+
+    def test_get_labourer_average_duration__uses_rolling_stats(self):
+        tm = MagicMock()
+        tm.config = {'labourer_stats_table': 'autotest_sosw_labourer_stats'}
+        tm.get_labourer_duration_stats.return_value = {'count': 10, 'average': 41.6, 'p50': 40, 'p95': 60}
+        self.manager.register_task_manager(tm)
+
+        self.assertEqual(self.manager.get_labourer_average_duration(self.LABOURER), 42)
+        tm.get_average_labourer_duration.assert_not_called()
+
+
+    def test_get_labourer_average_duration__no_rolling_stats(self):
+        tm = MagicMock()
+        tm.config = {'labourer_stats_table': 'autotest_sosw_labourer_stats'}
+        tm.get_labourer_duration_stats.return_value = None
+        tm.get_average_labourer_duration.return_value = 30
+        self.manager.register_task_manager(tm)
+
+        self.assertEqual(self.manager.get_labourer_average_duration(self.LABOURER), 30)
@@ -3,6 +3,8 @@ import json
 import logging
 import os
 import random
+import tempfile
+import threading
 import time
 import unittest
 import uuid
@@ -17,9 +19,54 @@ logging.getLogger('botocore').setLevel(logging.WARNING)
 os.environ["STAGE"] = "test"
 os.environ["autotest"] = "True"
 
+from sosw.components.compression import pack
 from sosw.labourer import Labourer
-from sosw.managers.task import TaskManager
-from sosw.test.variables import TEST_TASK_CLIENT_CONFIG
+from sosw.managers.ecology import EcologyManager
+from sosw.managers.task import TaskManager, _labourer_attributes_cache
+from sosw.test.variables import TEST_ECOLOGY_CLIENT_CONFIG, TEST_TASK_CLIENT_CONFIG
+from sosw.components.boto3_clients import reset_boto3_clients
+
+
+class ConditionalCheckFailedException(Exception):
+    pass
+
+
+class FakeGreenfieldCounters:
+    """ Emulates the conditional writes to the counter of greenfields in DynamoDB. """
+
+    def __init__(self, manager, greenfield=None, lease_expires_at=None):
+        self.item = {k: v for k, v in [('greenfield', greenfield), ('lease_expires_at', lease_expires_at)]
+                     if v is not None}
+        self.newest_greenfield = manager.config['greenfield_task_step']
+
+        manager.get_newest_greenfield_for_labourer = lambda labourer: self.newest_greenfield
+        manager.dynamo_db_client.update.side_effect = self.update
+        manager.dynamo_db_client.get_item.side_effect = lambda *args, **kwargs: dict(self.item)
+
+
+    @property
+    def greenfield(self):
+        return self.item.get('greenfield')
+
+
+    def update(self, keys, attributes_to_update=None, attributes_to_increment=None, condition_expression=None,
+               **kwargs):
+        words = condition_expression.split()
+        if words[0] == 'attribute_not_exists':
+            passed = words[1] not in self.item
+        elif words[1] == '>':
+            passed = words[0] in self.item and self.item[words[0]] > int(words[2])
+        else:
+            passed = self.item.get(words[0]) == int(words[2])
+
+        if not passed:
+            raise ConditionalCheckFailedException(condition_expression)
+
+        self.item.update(attributes_to_update or {})
+        for k, v in (attributes_to_increment or {}).items():
+            self.item[k] = self.item.get(k, 0) + v
+
+        return dict(self.item)
 
 
 class task_manager_UnitTestCase(unittest.TestCase):
@@ -45,6 +92,7 @@ class task_manager_UnitTestCase(unittest.TestCase):
         self.RANGE_KEY = ('labourer_id', 'S')
         self.table_name = self.config['dynamo_db_config']['table_name']
 
+        reset_boto3_clients()
         with patch('boto3.client'):
             self.manager = TaskManager(custom_config=self.config)
 
@@ -56,6 +104,8 @@ class task_manager_UnitTestCase(unittest.TestCase):
 
     def tearDown(self):
         self.patcher.stop()
+        reset_boto3_clients()
+        _labourer_attributes_cache.clear()
 
 
     def test_get_db_field_name(self):
@@ -172,6 +222,28 @@ class task_manager_UnitTestCase(unittest.TestCase):
         # self.assertEqual(call_kwargs['Payload'], json.dumps(task['payload']))
 
 
+    def test_invoke_task__resolves_claim_check(self):
+        self.manager.is_valid_task = MagicMock(return_value=True)
+        self.manager.mark_task_invoked = MagicMock()
+
+        with tempfile.TemporaryDirectory() as path:
+            self.manager.config['payload_claim_check_uri'] = f"file://{path}"
+            pointer = self.manager.offload_payload({'foo': 'x' * 200000})
+
+            task = {self.HASH_KEY[0]: 'task_id_256', self.RANGE_KEY[0]: self.labourer.id, 'payload': pointer}
+            self.manager.invoke_task(task=dict(task), labourer=self.labourer)
+
+            call_args, call_kwargs = self.manager.lambda_client.invoke.call_args
+            self.assertEqual(json.loads(call_kwargs['Payload'])['foo'], 'x' * 200000)
+
+            # Pass the pointer to the Worker.
+            self.manager.config['payload_claim_check_resolve'] = False
+            self.manager.invoke_task(task=dict(task), labourer=self.labourer)
+
+            call_args, call_kwargs = self.manager.lambda_client.invoke.call_args
+            self.assertEqual(json.loads(call_kwargs['Payload'])['sosw_claim_check'], pointer['sosw_claim_check'])
+
+
     def test_invoke_task__not_calls__lambda_client_if_raised_conditional_exception(self):
         self.manager.register_labourers()
 
@@ -223,6 +295,62 @@ class task_manager_UnitTestCase(unittest.TestCase):
         self.assertEqual(lab.get_attr('max_attempts'), 3)
 
 
+    def test_register_labourers__evaluates_attributes_once(self):
+        self.manager.ecology_client.get_labourer_average_duration.return_value = 42
+
+        labourers = self.manager.register_labourers()
+
+        self.assertEqual(len(labourers), 2)
+        self.assertTrue(all(x.get_attr('average_duration') == 42 for x in labourers))
+        self.assertEqual(self.manager.ecology_client.get_labourer_status.call_count, 2)
+        self.assertEqual(self.manager.ecology_client.get_labourer_average_duration.call_count, 2)
+
+
+    def test_register_labourers__caches_durations(self):
+        self.manager.register_labourers()
+        self.manager.register_labourers()
+
+        self.assertEqual(self.manager.ecology_client.get_labourer_average_duration.call_count, 2)
+        self.assertEqual(self.manager.ecology_client.get_max_labourer_duration.call_count, 2)
+        self.assertEqual(self.manager.ecology_client.get_labourer_status.call_count, 4)
+
+        self.manager.config['labourer_attributes_cache_ttl'] = 0
+        self.manager.register_labourers()
+
+        self.assertEqual(self.manager.ecology_client.get_labourer_average_duration.call_count, 4)
+
+
+    def test_register_labourers__average_duration_of_failed_tasks(self):
+        self.manager.ecology_client = EcologyManager(custom_config=TEST_ECOLOGY_CLIENT_CONFIG)
+
+        failed_task = {'task_id': '123', 'labourer_id': 'some_function', 'attempts': 2,
+                       'greenfield': 1000, 'labourer_id_task_status': 'some_function_0'}
+
+        self.manager.dynamo_db_client.get_by_query.side_effect = \
+            lambda keys, **kwargs: [failed_task] if keys['labourer_id_task_status'].endswith('_0') else []
+
+        labourers = self.manager.register_labourers()
+
+        self.assertEqual([x.get_attr('max_duration') for x in labourers], [900, 900])
+        self.assertEqual([x.get_attr('average_duration') for x in labourers], [900, 900])
+
+
+    def test_register_labourers__updates_shared_state_in_calling_thread(self):
+        threads = set()
+
+        def record_thread(*args, **kwargs):
+            threads.add(threading.get_ident())
+
+        with patch('sosw.managers.task._labourer_attributes_cache') as cache_mock:
+            cache_mock.get.side_effect = lambda key, default=None: default
+            cache_mock.set.side_effect = record_thread
+
+            labourers = self.manager.register_labourers()
+
+        self.assertEqual(cache_mock.set.call_count, 2 * len(labourers))
+        self.assertEqual(threads, {threading.get_ident()})
+
+
     def test_register_labourers__calls_register_task_manager(self):
 
         self.manager.register_labourers()
@@ -247,6 +375,7 @@ class task_manager_UnitTestCase(unittest.TestCase):
             'some_lambda2': {'foo': 'baz'},
         }
 
+        reset_boto3_clients()
         with patch('boto3.client'):
             self.task_client = TaskManager(custom_config=self.config)
 
@@ -274,9 +403,103 @@ class task_manager_UnitTestCase(unittest.TestCase):
         # Check calls
         expected_completed_task = task.copy()
         expected_completed_task['labourer_id_task_status'] = 'some_lambda_1'
-        self.manager.dynamo_db_client.put.assert_called_once_with(expected_completed_task, table_name=self.TEST_CONFIG[
-            'sosw_closed_tasks_table'])
-        self.manager.dynamo_db_client.delete.assert_called_once_with({'task_id': task_id})
+        dynamo = self.manager.dynamo_db_client
+        dynamo.make_put_transaction_item.assert_called_once_with(
+                expected_completed_task, table_name=self.TEST_CONFIG['sosw_closed_tasks_table'])
+        dynamo.make_delete_transaction_item.assert_called_once_with(
+                {'task_id': task_id}, table_name=self.TEST_CONFIG['dynamo_db_config']['table_name'])
+
+        # Put and delete are in the same transaction, never in a batch without guaranteed order.
+        dynamo.transact_write.assert_called_once_with(dynamo.make_put_transaction_item.return_value,
+                                                      dynamo.make_delete_transaction_item.return_value)
+        dynamo.put.assert_not_called()
+        dynamo.delete.assert_not_called()
+
+
+    def test_archive_task__hooks_after_write(self):
+        self.manager.get_task_by_id = Mock(return_value={'labourer_id': 'some_lambda', 'task_id': '1'})
+        self.manager.dynamo_db_client.transact_write.side_effect = RuntimeError("TransactionCanceledException")
+
+        self.assertRaises(RuntimeError, self.manager.archive_task, '1')
+        self.assertEqual(self.manager.stats['archived_tasks'], 0)
+
+
+    def test_move_task_to_retry_table(self):
+        task = {'labourer_id': 'some_lambda', 'task_id': '1', 'attempts': 2}
+        dynamo = self.manager.dynamo_db_client
+
+        self.manager.move_task_to_retry_table(task, 300)
+
+        put_args, put_kwargs = dynamo.make_put_transaction_item.call_args
+        self.assertEqual(put_kwargs['table_name'], self.TEST_CONFIG['sosw_retry_tasks_table'])
+        self.assertGreater(put_args[0]['desired_launch_time'], time.time())
+        dynamo.make_delete_transaction_item.assert_called_once_with(
+                {'task_id': '1'}, table_name=self.TEST_CONFIG['dynamo_db_config']['table_name'])
+        dynamo.transact_write.assert_called_once_with(dynamo.make_put_transaction_item.return_value,
+                                                      dynamo.make_delete_transaction_item.return_value)
+
+
+    def test_archive_tasks(self):
+        tasks = [{'labourer_id': 'some_lambda', 'task_id': '1', 'completed_at': 1551962375},
+                 {'labourer_id': 'some_lambda', 'task_id': '2', 'attempts': 3}]
+        original = deepcopy(tasks)
+        self.manager.dynamo_db_client = MagicMock()
+        self.manager.get_task_by_id = Mock()
+
+        self.manager.archive_tasks(tasks)
+
+        # Items are not fetched again and not modified.
+        self.manager.get_task_by_id.assert_not_called()
+        self.assertEqual(tasks, original)
+
+        put_args, put_kwargs = self.manager.dynamo_db_client.batch_put.call_args
+        self.assertEqual(put_kwargs['table_name'], self.TEST_CONFIG['sosw_closed_tasks_table'])
+        self.assertEqual([x['labourer_id_task_status'] for x in put_args[0]], ['some_lambda_1', 'some_lambda_0'])
+        self.assertTrue(all(x['closed_at'] for x in put_args[0]))
+
+        delete_args, delete_kwargs = self.manager.dynamo_db_client.batch_delete.call_args
+        self.assertEqual(delete_args[0], [{'task_id': '1'}, {'task_id': '2'}])
+        self.assertEqual(delete_kwargs['table_name'], self.TEST_CONFIG['dynamo_db_config']['table_name'])
+
+        self.manager.dynamo_db_client.put.assert_not_called()
+        self.manager.dynamo_db_client.delete.assert_not_called()
+        self.assertEqual(self.manager.stats['archived_tasks'], 2)
+
+
+    def test_archive_tasks__puts_before_deletes(self):
+        self.manager.dynamo_db_client = MagicMock()
+        self.manager.dynamo_db_client.batch_put.side_effect = RuntimeError("Unprocessed items")
+
+        self.assertRaises(RuntimeError, self.manager.archive_tasks, [{'labourer_id': 'some_lambda', 'task_id': '1'}])
+
+        # Nothing is deleted if the tasks were not written to the closed table.
+        self.manager.dynamo_db_client.batch_delete.assert_not_called()
+        self.assertEqual(self.manager.stats['archived_tasks'], 0)
+
+
+    def test_archive_tasks__empty(self):
+        self.manager.dynamo_db_client = MagicMock()
+
+        self.manager.archive_tasks([])
+
+        self.manager.dynamo_db_client.batch_put.assert_not_called()
+        self.manager.dynamo_db_client.batch_delete.assert_not_called()
+
+
+    def test_get_task_by_id(self):
+        self.manager.dynamo_db_client.get_item.return_value = {'task_id': '123', 'labourer_id': 'some_lambda'}
+
+        self.assertEqual(self.manager.get_task_by_id('123'), {'task_id': '123', 'labourer_id': 'some_lambda'})
+        self.manager.dynamo_db_client.get_item.assert_called_once_with({'task_id': '123'}, cached=False)
+        self.manager.dynamo_db_client.get_by_query.assert_not_called()
+
+
+    def test_read_cache__disabled_by_default(self):
+        self.assertNotIn('read_cache_size', TaskManager.DEFAULT_CONFIG['dynamo_db_config'])
+
+        # Moving the task must never see a stale copy of it.
+        self.manager.archive_task('123')
+        self.assertFalse(self.manager.dynamo_db_client.get_item.call_args[1]['cached'])
 
 
     # @unittest.skip("Function currently depricated")
@@ -321,6 +544,49 @@ class task_manager_UnitTestCase(unittest.TestCase):
         self.assertEqual(called_with_table, self.config['sosw_retry_tasks_table'])
 
 
+    def test_retry_tasks(self):
+        _ = self.manager.get_db_field_name
+        tasks = [{_('task_id'): str(i), _('labourer_id'): self.LABOURER.id, 'desired_launch_time': 1} for i in range(3)]
+
+        self.manager.get_oldest_greenfield_for_labourer = MagicMock(return_value=1000)
+        self.manager.dynamo_db_client.make_put_transaction_item.side_effect = lambda row: {'Put': row}
+        self.manager.dynamo_db_client.make_delete_transaction_item.side_effect = lambda keys, table_name: {
+            'Delete': keys}
+        self.manager.dynamo_db_client.transact_write.side_effect = \
+            lambda *transactions, on_commit, **kwargs: on_commit(list(transactions))
+
+        self.manager.retry_tasks(self.LABOURER, tasks)
+
+        # All the tasks are moved with a single call.
+        self.manager.dynamo_db_client.transact_write.assert_called_once()
+        transactions = self.manager.dynamo_db_client.transact_write.call_args[0]
+
+        self.assertEqual(len(transactions), 6)
+        self.assertEqual([t['Put'][_('greenfield')] for t in transactions[::2]], [999, 998, 997])
+        self.assertEqual([t['Delete'][_('task_id')] for t in transactions[1::2]], ['0', '1', '2'])
+        self.assertEqual(self.manager.stats['due_for_retry_tasks'], 3)
+
+
+    def test_retry_tasks__counts_only_moved(self):
+        _ = self.manager.get_db_field_name
+        tasks = [{_('task_id'): str(i), _('labourer_id'): self.LABOURER.id, 'desired_launch_time': 1} for i in range(3)]
+
+        self.manager.get_oldest_greenfield_for_labourer = MagicMock(return_value=1000)
+        self.manager.dynamo_db_client.make_put_transaction_item.side_effect = lambda row: {'Put': row}
+        self.manager.dynamo_db_client.make_delete_transaction_item.side_effect = lambda keys, table_name: {
+            'Delete': keys}
+
+        # The first pair of Put and Delete is committed, the rest fails.
+        def transact_write(*transactions, on_commit, **kwargs):
+            on_commit(list(transactions[:2]))
+            raise RuntimeError("TransactionCanceledException")
+
+        self.manager.dynamo_db_client.transact_write.side_effect = transact_write
+
+        self.assertRaises(RuntimeError, self.manager.retry_tasks, self.LABOURER, tasks)
+        self.assertEqual(self.manager.stats['due_for_retry_tasks'], 1)
+
+
     def test_get_tasks_to_retry_for_labourer(self):
 
         with patch('time.time') as t:
@@ -389,6 +655,150 @@ class task_manager_UnitTestCase(unittest.TestCase):
         self.assertEqual(result, 0 + self.manager.config['greenfield_task_step'])
 
 
+    def take_labourer_snapshot(self, queued=True):
+        labourer = self.manager.register_labourers()[0]
+        start, expired, invoked = (labourer.get_attr(x) for x in ('start', 'expired', 'invoked'))
+
+        queue = [
+            {'task_id': 'q1', 'greenfield': 1000},
+            {'task_id': 'q2', 'greenfield': 2000},
+            {'task_id': 'q3', 'greenfield': 3000},
+        ]
+        invoked_tasks = [
+            {'task_id': 'e1', 'greenfield': start + 1},
+            {'task_id': 'c1', 'greenfield': start + 2, 'completed_at': start},
+            {'task_id': 'r1', 'greenfield': expired},
+            {'task_id': 'r2', 'greenfield': invoked},
+        ]
+
+        def query(keys, comparisons, max_items=None, **kwargs):
+            tasks = queue if comparisons['greenfield'] == '<' else invoked_tasks
+            return iter(tasks[:max_items])
+
+        self.manager.dynamo_db_client.get_by_query_generator.side_effect = query
+        snapshot = self.manager.snapshot_labourer(labourer, queued=queued)
+        self.manager.dynamo_db_client.get_by_query.reset_mock()
+
+        return labourer, snapshot
+
+
+    def test_snapshot_labourer(self):
+        labourer, snapshot = self.take_labourer_snapshot()
+
+        self.assertEqual(snapshot['counts'], {'queued': 3, 'running': 2, 'expired': 1, 'completed': 1})
+        self.assertEqual([x['task_id'] for x in snapshot['running']], ['r1', 'r2'])
+        self.assertEqual(snapshot['oldest_greenfield'], 1000)
+        self.assertEqual(snapshot['newest_greenfield'], 3000)
+
+        (queue_args, queue_kwargs), (_, invoked_kwargs) = \
+            self.manager.dynamo_db_client.get_by_query_generator.call_args_list
+        start = labourer.get_attr('start')
+        self.assertEqual(queue_kwargs['keys'], {'labourer_id': labourer.id, 'greenfield': start})
+        self.assertEqual(queue_kwargs['comparisons'], {'greenfield': '<'})
+        self.assertEqual(queue_kwargs['max_items'], self.manager.config['labourer_snapshot_max_queued_ids'] + 1)
+        self.assertEqual(invoked_kwargs['comparisons'], {'greenfield': '>='})
+        self.assertNotIn('max_items', invoked_kwargs)
+        self.assertEqual(invoked_kwargs['fields'], ['task_id', 'greenfield', 'completed_at'])
+
+
+    def test_snapshot_labourer__max_queued(self):
+        labourer = self.manager.register_labourers()[0]
+        self.manager.get_labourer_snapshot = Mock(return_value=None)
+        self.manager.dynamo_db_client.get_by_query_generator.side_effect = lambda **kw: iter([])
+
+        self.manager.snapshot_labourer(labourer, max_queued=5)
+
+        self.assertEqual(self.manager.dynamo_db_client.get_by_query_generator.call_args_list[0][1]['max_items'], 6)
+
+
+    def test_snapshot_labourer__queue_truncated(self):
+        self.manager.config['labourer_snapshot_max_queued_ids'] = 2
+        labourer, snapshot = self.take_labourer_snapshot()
+
+        self.assertTrue(snapshot['queued_truncated'])
+        self.assertIsNone(snapshot['counts']['queued'])
+        self.assertEqual(len(snapshot['queued']), 2)
+        self.assertEqual(snapshot['oldest_greenfield'], 1000)
+        self.assertIsNone(snapshot['newest_greenfield'])
+
+        self.assertEqual(self.manager.get_next_for_labourer(labourer, cnt=2, only_ids=True), ['q1', 'q2'])
+        self.assertEqual(self.manager.get_oldest_greenfield_for_labourer(labourer), 1000)
+        self.manager.dynamo_db_client.get_by_query.assert_not_called()
+
+        # The end and the length of the queue are unknown to the snapshot.
+        self.manager.get_next_for_labourer(labourer, cnt=3, only_ids=True)
+        self.manager.get_newest_greenfield_for_labourer(labourer)
+        self.manager.get_length_of_queue_for_labourer(labourer)
+        self.assertEqual(self.manager.dynamo_db_client.get_by_query.call_count, 3)
+
+
+    def test_snapshot_labourer__empty_queue(self):
+        labourer = self.manager.register_labourers()[0]
+        self.manager.dynamo_db_client.get_by_query_generator.side_effect = lambda **kw: iter([])
+        self.manager.snapshot_labourer(labourer)
+
+        self.assertEqual(self.manager.get_next_for_labourer(labourer, cnt=3), [])
+        self.manager.dynamo_db_client.get_by_query.assert_not_called()
+
+
+    def test_snapshot_labourer__answers_queries(self):
+        labourer, snapshot = self.take_labourer_snapshot()
+        self.manager.dynamo_db_client.batch_get_items_one_table.return_value = [
+            {'task_id': 'r2', 'greenfield': 2}, {'task_id': 'r1', 'greenfield': 1},
+        ]
+
+        self.assertEqual(self.manager.get_oldest_greenfield_for_labourer(labourer), 1000)
+        self.assertEqual(self.manager.get_newest_greenfield_for_labourer(labourer), 3000)
+        self.assertEqual(self.manager.get_length_of_queue_for_labourer(labourer), 3)
+        self.assertEqual(self.manager.get_count_of_running_tasks_for_labourer(labourer), 2)
+        self.assertEqual(self.manager.get_next_for_labourer(labourer, cnt=5, only_ids=True), ['q1', 'q2', 'q3'])
+        self.manager.dynamo_db_client.get_by_query.assert_not_called()
+
+        # Full tasks are fetched by IDs and sorted by greenfield.
+        self.assertEqual([x['task_id'] for x in self.manager.get_running_tasks_for_labourer(labourer)], ['r1', 'r2'])
+        self.manager.dynamo_db_client.batch_get_items_one_table.assert_called_once_with(
+                [{'task_id': 'r1'}, {'task_id': 'r2'}])
+
+        self.manager.get_expired_tasks_for_labourer(labourer)
+        self.manager.get_completed_tasks_for_labourer(labourer)
+        self.manager.dynamo_db_client.get_by_query.assert_not_called()
+
+
+    def test_snapshot_labourer__without_queue(self):
+        labourer, snapshot = self.take_labourer_snapshot(queued=False)
+
+        self.assertIsNone(snapshot['queued'])
+        self.assertEqual(snapshot['counts'], {'queued': None, 'running': 2, 'expired': 1, 'completed': 1})
+
+        self.manager.dynamo_db_client.get_by_query_generator.assert_called_once()
+        call_kwargs = self.manager.dynamo_db_client.get_by_query_generator.call_args[1]
+        self.assertEqual(call_kwargs['keys'], {'labourer_id': labourer.id, 'greenfield': labourer.get_attr('start')})
+        self.assertEqual(call_kwargs['comparisons'], {'greenfield': '>='})
+
+        self.manager.dynamo_db_client.get_by_query.return_value = []
+        self.manager.get_oldest_greenfield_for_labourer(labourer)
+        self.manager.dynamo_db_client.get_by_query.assert_called_once()
+
+
+    def test_snapshot_labourer__updated_by_writes(self):
+        labourer, snapshot = self.take_labourer_snapshot()
+        self.manager.get_task_by_id = Mock(return_value={'task_id': 'c1', 'labourer_id': labourer.id})
+
+        self.manager.archive_task('c1')
+        self.assertEqual(snapshot['counts']['completed'], 0)
+        self.assertEqual(snapshot['completed'], [])
+
+        self.manager.create_task(labourer=labourer, payload={})
+        self.assertIsNone(self.manager.get_labourer_snapshot(labourer))
+
+
+    def test_register_labourers__drops_snapshots(self):
+        labourer, snapshot = self.take_labourer_snapshot()
+        self.manager.register_labourers()
+
+        self.assertIsNone(self.manager.get_labourer_snapshot(labourer))
+
+
     def test_create_task(self):
 
         TASK = dict(labourer=self.LABOURER, payload={'foo': 42})
@@ -434,6 +844,244 @@ class task_manager_UnitTestCase(unittest.TestCase):
         self.assertEqual(payload['lloyd'], 'green ninja')
 
 
+    def test_create_task__native_map_payload(self):
+        self.manager.config['dynamo_db_config'] = deepcopy(self.manager.config['dynamo_db_config'])
+        self.manager.config['dynamo_db_config']['row_mapper']['payload'] = 'M'
+        self.manager.get_newest_greenfield_for_labourer = MagicMock(return_value=5000)
+
+        self.manager.create_task(labourer=self.LABOURER, payload='{"foo": 42}', shops=[1, 3])
+
+        call_args, call_kwargs = self.manager.dynamo_db_client.put.call_args
+        self.assertEqual(call_args[0]['payload'], {'foo': 42, 'shops': [1, 3]})
+
+
+    def test_create_task__offloads_large_payload(self):
+        self.manager.get_newest_greenfield_for_labourer = MagicMock(return_value=5000)
+
+        with tempfile.TemporaryDirectory() as path:
+            self.manager.config['payload_claim_check_uri'] = f"file://{path}"
+            self.manager.config['payload_claim_check_threshold'] = 1000
+
+            self.manager.create_task(labourer=self.LABOURER, payload={'foo': 42})
+            self.manager.create_task(labourer=self.LABOURER, payload={'foo': 'x' * 1000})
+
+            small, large = [json.loads(c[0][0]['payload']) for c in self.manager.dynamo_db_client.put.call_args_list]
+
+            self.assertEqual(small, {'foo': 42})
+            self.assertEqual(list(large.keys()), ['sosw_claim_check'])
+            self.assertEqual(self.manager.claim_check_store.get(large), {'foo': 'x' * 1000})
+            self.assertEqual(self.manager.stats['offloaded_payloads'], 1)
+
+
+    def test_offload_payload__serializes_only_with_store(self):
+        with patch('sosw.managers.task.json.dumps') as dumps:
+            self.assertEqual(self.manager.offload_payload({'foo': 42}), {'foo': 42})
+            dumps.assert_not_called()
+
+        with tempfile.TemporaryDirectory() as path:
+            self.manager.config['payload_claim_check_uri'] = f"file://{path}"
+            self.manager.config['payload_claim_check_threshold'] = 10
+
+            with patch('sosw.components.claim_check.json.dumps', wraps=json.dumps) as dumps:
+                pointer = self.manager.offload_payload({'foo': 'x' * 100})
+
+            # The same serialized bytes are used to check the size and to write.
+            dumps.assert_called_once()
+            self.assertEqual(self.manager.claim_check_store.get(pointer), {'foo': 'x' * 100})
+
+
+    def test_create_task__queries_greenfield_once(self):
+        self.manager.get_newest_greenfield_for_labourer = MagicMock(return_value=5000)
+
+        self.manager.create_task(labourer=self.LABOURER, payload={'foo': 42})
+
+        self.manager.get_newest_greenfield_for_labourer.assert_called_once()
+
+
+    def test_create_tasks(self):
+        TASKS = [{'payload': {'foo': i}} for i in range(30)]
+        self.manager.get_newest_greenfield_for_labourer = MagicMock(return_value=5000)
+
+        self.manager.create_tasks(labourer=self.LABOURER, tasks=TASKS)
+
+        self.manager.get_newest_greenfield_for_labourer.assert_called_once()
+        self.manager.dynamo_db_client.put.assert_not_called()
+        self.manager.dynamo_db_client.batch_put.assert_called_once()
+
+        rows = self.manager.dynamo_db_client.batch_put.call_args[0][0]
+        self.assertEqual(len(rows), 30)
+
+        step = self.manager.config['greenfield_task_step']
+        for i, row in enumerate(rows, start=1):
+            self.assertEqual(row['greenfield'], str(5000 + step * i))
+            self.assertEqual(row['labourer_id'], self.LABOURER.id)
+            self.assertEqual(json.loads(row['payload']), {'foo': i - 1})
+
+        self.assertEqual(len(set(row['task_id'] for row in rows)), 30)
+
+
+    def test_allocate_greenfields(self):
+        self.manager.config['greenfield_counters_table'] = 'autotest_sosw_greenfield_counters'
+        self.manager.config['greenfield_counters_block_size'] = 3
+        step = self.manager.config['greenfield_task_step']
+        self.manager.get_newest_greenfield_for_labourer = MagicMock(return_value=2000)
+        self.manager.dynamo_db_client.update.side_effect = [{'greenfield': 5000}, {'greenfield': 9000}]
+
+        self.assertEqual(self.manager.allocate_greenfields(self.LABOURER), [3000])
+        self.assertEqual(self.manager.allocate_greenfields(self.LABOURER, 2), [4000, 5000])
+        self.assertEqual(self.manager.dynamo_db_client.update.call_count, 1)
+
+        # The block is exhausted. The next one is at least as large as requested.
+        self.assertEqual(self.manager.allocate_greenfields(self.LABOURER, 4), [6000, 7000, 8000, 9000])
+
+        call_args, call_kwargs = self.manager.dynamo_db_client.update.call_args
+        self.assertEqual(call_args[0], {'labourer_id': self.LABOURER.id})
+        self.assertEqual(call_kwargs['attributes_to_increment'], {'greenfield': 4 * step})
+        self.assertEqual(call_kwargs['table_name'], 'autotest_sosw_greenfield_counters')
+        self.assertEqual(call_kwargs['return_values'], 'UPDATED_NEW')
+
+        # The counter is incremented while the lease of the previous reservation is active. The lease is extended.
+        self.assertEqual(call_kwargs['condition_expression'].split()[:2], ['lease_expires_at', '>'])
+        self.assertIn('lease_expires_at', call_kwargs['attributes_to_update'])
+
+        # The end of the queue is read once per block, not per task.
+        self.assertEqual(self.manager.get_newest_greenfield_for_labourer.call_count, 2)
+
+
+    def test_allocate_greenfields__initializes_counter(self):
+        self.manager.config['greenfield_counters_table'] = 'autotest_sosw_greenfield_counters'
+        self.manager.config['greenfield_counters_block_size'] = 1
+        self.manager.get_newest_greenfield_for_labourer = MagicMock(return_value=7000)
+        self.manager.dynamo_db_client.update.side_effect = [ConditionalCheckFailedException(), None]
+        self.manager.dynamo_db_client.get_item.return_value = {}
+
+        self.assertEqual(self.manager.allocate_greenfields(self.LABOURER), [8000])
+
+        init_kwargs = self.manager.dynamo_db_client.update.call_args_list[1][1]
+        self.assertEqual(init_kwargs['attributes_to_update']['greenfield'], 8000)
+        self.assertGreater(init_kwargs['attributes_to_update']['lease_expires_at'], time.time())
+        self.assertEqual(init_kwargs['condition_expression'], 'attribute_not_exists greenfield')
+
+
+    def test_allocate_greenfields__drained_queue(self):
+        self.manager.config['greenfield_counters_table'] = 'autotest_sosw_greenfield_counters'
+        self.manager.config['greenfield_counters_block_size'] = 1
+        counters = FakeGreenfieldCounters(self.manager, greenfield=5000000, lease_expires_at=time.time() + 10)
+        counters.newest_greenfield = 1000
+
+        # The queue is empty, but the block below the counter may still be handed out by some other producer.
+        self.assertEqual(self.manager.allocate_greenfields(self.LABOURER), [5001000])
+        self.assertEqual(self.manager.stats['greenfield_counters_rebased'], 0)
+
+        # Once the lease has expired, the counter drops back to the end of the queue.
+        counters.item['lease_expires_at'] = time.time() - 1
+        self.manager._greenfield_blocks = {}
+        self.assertEqual(self.manager.allocate_greenfields(self.LABOURER), [2000])
+        self.assertEqual(counters.greenfield, 2000)
+        self.assertEqual(self.manager.stats['greenfield_counters_rebased'], 1)
+
+
+    def test_allocate_greenfields__counter_behind_queue(self):
+        self.manager.config['greenfield_counters_table'] = 'autotest_sosw_greenfield_counters'
+        self.manager.config['greenfield_counters_block_size'] = 1
+        counters = FakeGreenfieldCounters(self.manager, greenfield=1000)
+
+        # Tasks were queued without the counter, so it is rebased forward to the end of the queue.
+        counters.newest_greenfield = 7000
+        self.assertEqual(self.manager.allocate_greenfields(self.LABOURER), [8000])
+        self.assertEqual(counters.greenfield, 8000)
+        self.assertEqual(self.manager.stats['greenfield_counters_rebased'], 1)
+
+
+    def test_allocate_greenfields__concurrent_producers_dont_overlap(self):
+        self.manager.config['greenfield_counters_table'] = 'autotest_sosw_greenfield_counters'
+        self.manager.config['greenfield_counters_block_size'] = 5
+        counters = FakeGreenfieldCounters(self.manager)
+
+        with patch('boto3.client'):
+            other = TaskManager(custom_config=self.config)
+        other.dynamo_db_client = self.manager.dynamo_db_client
+        other.get_newest_greenfield_for_labourer = self.manager.get_newest_greenfield_for_labourer
+
+        # The other producer holds most of its block in memory. None of it reaches the queue.
+        handed_out = other.allocate_greenfields(self.LABOURER)
+
+        for _ in range(20):
+            self.manager._greenfield_blocks = {}
+            handed_out.extend(self.manager.allocate_greenfields(self.LABOURER, 2))
+            handed_out.extend(other.allocate_greenfields(self.LABOURER))
+
+        self.assertEqual(len(handed_out), len(set(handed_out)))
+
+
+    def test_allocate_greenfields__long_run(self):
+        self.manager.config['greenfield_counters_table'] = 'autotest_sosw_greenfield_counters'
+        step = self.manager.config['greenfield_task_step']
+        block_size = self.manager.config['greenfield_counters_block_size']
+        counters = FakeGreenfieldCounters(self.manager)
+        clock = [time.time()]
+
+        # A Scheduler creates a single task every minute and its container throws away the rest of the block.
+        # The queue stays empty. That is more reservations than the greenfields below now() could fit without reuse.
+        with patch('time.time', side_effect=lambda: clock[0]):
+            for _ in range(int(time.time() / (block_size * step)) + 1000):
+                clock[0] += 60
+                self.manager._greenfield_blocks = {}
+                self.assertEqual(self.manager.allocate_greenfields(self.LABOURER), [counters.newest_greenfield + step])
+
+        self.assertEqual(counters.greenfield, counters.newest_greenfield + block_size * step)
+
+
+    def test_allocate_greenfields__block_expires_in_memory(self):
+        self.manager.config['greenfield_counters_table'] = 'autotest_sosw_greenfield_counters'
+        self.manager.config['greenfield_counters_block_size'] = 10
+        counters = FakeGreenfieldCounters(self.manager)
+        clock = [time.time()]
+
+        with patch('time.time', side_effect=lambda: clock[0]):
+            self.assertEqual(self.manager.allocate_greenfields(self.LABOURER), [2000])
+            self.assertEqual(self.manager.allocate_greenfields(self.LABOURER), [3000])
+
+            # The rest of the block is not handed out after the half of the lease.
+            clock[0] += self.manager.config['greenfield_counters_lease_ttl'] / 2
+            self.assertEqual(self.manager.allocate_greenfields(self.LABOURER), [12000])
+
+        self.assertEqual(counters.greenfield, 21000)
+
+
+    def test_allocate_greenfields__too_close_to_now(self):
+        self.manager.config['greenfield_counters_table'] = 'autotest_sosw_greenfield_counters'
+        self.manager.get_newest_greenfield_for_labourer = MagicMock(return_value=int(time.time()) - 3600)
+
+        self.assertRaises(RuntimeError, self.manager.allocate_greenfields, self.LABOURER)
+        self.manager.dynamo_db_client.update.assert_not_called()
+
+
+    def test_create_tasks__greenfield_counters(self):
+        self.manager.config['greenfield_counters_table'] = 'autotest_sosw_greenfield_counters'
+        self.manager.get_newest_greenfield_for_labourer = MagicMock(return_value=100000)
+        self.manager.dynamo_db_client.update.return_value = {'greenfield': 200000}
+
+        self.manager.create_tasks(labourer=self.LABOURER, tasks=[{'payload': {'foo': i}} for i in range(3)])
+        self.manager.create_task(labourer=self.LABOURER, payload={'foo': 3})
+
+        rows = self.manager.dynamo_db_client.batch_put.call_args[0][0]
+        rows.append(self.manager.dynamo_db_client.put.call_args[0][0])
+        self.assertEqual([row['greenfield'] for row in rows], ['101000', '102000', '103000', '104000'])
+
+        self.manager.dynamo_db_client.update.assert_called_once()
+        self.manager.get_newest_greenfield_for_labourer.assert_called_once()
+
+
+    def test_create_tasks__empty(self):
+        self.manager.get_newest_greenfield_for_labourer = MagicMock()
+
+        self.manager.create_tasks(labourer=self.LABOURER, tasks=[])
+
+        self.manager.get_newest_greenfield_for_labourer.assert_not_called()
+        self.manager.dynamo_db_client.batch_put.assert_not_called()
+
+
     def test_construct_payload_for_task(self):
         TESTS = [
             (dict(payload={'foo': 42}), {'foo': 42}),  # Dictionary
@@ -441,10 +1089,11 @@ class task_manager_UnitTestCase(unittest.TestCase):
             (dict(payload={'foo': 42}, shops=[1, 3]), {'foo': 42, 'shops': [1, 3]}),  # Combine custom attrs
             (dict(bar="foo"), {'bar': "foo"}),  # Missing initial payload
             (dict(bar={"foo": 3}), {'bar': {"foo": 3}}),  # Missing initial payload
+            (dict(payload=pack({'foo': 42}), bar=1), {'foo': 42, 'bar': 1}),  # Compressed
         ]
 
         for test, expected in TESTS:
-            self.assertEqual(self.manager.construct_payload_for_task(**test), json.dumps(expected))
+            self.assertEqual(self.manager.construct_payload_for_task(**test), expected)
 
 
     def test_get_average_labourer_duration__calls_dynamo_twice(self):
@@ -501,6 +1150,170 @@ class task_manager_UnitTestCase(unittest.TestCase):
         self.assertEqual(expected, self.manager.get_average_labourer_duration(some_labourer))
 
 
+    def test_record_task_duration(self):
+        self.manager.config['labourer_stats_table'] = 'autotest_sosw_labourer_stats'
+        self.manager.dynamo_db_client.update.return_value = {'labourer_id': 'some_function', 'duration_count': 1}
+        delta = self.manager.config['greenfield_invocation_delta']
+
+        self.manager.record_task_duration({'task_id': '123', 'labourer_id': 'some_function',
+                                           'greenfield': 10000 + delta, 'completed_at': 10500})
+
+        call_args, call_kwargs = self.manager.dynamo_db_client.update.call_args
+        self.assertEqual(call_args[0], {'labourer_id': 'some_function'})
+        self.assertEqual(call_kwargs['table_name'], 'autotest_sosw_labourer_stats')
+
+        increments = call_kwargs['attributes_to_increment']
+        self.assertEqual(increments.pop('duration_count'), 1)
+        self.assertEqual(increments.pop('duration_sum'), 500)
+        self.assertEqual(list(increments.values()), [1])
+        self.assertEqual(call_kwargs['return_values'], 'ALL_NEW')
+        self.manager.dynamo_db_client.update.assert_called_once()
+
+
+    def test_record_task_duration__failed_task(self):
+        self.manager.config['labourer_stats_table'] = 'autotest_sosw_labourer_stats'
+        self.manager.dynamo_db_client.update.return_value = {}
+
+        self.manager.record_task_duration({'task_id': '123', 'labourer_id': 'some_function', 'attempts': 3,
+                                           'greenfield': 10000})
+
+        increments = self.manager.dynamo_db_client.update.call_args[1]['attributes_to_increment']
+        self.assertEqual(increments['duration_count'], 3)
+        self.assertEqual(increments['duration_sum'], 3 * 900)
+
+
+    def test_archive_task__records_duration(self):
+        self.manager.config['labourer_stats_table'] = 'autotest_sosw_labourer_stats'
+        task = {'task_id': '123', 'labourer_id': 'some_function', 'greenfield': 1000, 'completed_at': 1000}
+        self.manager.get_task_by_id = Mock(return_value=task)
+        self.manager.record_task_durations = Mock(side_effect=RuntimeError("Boom"))
+
+        self.manager.archive_task('123')
+
+        self.manager.record_task_durations.assert_called_once_with([task])
+        self.manager.dynamo_db_client.transact_write.assert_called_once()
+
+
+    def test_archive_tasks__records_durations_per_labourer(self):
+        self.manager.config['labourer_stats_table'] = 'autotest_sosw_labourer_stats'
+        self.manager.dynamo_db_client = MagicMock()
+        self.manager.dynamo_db_client.update.return_value = {'duration_count': 3}
+        delta = self.manager.config['greenfield_invocation_delta']
+
+        tasks = [{'task_id': str(i), 'labourer_id': 'some_function', 'greenfield': 10000 + delta,
+                  'completed_at': 10000 + 100 * i} for i in range(1, 4)]
+        tasks.append({'task_id': '4', 'labourer_id': 'some_lambda', 'attempts': 2, 'greenfield': 10000})
+
+        self.manager.archive_tasks(tasks)
+
+        # A single increment per Labourer, not per task.
+        self.assertEqual(self.manager.dynamo_db_client.update.call_count, 2)
+        increments = {call[0][0]['labourer_id']: call[1]['attributes_to_increment']
+                      for call in self.manager.dynamo_db_client.update.call_args_list}
+
+        self.assertEqual(increments['some_function']['duration_count'], 3)
+        self.assertEqual(increments['some_function']['duration_sum'], 100 + 200 + 300)
+        self.assertEqual(sum(v for k, v in increments['some_function'].items() if k.startswith('duration_b')), 3)
+        self.assertEqual(increments['some_lambda']['duration_count'], 2)
+
+
+    def test_get_labourer_duration_stats(self):
+        self.manager.config['labourer_stats_table'] = 'autotest_sosw_labourer_stats'
+
+        from sosw.components.benchmark import LatencyHistogram
+        from sosw.managers.task import DURATION_HISTOGRAM_SETTINGS
+        histogram = LatencyHistogram(**DURATION_HISTOGRAM_SETTINGS)
+
+        durations = [100] * 10 + [600] * 9 + [900]
+        item = {'labourer_id': 'some_function', 'duration_count': len(durations), 'duration_sum': sum(durations)}
+        for x in durations:
+            key = f"duration_b{histogram.get_bucket(x)}"
+            item[key] = item.get(key, 0) + 1
+
+        self.manager.dynamo_db_client.get_item.return_value = item
+
+        result = self.manager.get_labourer_duration_stats(self.LABOURER)
+
+        self.assertEqual(result['count'], 20)
+        self.assertEqual(result['average'], sum(durations) / 20)
+        self.assertAlmostEqual(result['p50'], 100, delta=10)
+        self.assertAlmostEqual(result['p95'], 600, delta=60)
+        self.manager.dynamo_db_client.update.assert_not_called()
+
+
+    def test_get_labourer_duration_stats__no_data(self):
+        self.manager.config['labourer_stats_table'] = 'autotest_sosw_labourer_stats'
+        self.manager.dynamo_db_client.get_item.return_value = {}
+
+        self.assertIsNone(self.manager.get_labourer_duration_stats(self.LABOURER))
+
+
+    def test_get_labourer_duration_stats__does_not_write(self):
+        self.manager.config['labourer_stats_table'] = 'autotest_sosw_labourer_stats'
+        self.manager.config['labourer_stats_decay_after'] = 10
+        self.manager.dynamo_db_client.get_item.return_value = {
+            'labourer_id': 'some_function', 'duration_count': 100, 'duration_sum': 10000, 'duration_b49': 100,
+        }
+
+        self.manager.get_labourer_duration_stats(self.LABOURER)
+
+        self.manager.dynamo_db_client.update.assert_not_called()
+
+
+    def test_get_labourer_duration_stats__fractional_counts(self):
+        self.manager.config['labourer_stats_table'] = 'autotest_sosw_labourer_stats'
+
+        # Rows decayed by earlier versions may have fractional counters.
+        self.manager.dynamo_db_client.get_item.return_value = {
+            'labourer_id': 'some_function', 'duration_count': 0.5, 'duration_sum': 50, 'duration_b49': 0.1,
+            'duration_b50': 0.39999999,
+        }
+
+        result = self.manager.get_labourer_duration_stats(self.LABOURER)
+
+        self.assertIsNotNone(result['p50'])
+        self.assertIsNotNone(result['p95'])
+        self.assertGreater(result['p95'], 0)
+
+
+    def test_record_task_duration__decay(self):
+        self.manager.config['labourer_stats_table'] = 'autotest_sosw_labourer_stats'
+        self.manager.config['labourer_stats_decay_after'] = 10
+        self.manager.dynamo_db_client.update.side_effect = [
+            {'labourer_id': 'some_function', 'duration_count': 10, 'duration_sum': 1000, 'duration_b49': 10,
+             'duration_epoch': 'abc'},
+            None,
+        ]
+
+        self.manager.record_task_duration({'task_id': '123', 'labourer_id': 'some_function',
+                                           'greenfield': 10000, 'completed_at': 10100})
+
+        self.assertEqual(self.manager.dynamo_db_client.update.call_count, 2)
+        call_kwargs = self.manager.dynamo_db_client.update.call_args[1]
+        self.assertEqual(call_kwargs['attributes_to_increment'],
+                         {'duration_count': -5, 'duration_sum': -500, 'duration_b49': -5})
+        self.assertEqual(call_kwargs['condition_expression'], 'duration_epoch = abc')
+        self.assertNotEqual(call_kwargs['attributes_to_update']['duration_epoch'], 'abc')
+
+
+    def test_record_task_duration__decay_keeps_whole_counters(self):
+        self.manager.config['labourer_stats_table'] = 'autotest_sosw_labourer_stats'
+        self.manager.config['labourer_stats_decay_after'] = 10
+        self.manager.dynamo_db_client.update.side_effect = [
+            {'labourer_id': 'some_function', 'duration_count': 11, 'duration_sum': 1101, 'duration_b49': 1,
+             'duration_b50': 10, 'duration_epoch': 'abc'},
+            None,
+        ]
+
+        self.manager.record_task_duration({'task_id': '123', 'labourer_id': 'some_function',
+                                           'greenfield': 10000, 'completed_at': 10100})
+
+        call_kwargs = self.manager.dynamo_db_client.update.call_args[1]
+        self.assertEqual(call_kwargs['attributes_to_increment'],
+                         {'duration_count': -5, 'duration_sum': -550, 'duration_b49': 0, 'duration_b50': -5})
+        self.assertTrue(all(isinstance(v, int) for v in call_kwargs['attributes_to_increment'].values()))
+
+
     def test_validate_task__good(self):
         TESTS = [
             ({'task_id': '235', 'labourer_id': 'foo', 'created_at': 5000, 'greenfield': 1000}, True),
@@ -56,6 +56,10 @@ class Orchestrator(Processor):
         Invokes required queued tasks for `labourer`.
         """
 
+        # The counters of running tasks are answered from the snapshot of the Labourer. The queue is not included:
+        # the full next tasks are fetched from it with a single query anyway.
+        self.task_client.snapshot_labourer(labourer, queued=False)
+
         number_of_tasks = self.get_desired_invocation_number_for_labourer(labourer=labourer)
 
         if number_of_tasks < 1:
@@ -83,11 +87,7 @@ class Orchestrator(Processor):
 
         coefficient = next(v for k, v in self.config['invocation_number_coefficient'].items() if labourer_status == k)
 
-        labourer_max = labourer.get_attr('max_simultaneous_invocations')
-
-        max_invocations = labourer_max if labourer_max is not None else self.config['max_simultaneous_invocations']
-
-        desired = int(math.floor(max_invocations * coefficient))
+        desired = int(math.floor(self.get_max_invocations_for_labourer(labourer) * coefficient))
         currently_running = self.task_client.ecology_client.count_running_tasks_for_labourer(labourer)
 
         logger.info(f"Labourer: {labourer.id} has currently running {currently_running} tasks and desired {desired} "
@@ -95,6 +95,13 @@ class Orchestrator(Processor):
         return max(desired - currently_running, 0)
 
 
+    def get_max_invocations_for_labourer(self, labourer: Labourer) -> int:
+        """ Maximum number of simultaneous invocations of `labourer` from its attributes or the config. """
+
+        labourer_max = labourer.get_attr('max_simultaneous_invocations')
+        return labourer_max if labourer_max is not None else self.config['max_simultaneous_invocations']
+
+
     def get_labourers(self) -> List[Labourer]:
         """
         Gets a list of pre-configured Labourers from TaskManager.
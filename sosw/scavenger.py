@@ -39,6 +39,9 @@ class Scavenger(Processor):
         labourers = self.task_client.register_labourers()
 
         for labourer in labourers:
+            # Read the state of invoked tasks once. The queue itself is not required here.
+            self.task_client.snapshot_labourer(labourer, queued=False)
+
             self.archive_tasks(labourer)
             self.handle_expired_tasks(labourer)
             self.retry_tasks(labourer)
@@ -48,6 +51,7 @@ class Scavenger(Processor):
         logger.debug(f"Called Scavenger.handle_expired_tasks with labourer={labourer}")
         expired_tasks = self.task_client.get_expired_tasks_for_labourer(labourer)
         logger.debug(f"expired_tasks: {expired_tasks}")
+
         for task in expired_tasks:
             self.process_expired_task(labourer, task)
 
@@ -111,10 +115,11 @@ class Scavenger(Processor):
         logger.debug(f"Running Scavenger.archive_tasks for {labourer.id}")
 
         tasks = self.task_client.get_completed_tasks_for_labourer(labourer)
+        if not tasks:
+            return
 
-        for task in tasks:
-            logger.info(f"Archiving completed_task: {task}")
-            self.task_client.archive_task(task[_('task_id')])
+        logger.info(f"Archiving {len(tasks)} completed tasks: {[task[_('task_id')] for task in tasks]}")
+        self.task_client.archive_tasks(tasks)
 
 
     def get_db_field_name(self, key: str) -> str:
@@ -489,20 +489,19 @@ class Scheduler(Processor):
                 if not data:
                     break
 
+                # Group tasks by Labourer preserving the order, to create them in bulk.
+                tasks_by_labourer = OrderedDict()
                 for task in data:
                     logger.info(task)
                     t = json.loads(task)
-                    labourer = self.task_client.get_labourer(t['labourer_id'])
-                    self.task_client.create_task(labourer=labourer, **t)
-                    time.sleep(self._sleeptime_for_dynamo)
-
-            self.upload_and_unlock_queue_file()
+                    tasks_by_labourer.setdefault(t['labourer_id'], []).append(t)
 
+                for labourer_id, tasks in tasks_by_labourer.items():
+                    labourer = self.task_client.get_labourer(labourer_id)
+                    # The pace of writes is controlled by `rate_limits` of the DynamoDbClient of TaskManager.
+                    self.task_client.create_tasks(labourer=labourer, tasks=tasks)
 
-    @property
-    def _sleeptime_for_dynamo(self):
-        # TODO Should use incremental sleeps based on Throttling. Probably interact with EcologyManager.
-        return 0.2
+            self.upload_and_unlock_queue_file()
 
 
     @staticmethod
@@ -8,9 +8,14 @@ from .unit.test_scavenger import Scavenger_UnitTestCase
 from .unit.test_scheduler import Scheduler_UnitTestCase
 
 # Components
+from ..components.test.unit.test_boto3_clients import boto3_clients_UnitTestCase
+from ..components.test.unit.test_cache import TTLCache_UnitTestCase
+from ..components.test.unit.test_claim_check import claim_check_UnitTestCase
+from ..components.test.unit.test_compression import compression_UnitTestCase
 from ..components.test.unit.test_config import Config_UnitTestCase
 from ..components.test.unit.test_dynamo_db import dynamodb_client_UnitTestCase
 from ..components.test.unit.test_helpers import helpers_UnitTestCase
+from ..components.test.unit.test_rate_limiter import TokenBucket_UnitTestCase
 from ..components.test.test_siblings import siblings_TestCase
 from ..components.test.test_sns import sns_TestCase
 
@@ -29,9 +34,14 @@ def suite():
     test_suite.addTest(unittest.makeSuite(Scheduler_UnitTestCase))
 
     # Components
+    test_suite.addTest(unittest.makeSuite(boto3_clients_UnitTestCase))
+    test_suite.addTest(unittest.makeSuite(TTLCache_UnitTestCase))
+    test_suite.addTest(unittest.makeSuite(claim_check_UnitTestCase))
+    test_suite.addTest(unittest.makeSuite(compression_UnitTestCase))
     test_suite.addTest(unittest.makeSuite(Config_UnitTestCase))
     test_suite.addTest(unittest.makeSuite(dynamodb_client_UnitTestCase))
     test_suite.addTest(unittest.makeSuite(helpers_UnitTestCase))
+    test_suite.addTest(unittest.makeSuite(TokenBucket_UnitTestCase))
     test_suite.addTest(unittest.makeSuite(siblings_TestCase))
     test_suite.addTest(unittest.makeSuite(sns_TestCase))
 
@@ -6,6 +6,7 @@ from unittest import mock
 from unittest.mock import MagicMock
 
 from sosw.app import Processor
+from sosw.components.boto3_clients import reset_boto3_clients
 from sosw.components.sns import SnsManager
 from sosw.components.siblings import SiblingsManager
 
@@ -19,10 +20,13 @@ class app_UnitTestCase(unittest.TestCase):
 
 
     def setUp(self):
-        pass
+        reset_boto3_clients()
 
 
     def tearDown(self):
+        Processor.clear_instances()
+        reset_boto3_clients()
+
         try:
             del (os.environ['AWS_LAMBDA_FUNCTION_NAME'])
         except:
@@ -72,7 +76,144 @@ class app_UnitTestCase(unittest.TestCase):
             'init_clients': ['NotExists']
         }
         Processor(custom_config=custom_config)
-        mock_boto_client.assert_called_with('not_exists')
+        self.assertEqual(mock_boto_client.call_args[0], ('not_exists',))
+
+
+    @mock.patch("boto3.client")
+    def test_app_init__lazy_clients(self, mock_boto_client):
+
+        class LazyProcessor(Processor):
+            sns_client = None
+
+        custom_config = {
+            'init_clients': ['Sns', 'dynamodb'],
+            'lazy_clients': True,
+        }
+
+        processor = LazyProcessor(custom_config=custom_config)
+        self.assertNotIn('sns_client', processor.__dict__)
+        self.assertNotIn('dynamodb_client', processor.__dict__)
+        processor.get_stats()
+        self.assertNotIn('sns_client', processor.__dict__)
+        mock_boto_client.assert_not_called()
+
+        self.assertIsInstance(processor.sns_client, SnsManager)
+        self.assertIs(processor.sns_client, processor.sns_client)
+        mock_boto_client.assert_not_called()
+
+        self.assertIs(processor.dynamodb_client, mock_boto_client.return_value)
+        self.assertEqual(mock_boto_client.call_args[0], ('dynamodb',))
+
+        # Other instances are not affected.
+        self.assertIsNone(LazyProcessor(custom_config=self.TEST_CONFIG).sns_client)
+
+
+    @mock.patch("boto3.client")
+    def test_register_clients__not_lazy_does_not_modify_class(self, mock_boto_client):
+
+        class SomeProcessor(Processor):
+            sns_client = None
+
+        before = dict(vars(SomeProcessor))
+        processor = SomeProcessor(custom_config={'init_clients': ['Sns']})
+
+        self.assertEqual(dict(vars(SomeProcessor)), before)
+        self.assertIsNone(vars(SomeProcessor)['sns_client'])
+        self.assertIsInstance(processor.sns_client, SnsManager)
+        self.assertRaises(AttributeError, getattr, processor, 'dynamodb_client')
+
+
+    @mock.patch("boto3.client")
+    def test_register_clients__lazy_without_class_attribute(self, mock_boto_client):
+
+        class LazyProcessor(Processor):
+            pass
+
+        processor = LazyProcessor(custom_config={'init_clients': ['Sns'], 'lazy_clients': True})
+
+        self.assertNotIn('sns_client', processor.__dict__)
+        self.assertIsInstance(processor.sns_client, SnsManager)
+        self.assertIsNone(LazyProcessor(custom_config=self.TEST_CONFIG).sns_client)
+        self.assertFalse(hasattr(Processor, 'sns_client'))
+
+
+    @mock.patch("boto3.client")
+    def test_register_clients__lazy_argument_overrides_config(self, mock_boto_client):
+        processor = Processor(custom_config={'lazy_clients': True})
+        processor.register_clients(['Sns'], lazy=False)
+
+        self.assertIsInstance(processor.__dict__['sns_client'], SnsManager)
+
+
+    @mock.patch("boto3.client")
+    def test_register_clients__caches_resolved_classes(self, mock_boto_client):
+        Processor(custom_config={'init_clients': ['Siblings']})
+
+        with mock.patch("sosw.app.import_module") as mock_import_module:
+            processor = Processor(custom_config={'init_clients': ['Siblings']})
+
+        mock_import_module.assert_not_called()
+        self.assertIsInstance(processor.siblings_client, SiblingsManager)
+
+
+    @mock.patch("sosw.app.get_config")
+    def test_get_instance__reused(self, mock_get_config):
+        mock_get_config.return_value = {}
+
+        processor = Processor.get_instance(custom_config=self.TEST_CONFIG)
+        processor.stats['some_counter'] += 5
+
+        with mock.patch.object(Processor, 'refresh') as mock_refresh:
+            self.assertIs(Processor.get_instance(custom_config=dict(self.TEST_CONFIG)), processor)
+            mock_refresh.assert_called_once_with()
+
+        mock_get_config.assert_called_once()
+        self.assertEqual(processor.stats['some_counter'], 0)
+        self.assertEqual(processor.stats['total_some_counter'], 5)
+        self.assertEqual(processor.stats['processor_reused'], 1)
+
+
+    @mock.patch("sosw.app.get_config")
+    def test_get_instance__different_configs(self, mock_get_config):
+        mock_get_config.return_value = {}
+
+        processor = Processor.get_instance(custom_config=self.TEST_CONFIG)
+
+        self.assertIsNot(Processor.get_instance(custom_config={'test': True, 'other': 1}), processor)
+
+
+    @mock.patch("sosw.app.get_config")
+    def test_get_instance__different_classes(self, mock_get_config):
+        mock_get_config.return_value = {}
+
+        class OtherProcessor(Processor):
+            pass
+
+        processor = Processor.get_instance(custom_config=self.TEST_CONFIG)
+        other = OtherProcessor.get_instance(custom_config=self.TEST_CONFIG)
+
+        self.assertIsInstance(other, OtherProcessor)
+        self.assertIsNot(other, processor)
+
+
+    @mock.patch("time.monotonic")
+    @mock.patch("sosw.app.get_config")
+    def test_get_instance__config_ttl(self, mock_get_config, mock_monotonic):
+        mock_get_config.return_value = {}
+        mock_monotonic.return_value = 1000
+
+        custom_config = {'test': True, 'config_ttl': 60}
+        processor = Processor.get_instance(custom_config=custom_config)
+
+        mock_monotonic.return_value = 1060
+        self.assertIs(Processor.get_instance(custom_config=custom_config), processor)
+
+        mock_monotonic.return_value = 1061
+        new_processor = Processor.get_instance(custom_config=custom_config)
+
+        self.assertIsNot(new_processor, processor)
+        self.assertIs(Processor.get_instance(custom_config=custom_config), new_processor)
+        self.assertEqual(mock_get_config.call_count, 2)
 
 
     @mock.patch("sosw.app.get_config")
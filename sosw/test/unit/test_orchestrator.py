@@ -9,6 +9,7 @@ from unittest.mock import MagicMock, patch
 from sosw.orchestrator import Orchestrator
 from sosw.labourer import Labourer
 from sosw.test.variables import TEST_ORCHESTRATOR_CONFIG
+from sosw.components.boto3_clients import reset_boto3_clients
 
 
 os.environ["STAGE"] = "test"
@@ -25,6 +26,7 @@ class Orchestrator_UnitTestCase(unittest.TestCase):
         self.get_config_patch = self.patcher.start()
 
         self.custom_config = deepcopy(self.TEST_CONFIG)
+        reset_boto3_clients()
         with patch('boto3.client'):
             self.orchestrator = Orchestrator(self.custom_config)
 
@@ -33,6 +35,7 @@ class Orchestrator_UnitTestCase(unittest.TestCase):
 
     def tearDown(self):
         self.patcher.stop()
+        reset_boto3_clients()
 
         try:
             del (os.environ['AWS_LAMBDA_FUNCTION_NAME'])
@@ -75,6 +78,7 @@ class Orchestrator_UnitTestCase(unittest.TestCase):
 
         some_labourer = self.orchestrator.task_client.register_labourers()[0]
 
+        reset_boto3_clients()
         with patch('boto3.client'):
             orchestrator = Orchestrator(self.custom_config)
 
@@ -125,9 +129,37 @@ class Orchestrator_UnitTestCase(unittest.TestCase):
 
 
     def test_invoke_for_labourer__desired_zero(self):
+        some_labourer = self.orchestrator.task_client.register_labourers()[0]
         self.orchestrator.get_desired_invocation_number_for_labourer = MagicMock(return_value=0)
         self.orchestrator.task_client.invoke_task = MagicMock()
 
-        self.orchestrator.invoke_for_labourer(self.LABOURER)
+        self.orchestrator.invoke_for_labourer(some_labourer)
+
+        self.orchestrator.task_client.invoke_task.assert_not_called()
+
+
+    def test_invoke_for_labourer__uses_snapshot(self):
+        task_client = self.orchestrator.task_client
+        some_labourer = task_client.register_labourers()[0]
+        task_client.ecology_client.running_tasks.clear()
+        task_client.invoke_task = MagicMock()
+
+        dynamo = task_client.dynamo_db_client = MagicMock()
+        queue = [{'task_id': f"q{i}", 'greenfield': 1000 * i} for i in range(1, 4)]
+        running = [{'task_id': 'r1', 'greenfield': some_labourer.get_attr('invoked')}]
+        dynamo.get_by_query_generator.side_effect = \
+            lambda keys, comparisons, max_items=None, **kw: iter(queue if comparisons['greenfield'] == '<' else running)
+        dynamo.get_by_query.side_effect = lambda keys, max_items=None, **kw: queue[:max_items]
+
+        self.orchestrator.invoke_for_labourer(some_labourer)
+
+        # The snapshot reads only the invoked tasks. The queue is not read separately from the next tasks.
+        self.assertEqual(dynamo.get_by_query_generator.call_args[1]['comparisons'], {'greenfield': '>='})
+
+        # The running tasks are counted from the snapshot, not with separate queries.
+        self.assertEqual(task_client.ecology_client.count_running_tasks_for_labourer(some_labourer), 1)
+        self.assertEqual(dynamo.get_by_query_generator.call_count, 1)
 
-        self.orchestrator.task_client.invoke_task.assert_not_called()
\ No newline at end of file
+        # The full next tasks are fetched with a single query. Two queries in total for the Labourer.
+        dynamo.get_by_query.assert_called_once()
+        self.assertEqual(dynamo.get_by_query.call_count + dynamo.get_by_query_generator.call_count, 2)
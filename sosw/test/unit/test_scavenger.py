@@ -7,6 +7,7 @@ from unittest.mock import Mock, MagicMock, patch, call
 from sosw.scavenger import Scavenger
 from sosw.labourer import Labourer
 from sosw.test.variables import TEST_SCAVENGER_CONFIG, TASKS, LABOURERS
+from sosw.components.boto3_clients import reset_boto3_clients
 
 
 os.environ["STAGE"] = "test"
@@ -22,6 +23,7 @@ class Scavenger_UnitTestCase(unittest.TestCase):
         self.get_config_patch = self.patcher.start()
 
         self.custom_config = self.TEST_CONFIG.copy()
+        reset_boto3_clients()
         with patch('boto3.client'):
             self.scavenger = Scavenger(self.custom_config)
 
@@ -42,6 +44,7 @@ class Scavenger_UnitTestCase(unittest.TestCase):
 
     def tearDown(self):
         self.patcher.stop()
+        reset_boto3_clients()
 
         try:
             del (os.environ['AWS_LAMBDA_FUNCTION_NAME'])
@@ -115,6 +118,24 @@ class Scavenger_UnitTestCase(unittest.TestCase):
         self.scavenger.task_client.archive_task.assert_not_called()
 
 
+    def test_archive_tasks(self):
+        tasks = [self.task, {**self.task, 'task_id': '124'}]
+        self.scavenger.task_client.get_completed_tasks_for_labourer.return_value = tasks
+
+        self.scavenger.archive_tasks(self.labourer)
+
+        self.scavenger.task_client.archive_tasks.assert_called_once_with(tasks)
+        self.scavenger.task_client.archive_task.assert_not_called()
+
+
+    def test_archive_tasks__nothing_completed(self):
+        self.scavenger.task_client.get_completed_tasks_for_labourer.return_value = []
+
+        self.scavenger.archive_tasks(self.labourer)
+
+        self.scavenger.task_client.archive_tasks.assert_not_called()
+
+
     def test_calculate_delay_for_task_retry(self):
         _ = self.scavenger.get_db_field_name
         labourer = Labourer(id='some_lambda', arn='some_arn', max_duration=45)
@@ -13,12 +13,13 @@ from copy import deepcopy
 from pathlib import Path
 import pprint
 from unittest import mock
-from unittest.mock import MagicMock, PropertyMock, patch
+from unittest.mock import MagicMock, patch
 
 from sosw.scheduler import Scheduler, InvalidJob
 from sosw.labourer import Labourer
 from sosw.test.variables import TEST_SCHEDULER_CONFIG
 from sosw.test.helpers_test import line_count
+from sosw.components.boto3_clients import reset_boto3_clients
 
 
 os.environ["STAGE"] = "test"
@@ -72,6 +73,7 @@ class Scheduler_UnitTestCase(unittest.TestCase):
 
         self.custom_config = deepcopy(self.TEST_CONFIG)
 
+        reset_boto3_clients()
         with patch('boto3.client'):
             self.scheduler = Scheduler(self.custom_config)
 
@@ -85,6 +87,7 @@ class Scheduler_UnitTestCase(unittest.TestCase):
 
     def tearDown(self):
         self.patcher.stop()
+        reset_boto3_clients()
 
         try:
             del (os.environ['AWS_LAMBDA_FUNCTION_NAME'])
@@ -116,6 +119,7 @@ class Scheduler_UnitTestCase(unittest.TestCase):
         config = self.custom_config
         config['job_schema']['chunkable_attrs'] = [('bad_name_ending_with_s', {})]
 
+        reset_boto3_clients()
         with patch('boto3.client'):
             self.assertRaises(AssertionError, Scheduler, custom_config=config)
 
@@ -199,13 +203,13 @@ class Scheduler_UnitTestCase(unittest.TestCase):
         self.scheduler.upload_and_unlock_queue_file = MagicMock()
         self.scheduler.task_client = MagicMock()
 
-        with patch('sosw.scheduler.Scheduler._sleeptime_for_dynamo', new_callable=PropertyMock) as mock_sleeptime:
-            mock_sleeptime.return_value = 0.0001
-
+        with patch('time.sleep') as mock_sleep:
             self.scheduler.process_file()
 
-            self.assertEqual(self.scheduler.task_client.create_task.call_count, 10)
-            self.assertEqual(mock_sleeptime.call_count, 10)
+            # All the rows of the file belong to the same Labourer and fit into a single bulk creation.
+            self.scheduler.task_client.create_tasks.assert_called_once()
+            self.assertEqual(len(self.scheduler.task_client.create_tasks.call_args[1]['tasks']), 10)
+            mock_sleep.assert_not_called()
 
             self.scheduler.upload_and_unlock_queue_file.assert_called_once()
 
@@ -666,7 +670,7 @@ class Scheduler_UnitTestCase(unittest.TestCase):
         r = self.scheduler(json.dumps(SAMPLE_SIMPLE_JOB))
         print(r)
 
-        self.scheduler.task_client.create_task.assert_called_once()
+        self.scheduler.task_client.create_tasks.assert_called_once()
 
         self.scheduler.s3_client.download_file.assert_not_called()
         self.scheduler.s3_client.copy_object.assert_not_called()